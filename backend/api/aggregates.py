@@ -0,0 +1,211 @@
+"""
+Running aggregates over finished gameplay, served at /api/stats/.
+
+Sessions are deleted once completed, so outcomes are folded into a handful of
+counters as they happen instead of being recomputed from session data:
+
+- attempts and successes per challenge id (updated by every verify)
+- a histogram of verdicts
+- a histogram of final confidence levels (101 exact bins, 0-100)
+
+Every update is a couple of dict increments. All aggregates are plain sums, so
+they merge across workers by addition: each worker accumulates a delta and a
+background thread periodically adds it to the shared api_aggregate table in
+db.sqlite3 (value = value + delta), then resets it. /api/stats/ reports the
+table plus this worker's not yet checkpointed delta; other workers' deltas show
+up after their next checkpoint. Checkpointing is off by default, and then each
+worker only reports what it has seen since it started.
+
+Configured via THISYOU_STATS in settings.
+"""
+import atexit
+import os
+import sqlite3
+import threading
+
+from django.conf import settings
+
+
+DEFAULTS = {
+    # Whether to checkpoint to the database; without it stats are per process
+    # and nothing is written to disk
+    'CHECKPOINT': False,
+    # Database file for checkpoints; None means the project's default database
+    'DATABASE': None,
+    # Seconds between checkpoints
+    'CHECKPOINT_INTERVAL': 30,
+}
+
+TABLE = 'api_aggregate'
+ATTEMPTS = 'attempts'
+SUCCESSES = 'successes'
+VERDICTS = 'verdict'
+CONFIDENCE = 'confidence'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THISYOU_STATS', {})}
+
+
+class Aggregates:
+    """Additive counters keyed by (metric, key)"""
+
+    def __init__(self, path=None, checkpoint_interval=30):
+        self.path = str(path) if path else None
+        self.checkpoint_interval = checkpoint_interval
+        self._delta = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._thread_pid = None
+        self.checkpoints = 0
+
+    def _add(self, metric, key, amount=1):
+        # Called with the lock held
+        self._delta[metric, key] = self._delta.get((metric, key), 0) + amount
+
+    def record_attempt(self, challenge_id, success):
+        self._ensure_checkpointer()
+        with self._lock:
+            self._add(ATTEMPTS, challenge_id)
+            if success:
+                self._add(SUCCESSES, challenge_id)
+
+    def record_verdict(self, verdict, confidence):
+        self._ensure_checkpointer()
+        with self._lock:
+            self._add(VERDICTS, verdict)
+            self._add(CONFIDENCE, str(max(0, min(100, int(confidence)))))
+
+    def _connection(self):
+        # Called with the db lock held
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {TABLE} ('
+                'metric TEXT NOT NULL, '
+                'key TEXT NOT NULL, '
+                'value INTEGER NOT NULL, '
+                'PRIMARY KEY (metric, key))'
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def checkpoint(self):
+        """Add the pending delta to the database and reset it"""
+        if self.path is None:
+            return
+        with self._lock:
+            delta, self._delta = self._delta, {}
+        if not delta:
+            return
+        try:
+            with self._db_lock:
+                conn = self._connection()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.executemany(
+                        f'INSERT INTO {TABLE} (metric, key, value) VALUES (?, ?, ?) '
+                        'ON CONFLICT(metric, key) DO UPDATE SET value = value + excluded.value',
+                        [(metric, key, value) for (metric, key), value in delta.items()],
+                    )
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+            self.checkpoints += 1
+        except sqlite3.Error:
+            # Keep the counts for the next attempt
+            with self._lock:
+                for (metric, key), value in delta.items():
+                    self._add(metric, key, value)
+
+    def _checkpoint_loop(self):
+        while not self._stop.wait(self.checkpoint_interval):
+            self.checkpoint()
+
+    def _ensure_checkpointer(self):
+        # One background thread per process, started on first use (after any fork)
+        if self.path is None or self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._checkpoint_loop, name='aggregates-checkpoint', daemon=True).start()
+
+    def totals(self):
+        """Checkpointed totals plus this worker's pending delta"""
+        totals = {}
+        if self.path is not None:
+            with self._db_lock:
+                for metric, key, value in self._connection().execute(f'SELECT metric, key, value FROM {TABLE}'):
+                    totals[metric, key] = value
+        with self._lock:
+            for metric_key, value in self._delta.items():
+                totals[metric_key] = totals.get(metric_key, 0) + value
+        return totals
+
+    def summary(self):
+        """The /api/stats/ payload"""
+        totals = self.totals()
+        challenges = {}
+        verdicts = {}
+        confidence = [0] * 101
+        for (metric, key), value in totals.items():
+            if metric in (ATTEMPTS, SUCCESSES):
+                challenges.setdefault(key, {ATTEMPTS: 0, SUCCESSES: 0})[metric] = value
+            elif metric == VERDICTS:
+                verdicts[key] = value
+            elif metric == CONFIDENCE:
+                confidence[int(key)] = value
+        for counts in challenges.values():
+            counts['success_rate'] = round(counts[SUCCESSES] / counts[ATTEMPTS], 4) if counts[ATTEMPTS] else None
+
+        completed = sum(confidence)
+        return {
+            'sessions_completed': completed,
+            'verdicts': verdicts,
+            'challenges': dict(sorted(challenges.items())),
+            'confidence': {
+                # Ten bins of width 10; the last one also holds 100
+                'histogram': [sum(confidence[i:i + 10]) for i in range(0, 90, 10)] + [sum(confidence[90:])],
+                'mean': round(sum(level * count for level, count in enumerate(confidence)) / completed, 2) if completed else None,
+                'p50': _quantile(confidence, 0.5),
+                'p90': _quantile(confidence, 0.9),
+            },
+        }
+
+    def close(self):
+        self._stop.set()
+        self.checkpoint()
+
+
+def _quantile(histogram, q):
+    total = sum(histogram)
+    if not total:
+        return None
+    target = q * total
+    running = 0
+    for level, count in enumerate(histogram):
+        running += count
+        if running >= target:
+            return level
+    return len(histogram) - 1
+
+
+def _build():
+    config = get_config()
+    path = None
+    if config['CHECKPOINT']:
+        path = config['DATABASE'] or settings.DATABASES['default']['NAME']
+    aggregates = Aggregates(path, config['CHECKPOINT_INTERVAL'])
+    atexit.register(aggregates.close)
+    return aggregates
+
+
+aggregates = _build()
@@ -0,0 +1,289 @@
+"""
+Async versions of the session views, for the ASGI deployment (thisyou/asgi.py).
+
+DRF's @api_view is sync only, so under ASGI every request to api/views.py is
+handed to a thread via sync_to_async. These views run on the event loop
+instead: session store calls go through the async store interface, and heavy
+verifiers are awaited from the offload pool, so one worker can hold many slow
+clients without a thread each.
+
+Request and response bodies are the same as in api/views.py, which these views
+share their helpers with. api/urls.py routes to them when
+THISYOU_ASYNC_VIEWS is enabled. session_event_stream is async only, is
+always routed here and answers 501 when the request didn't come through ASGI.
+"""
+import functools
+import json
+import uuid
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+
+from . import session_tokens
+from .events import ChallengeJSONEncoder, session_events
+from .challenges import materialize_challenge, new_session
+from .session_locks import session_lock
+from .session_store import SessionConflict
+from .verifiers import averify_attempt
+from .views import (
+    CATALOG_VERSION,
+    STATELESS_SESSIONS,
+    claim_completion,
+    get_verdict,
+    log_attempts,
+    pack_session,
+    record_result,
+    record_verdict,
+    sessions,
+    unpack_session,
+)
+
+
+def api_response(data, status=200):
+    return JsonResponse(data, status=status, encoder=ChallengeJSONEncoder)
+
+
+def async_api_view(methods):
+    """
+    Minimal async stand-in for DRF's @api_view.
+
+    Checks the HTTP method, exempts the view from CSRF like @api_view does and
+    puts the parsed JSON (or form) body in request.data.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            if request.content_type == 'application/json' and request.body:
+                try:
+                    request.data = json.loads(request.body)
+                except ValueError:
+                    return api_response({'detail': 'JSON parse error'}, status=400)
+                if not isinstance(request.data, dict):
+                    return api_response({'detail': 'Expected a JSON object'}, status=400)
+            else:
+                request.data = request.POST
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+async def load_session(session_id, session_token=None):
+    """Async version of views.load_session()"""
+    if STATELESS_SESSIONS:
+        session_id, state = session_tokens.loads(session_token, session_id)
+        return session_id, unpack_session(state)
+    session = await sessions.aget(session_id) if session_id else None
+    return session_id, session
+
+
+async def save_session(session_id, session):
+    """Async version of views.save_session()"""
+    if STATELESS_SESSIONS:
+        return session_tokens.dumps(session_id, pack_session(session))
+    await sessions.asave(session_id, session)
+    return None
+
+
+async def finish_session(session_id, session):
+    """Async version of views.finish_session()"""
+    result = get_verdict(session)
+    record_verdict(session_id, session, result)
+    if not STATELESS_SESSIONS:
+        await sessions.adelete(session_id)
+    session_events.publish(session_id, 'complete', result, close=True)
+    return result
+
+
+@async_api_view(['POST'])
+async def start_session(request):
+    """Start a new verification session"""
+    session_id = str(uuid.uuid4())
+    user_info = request.data.get('user_info', {})
+    if not isinstance(user_info, dict):
+        return api_response({'error': 'user_info must be an object'}, status=400)
+
+    session = new_session(user_info)
+
+    compact = bool(request.data.get('compact'))
+    first_challenge = materialize_challenge(session, 0, compact) if session['sequence'] else None
+
+    data = {
+        'session_id': session_id,
+        'total_challenges': len(session['sequence']),
+        'first_challenge': first_challenge,
+        'catalog_version': CATALOG_VERSION,
+    }
+    if STATELESS_SESSIONS:
+        data['session_token'] = await save_session(session_id, session)
+    else:
+        await sessions.acreate(session_id, session)
+
+    return api_response(data)
+
+
+@async_api_view(['GET'])
+async def get_challenges(request):
+    """Get the current challenge for a session"""
+    try:
+        session_id, session = await load_session(request.GET.get('session_id'), request.GET.get('session_token'))
+    except session_tokens.InvalidSessionToken as e:
+        return api_response({'error': str(e)}, status=400)
+    if session is None:
+        return api_response({'error': 'Invalid session'}, status=400)
+
+    current_idx = session['current_challenge']
+
+    if current_idx >= len(session['sequence']):
+        return api_response({'error': 'All challenges completed'}, status=400)
+
+    compact = bool(request.GET.get('compact'))
+    challenge = materialize_challenge(session, current_idx, compact)
+
+    try:
+        session_token = await save_session(session_id, session)
+    except SessionConflict:
+        return api_response({'error': 'Session was updated by another request'}, status=409)
+
+    data = {
+        'challenge': challenge,
+        'challenge_number': current_idx + 1,
+        'total_challenges': len(session['sequence']),
+        'confidence_level': session['confidence_level'],
+        'catalog_version': CATALOG_VERSION,
+    }
+    if session_token:
+        data['session_token'] = session_token
+    return api_response(data)
+
+
+@async_api_view(['POST'])
+async def verify_challenge(request):
+    """Verify a challenge attempt, closing the session early with 'finalize' like views.verify_challenge"""
+    attempt_data = request.data.get('attempt_data', {})
+
+    async with session_lock.locked_async(request.data.get('session_id')):
+        try:
+            session_id, session = await load_session(request.data.get('session_id'), request.data.get('session_token'))
+        except session_tokens.InvalidSessionToken as e:
+            return api_response({'error': str(e)}, status=400)
+        if session is None:
+            return api_response({'error': 'Invalid session'}, status=400)
+
+        current_idx = session['current_challenge']
+
+        if current_idx >= len(session['sequence']):
+            return api_response({'error': 'All challenges completed'}, status=400)
+
+        challenge = materialize_challenge(session, current_idx)
+
+        challenge_id = request.data.get('challenge_id')
+        if challenge_id is not None and challenge_id != challenge['id']:
+            return api_response({'error': 'Challenge already answered'}, status=409)
+
+        # Spent after validation, like views.verify_challenge
+        if STATELESS_SESSIONS and not session_tokens.spent_tokens.consume((session_id, current_idx)):
+            return api_response({'error': 'Session token already used'}, status=409)
+
+        success, message, degraded = await averify_attempt(session, challenge, attempt_data)
+        attempt = record_result(session, challenge, success, message, degraded)
+
+        next_challenge = None
+        if session['current_challenge'] < len(session['sequence']):
+            next_challenge = materialize_challenge(session, session['current_challenge'], bool(request.data.get('compact')))
+
+        finalize = next_challenge is None and bool(request.data.get('finalize')) and claim_completion(session_id)
+        session_token = None
+        if not finalize:
+            try:
+                session_token = await save_session(session_id, session)
+            except SessionConflict:
+                return api_response({'error': 'Session was updated by another request'}, status=409)
+        log_attempts(session_id, session, [attempt])
+
+        data = {
+            'success': success,
+            'message': message,
+            'degraded': degraded,
+            'confidence_level': session['confidence_level'],
+            'next_challenge': next_challenge,
+            'challenge_number': session['current_challenge'] + 1 if next_challenge else None,
+            'total_challenges': len(session['sequence']),
+            'catalog_version': CATALOG_VERSION,
+        }
+        session_events.publish(session_id, 'result', {'challenge_id': challenge['id'], **data})
+        data['verdict'] = await finish_session(session_id, session) if finalize else None
+        if session_token:
+            data['session_token'] = session_token
+        return api_response(data)
+
+
+@async_api_view(['POST'])
+async def complete_session(request, session_id):
+    """Complete a session and get final verdict"""
+    try:
+        session_id, session = await load_session(session_id, request.data.get('session_token'))
+    except session_tokens.InvalidSessionToken as e:
+        return api_response({'error': str(e)}, status=400)
+    if session is None:
+        return api_response({'error': 'Invalid session'}, status=400)
+    if not claim_completion(session_id):
+        return api_response({'error': 'Session already completed'}, status=409)
+
+    return api_response(await finish_session(session_id, session))
+
+
+@async_api_view(['GET'])
+async def session_event_stream(request, session_id):
+    """
+    Server-sent events for a session.
+
+    A fresh connection starts with a 'state' event (the get_challenges payload,
+    with a null challenge once all are answered). Reconnects resume after
+    Last-Event-ID; then come 'result' events after each verified attempt and a
+    final 'complete' event with the verdict.
+
+    Only served under ASGI. A WSGI server would buffer the whole stream and
+    hold a worker until the session ends, so there the answer is 501.
+    """
+    if not isinstance(request, ASGIRequest):
+        return api_response({'error': 'Event streams need the ASGI server (thisyou/asgi.py)'}, status=501)
+    try:
+        session_id, session = await load_session(session_id, request.GET.get('session_token'))
+    except session_tokens.InvalidSessionToken as e:
+        return api_response({'error': str(e)}, status=400)
+    if session is None:
+        return api_response({'error': 'Invalid session'}, status=400)
+
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+        snapshot = None
+    except (TypeError, ValueError):
+        last_id = session_events.last_id(session_id)
+        current_idx = session['current_challenge']
+        challenge = None
+        if current_idx < len(session['sequence']):
+            challenge = materialize_challenge(session, current_idx, bool(request.GET.get('compact')))
+            # Picking the lyric may have changed the session
+            if not STATELESS_SESSIONS:
+                try:
+                    await sessions.asave(session_id, session)
+                except SessionConflict:
+                    pass
+        snapshot = {
+            'challenge': challenge,
+            'challenge_number': current_idx + 1 if challenge else None,
+            'total_challenges': len(session['sequence']),
+            'confidence_level': session['confidence_level'],
+            'catalog_version': CATALOG_VERSION,
+        }
+
+    # Stateless sessions aren't stored anywhere; their streams end on IDLE_TTL
+    alive = None if STATELESS_SESSIONS else functools.partial(sessions.acontains, session_id)
+    response = StreamingHttpResponse(session_events.stream(session_id, last_id, snapshot, alive), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
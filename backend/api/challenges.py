@@ -0,0 +1,332 @@
+"""
+Challenge templates and per-session challenge materialization.
+
+The challenge definitions below are frozen at import time (read-only mappings
+and tuples) and shared by every session. A session never copies or mutates
+them: it only stores the indices of its challenges plus a small
+ChallengeOverrides record for the per-session bits (which lyric was picked),
+and materialize_challenge() merges the two into a fresh dict when a challenge
+is sent to the client or verified.
+"""
+import random
+import time
+from datetime import datetime
+from types import MappingProxyType
+
+from .lyric_corpus import load_corpus
+from .sound_assets import asset_url
+
+# Built-in lyrics by decade (song, lyric with missing word(s), answer), used
+# when no corpus file is configured (see api/lyric_corpus.py)
+LYRICS_BY_DECADE = {
+    2020: [
+        {'song': 'Blinding Lights', 'lyric': 'I been tryna call, I been on my own for long enough', 'missing': 'call', 'full_lyric': 'I been tryna call, I been on my own for long enough'},
+        {'song': 'Watermelon Sugar', 'lyric': 'Tastes like strawberries on a summer evenin\'', 'missing': 'strawberries', 'full_lyric': 'Tastes like strawberries on a summer evenin\''},
+    ],
+    2010: [
+        {'song': 'Someone Like You', 'lyric': 'Never mind, I\'ll find someone like you', 'missing': 'you', 'full_lyric': 'Never mind, I\'ll find someone like you'},
+        {'song': 'Rolling in the Deep', 'lyric': 'We could have had it all, rolling in the deep', 'missing': 'deep', 'full_lyric': 'We could have had it all, rolling in the deep'},
+        {'song': 'Call Me Maybe', 'lyric': 'Hey, I just met you, and this is crazy', 'missing': 'crazy', 'full_lyric': 'Hey, I just met you, and this is crazy'},
+    ],
+    2000: [
+        {'song': 'Hey Ya!', 'lyric': 'Shake it like a Polaroid picture', 'missing': 'Polaroid', 'full_lyric': 'Shake it like a Polaroid picture'},
+        {'song': 'I\'m a Believer', 'lyric': 'I thought love was only true in fairy tales', 'missing': 'fairy', 'full_lyric': 'I thought love was only true in fairy tales'},
+        {'song': 'Complicated', 'lyric': 'Why\'d you have to go and make things so complicated?', 'missing': 'complicated', 'full_lyric': 'Why\'d you have to go and make things so complicated?'},
+    ],
+    1990: [
+        {'song': 'Wonderwall', 'lyric': 'Today is gonna be the day that they\'re gonna throw it back to you', 'missing': 'day', 'full_lyric': 'Today is gonna be the day that they\'re gonna throw it back to you'},
+        {'song': 'Smells Like Teen Spirit', 'lyric': 'Here we are now, entertain us', 'missing': 'entertain', 'full_lyric': 'Here we are now, entertain us'},
+        {'song': 'I Will Always Love You', 'lyric': 'And I will always love you', 'missing': 'always', 'full_lyric': 'And I will always love you'},
+    ],
+    1980: [
+        {'song': 'Billie Jean', 'lyric': 'Billie Jean is not my lover', 'missing': 'lover', 'full_lyric': 'Billie Jean is not my lover'},
+        {'song': 'Sweet Dreams', 'lyric': 'Sweet dreams are made of this', 'missing': 'this', 'full_lyric': 'Sweet dreams are made of this'},
+        {'song': 'Take On Me', 'lyric': 'Take on me, take me on', 'missing': 'on', 'full_lyric': 'Take on me, take me on'},
+    ],
+    1970: [
+        {'song': 'Bohemian Rhapsody', 'lyric': 'Is this the real life? Is this just fantasy?', 'missing': 'fantasy', 'full_lyric': 'Is this the real life? Is this just fantasy?'},
+        {'song': 'Hotel California', 'lyric': 'Welcome to the Hotel California', 'missing': 'California', 'full_lyric': 'Welcome to the Hotel California'},
+        {'song': 'Stairway to Heaven', 'lyric': 'And she\'s buying a stairway to heaven', 'missing': 'heaven', 'full_lyric': 'And she\'s buying a stairway to heaven'},
+    ],
+    1960: [
+        {'song': 'Hey Jude', 'lyric': 'Hey Jude, don\'t be afraid', 'missing': 'afraid', 'full_lyric': 'Hey Jude, don\'t be afraid'},
+        {'song': 'Let It Be', 'lyric': 'Let it be, let it be', 'missing': 'be', 'full_lyric': 'Let it be, let it be'},
+        {'song': 'I Can\'t Get No Satisfaction', 'lyric': 'I can\'t get no satisfaction', 'missing': 'satisfaction', 'full_lyric': 'I can\'t get no satisfaction'},
+    ],
+}
+
+def freeze(value):
+    """Recursively turn dicts into read-only mappings and lists into tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def thaw(value):
+    """Inverse of freeze(), for code that needs plain dicts and lists"""
+    if isinstance(value, MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+def get_birth_decade(age):
+    """Calculate birth decade from age"""
+    current_year = datetime.now().year
+    birth_year = current_year - int(age) if age else current_year - 25
+    # Round down to nearest decade
+    decade = (birth_year // 10) * 10
+    # Closest available decade, clamped to the oldest/newest we have
+    closest = DECADE_LOOKUP.get(decade)
+    if closest is None:
+        closest = AVAILABLE_DECADES[0] if decade < AVAILABLE_DECADES[0] else AVAILABLE_DECADES[-1]
+    return closest
+
+def get_lyric_decade(user_info):
+    """Decade the fill_lyrics challenge draws from for this user"""
+    # Without an age get_birth_decade() assumes 25; either way it is a decade LYRICS has
+    return get_birth_decade(user_info.get('age'))
+
+def get_lyric_challenge(birth_decade, index=None):
+    """Get a random (or the given) lyric challenge for the given decade"""
+    if birth_decade not in LYRICS:
+        birth_decade = get_birth_decade(None)  # Default
+    if index is None:
+        index = random.randrange(LYRICS.count(birth_decade))
+    return dict(LYRICS.payload(birth_decade, index), index=index)
+
+# Challenge definitions
+_CHALLENGE_DEFINITIONS = {
+    'semi_serious': [
+        {
+            'id': 'click_this_is_me',
+            'type': 'button_click',
+            'title': 'Click "This is me" button',
+            'description': 'Please click the button below to confirm your identity.',
+        },
+        {
+            'id': 'enter_name',
+            'type': 'text_input',
+            'title': 'Enter your name',
+            'description': 'Please enter the name you provided earlier.',
+            'field_name': 'name',
+            'attempts_required': 2,
+        },
+        {
+            'id': 'security_question',
+            'type': 'security_question',
+            'title': 'Answer your security question',
+            'description': 'Please answer the security question you definitely remember setting.',
+            'question': 'What was the name of your first pet\'s favorite color?',
+        },
+    ],
+    'silly': [
+        {
+            'id': 'draw_circle',
+            'type': 'draw_circle',
+            'title': 'Draw a perfect circle',
+            'description': 'Prove you are human by drawing a perfect circle.',
+        },
+        {
+            'id': 'fill_lyrics',
+            'type': 'fill_lyrics',
+            'title': 'Complete the lyric',
+            'description': 'Fill in the missing word(s) from a popular song from your birth decade.',
+            # Will be populated dynamically based on user's birth year
+        },
+        {
+            'id': 'match_toaster',
+            'type': 'match_personality',
+            'title': 'Match your personality to a toaster',
+            'description': 'Select the toaster that best matches your personality.',
+            # Will be populated dynamically with all personality options
+            'toasters': []
+        },
+        {
+            'id': 'funniest_sound',
+            'type': 'select_sound',
+            'title': 'Choose the funniest sound effect',
+            'description': 'Confirm your identity by selecting the funniest sound effect.',
+            'sounds': [
+                {'id': 1, 'name': 'Bloop', 'file': '/api/static/sounds/bloop.mp3'},
+                {'id': 2, 'name': 'Boing', 'file': '/api/static/sounds/boing.mp3'},
+                {'id': 3, 'name': 'Honk', 'file': '/api/static/sounds/honk.mp3'},
+                {'id': 4, 'name': 'Squeak', 'file': '/api/static/sounds/squeak.mp3'},
+            ]
+        },
+        {
+            'id': 'moving_button',
+            'type': 'moving_button',
+            'title': 'Click this button to confirm',
+            'description': 'Please click the button below to confirm your identity.',
+        },
+    ],
+    'physical': [
+        {
+            'id': 'blink_camera',
+            'type': 'blink_camera',
+            'title': 'Blink at the camera once',
+            'description': 'Please blink at your camera exactly 7 times to verify your humanity.',
+            'required_blinks': 1,
+        },
+        {
+            'id': 'say_this_is_me',
+            'type': 'voice_recognition',
+            'title': 'Say "this is me" out loud',
+            'description': 'Please say "this is me" out loud and press continue.',
+            'required_phrase': 'this is me',
+        },
+        {
+            'id': 'hold_spacebar',
+            'type': 'hold_key',
+            'title': 'Hold spacebar to demonstrate commitment',
+            'description': 'Please hold the spacebar key for 3 seconds to demonstrate your commitment.',
+            'key': 'space',
+            'duration': 3,
+        },
+        {
+            'id': 'type_alphabet',
+            'type': 'type_sequence',
+            'title': 'Type the alphabet',
+            'description': 'Please type the alphabet from A to Z to verify your identity.',
+            'sequence': 'abcdefghijklmnopqrstuvwxyz',
+        },
+    ],
+}
+
+# Point sound clips at their content-addressed URLs (see api/sound_assets.py)
+for _definitions in _CHALLENGE_DEFINITIONS.values():
+    for _definition in _definitions:
+        for _sound in _definition.get('sounds', ()):
+            _sound['file'] = asset_url(_sound['file'])
+del _definitions, _definition, _sound
+
+# Read-only views of the definitions above, shared by all sessions
+LYRICS_BY_DECADE = freeze(LYRICS_BY_DECADE)
+CHALLENGES = freeze(_CHALLENGE_DEFINITIONS)
+del _CHALLENGE_DEFINITIONS
+
+# Every template in a flat tuple; sessions refer to challenges by index into it
+CHALLENGE_TEMPLATES = CHALLENGES['semi_serious'] + CHALLENGES['silly'] + CHALLENGES['physical']
+
+# Include ALL challenges. Shared tuple, so a default session costs no extra memory.
+DEFAULT_SEQUENCE = tuple(range(len(CHALLENGE_TEMPLATES)))
+
+
+# Dynamic challenge data that doesn't depend on the player is computed once
+# here, so materializing a challenge is just an index pick and a dict merge.
+
+# Lyrics for fill_lyrics: the corpus file from THISYOU_LYRICS, or the list above
+LYRICS = load_corpus(LYRICS_BY_DECADE)
+
+AVAILABLE_DECADES = LYRICS.decades
+
+# Closest available decade for every decade in the covered range
+DECADE_LOOKUP = {
+    decade: min(AVAILABLE_DECADES, key=lambda x: abs(x - decade))
+    for decade in range(AVAILABLE_DECADES[0], AVAILABLE_DECADES[-1] + 10, 10)
+}
+
+def _build_toasters():
+    # All personality options from the form
+    all_personalities = ['Traditional', 'Modern', 'Bold', 'Tech-savvy', 'Quirky', 'Mysterious']
+    toaster_names = {
+        'Traditional': 'Classic White',
+        'Modern': 'Stainless Steel',
+        'Bold': 'Retro Red',
+        'Tech-savvy': 'Smart Toaster',
+        'Quirky': 'Rainbow Toaster',
+        'Mysterious': 'Black Toaster'
+    }
+    
+    toasters = []
+    for idx, personality in enumerate(all_personalities, 1):
+        toasters.append({
+            'id': idx,
+            'name': toaster_names.get(personality, personality + ' Toaster'),
+            'personality': personality
+        })
+    return toasters
+
+# All toaster options for the match_personality challenge
+TOASTERS = freeze(_build_toasters())
+
+
+class ChallengeOverrides:
+    """Per-session values that differ from the shared challenge templates"""
+    __slots__ = ('lyric_decade', 'lyric_index')
+
+    def __init__(self, lyric_decade=None, lyric_index=None):
+        self.lyric_decade = lyric_decade
+        self.lyric_index = lyric_index
+
+    def to_list(self):
+        return [self.lyric_decade, self.lyric_index]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
+
+
+def _build_catalog():
+    # Static part of every challenge, keyed by id. Toasters are the same for
+    # everyone so they ship with the catalog rather than with each step.
+    catalog = {}
+    for template in CHALLENGE_TEMPLATES:
+        entry = thaw(template)
+        if entry['type'] == 'match_personality':
+            entry['toasters'] = thaw(TOASTERS)
+        catalog[entry['id']] = entry
+    return catalog
+
+# Everything a client needs to render any challenge, minus per-session fields
+CATALOG = freeze(_build_catalog())
+
+
+def new_session(user_info):
+    """Fresh session state for a player who just started"""
+    return {
+        'user_info': user_info,
+        'sequence': DEFAULT_SEQUENCE,
+        'current_challenge': 0,
+        'results': [],
+        'confidence_level': 0,
+        'overrides': ChallengeOverrides(),
+        'started_at': time.time(),
+        # Bumped by the session store on every save (optimistic concurrency)
+        'version': 0,
+    }
+
+
+def materialize_challenge(session, position, compact=False):
+    """
+    Build the challenge at the given position of a session's sequence.
+
+    Returns a new dict (the shared template is never modified). Lyric picks are
+    made on first use and recorded in the session's overrides so later requests
+    ask the same question.
+
+    With compact=True only the id and the per-session fields are returned; the
+    client fills in the rest from the challenge catalog.
+    """
+    template = CHALLENGE_TEMPLATES[session['sequence'][position]]
+    challenge = {'id': template['id']} if compact else dict(template)
+    
+    # Populate match_personality challenge with all personality options
+    if template['type'] == 'match_personality':
+        if not compact:
+            challenge['toasters'] = TOASTERS
+        challenge['correct_personality'] = session['user_info'].get('personality', '')  # Store the correct answer
+    
+    # Populate fill_lyrics challenge based on user's age
+    elif template['type'] == 'fill_lyrics':
+        overrides = session['overrides']
+        # A session restored after the corpus was rebuilt may point past its end
+        if (overrides.lyric_index is None or overrides.lyric_decade not in LYRICS
+                or overrides.lyric_index >= LYRICS.count(overrides.lyric_decade)):
+            overrides.lyric_decade = get_lyric_decade(session['user_info'])
+            overrides.lyric_index = random.randrange(LYRICS.count(overrides.lyric_decade))
+        challenge.update(LYRICS.payload(overrides.lyric_decade, overrides.lyric_index))
+    
+    return challenge
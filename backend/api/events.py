@@ -0,0 +1,206 @@
+"""
+Per-session event stream, served as server-sent events.
+
+Views publish what changed after each step (verify result, new confidence,
+next challenge, final verdict) and GET /api/session/<id>/events/ pushes it to
+the client, so it doesn't have to poll get_challenges.
+
+A session gets a channel when a stream is first opened for it; until then
+publishing is a dict lookup. The channel holds the last BUFFER events with
+increasing ids. Connections don't get a queue of their own: each one just
+remembers the id of the last event it sent and reads newer ones from the
+channel, so an idle connection costs one coroutine and one asyncio.Event. A
+client that falls further behind than the buffer (or resumes with a
+Last-Event-ID that has already been dropped) gets a 'reset' event telling it
+to fetch the current state instead.
+
+A stream ends after its session's 'complete' event. Clients that go away
+aren't noticed until a write fails, so an abandoned stream also ends once
+nothing was published for IDLE_TTL seconds or its session is gone, checked on
+every heartbeat; the sweep closes such channels too, listeners or not.
+
+Events are kept in process memory, so with several workers a stream only sees
+events published by the worker it is connected to.
+
+Configured via THISYOU_EVENTS in settings.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+DEFAULTS = {
+    # Events kept per session for resuming streams
+    'BUFFER': 32,
+    # Seconds between keep-alive comments on an idle stream
+    'HEARTBEAT': 15,
+    # Channels nothing was published to for this long are closed, and their
+    # streams end
+    'IDLE_TTL': 30 * 60,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THISYOU_EVENTS', {})}
+
+
+class ChallengeJSONEncoder(DjangoJSONEncoder):
+    """Also encodes the read-only mappings challenge templates are made of"""
+
+    def default(self, o):
+        if isinstance(o, MappingProxyType):
+            return dict(o)
+        return super().default(o)
+
+
+class Channel:
+    def __init__(self, buffer):
+        self.events = deque(maxlen=buffer)  # (id, name, data)
+        self.last_id = 0
+        self.closed = False
+        # Last publish, or the last time a stream was opened
+        self.last_active = time.monotonic()
+        # One (loop, asyncio.Event) per connected stream
+        self.waiters = set()
+
+    def since(self, last_id):
+        """Events after last_id, or None if the client can't be caught up from the buffer"""
+        if last_id == self.last_id:
+            return []
+        # Older than the buffer, or an id from before a restart
+        if last_id > self.last_id or not self.events or self.events[0][0] > last_id + 1:
+            return None
+        return [event for event in self.events if event[0] > last_id]
+
+
+class EventBus:
+    def __init__(self, buffer=32, heartbeat=15, idle_ttl=1800):
+        self.buffer = buffer
+        self.heartbeat = heartbeat
+        self.idle_ttl = idle_ttl
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _channel(self, session_id, now):
+        # Called with the lock held
+        channel = self._channels.get(session_id)
+        if channel is None:
+            channel = self._channels[session_id] = Channel(self.buffer)
+        channel.last_active = now
+        return channel
+
+    def _maybe_sweep(self, now):
+        # Called with the lock held
+        if now - self._last_sweep < self.idle_ttl / 10:
+            return
+        self._last_sweep = now
+        cutoff = now - self.idle_ttl
+        for session_id in [sid for sid, ch in self._channels.items() if ch.last_active < cutoff]:
+            channel = self._channels.pop(session_id)
+            # Streams still waiting on it see closed and end
+            channel.closed = True
+            for loop, event in channel.waiters:
+                loop.call_soon_threadsafe(event.set)
+
+    def publish(self, session_id, name, data, close=False):
+        """
+        Add an event to a session's stream and wake its listeners.
+
+        Safe to call from any thread. With close=True this is the session's
+        last event: streams end after sending it. Sessions nobody has opened a
+        stream for have no channel, and their events are dropped unserialized.
+        """
+        if session_id not in self._channels:
+            return
+        payload = json.dumps(data, cls=ChallengeJSONEncoder, separators=(',', ':'))
+        now = time.monotonic()
+        with self._lock:
+            self._maybe_sweep(now)
+            channel = self._channels.get(session_id)
+            # Swept or closed meanwhile
+            if channel is None:
+                return
+            channel.last_active = now
+            channel.last_id += 1
+            channel.events.append((channel.last_id, name, payload))
+            if close:
+                channel.closed = True
+                del self._channels[session_id]
+            waiters = list(channel.waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def last_id(self, session_id):
+        with self._lock:
+            channel = self._channels.get(session_id)
+            return channel.last_id if channel is not None else 0
+
+    async def stream(self, session_id, last_id=0, snapshot=None, alive=None):
+        """
+        Async generator of SSE-formatted chunks for one connection.
+
+        snapshot, if given, is sent first as a 'state' event; it should describe
+        the session as of last_id. alive, if given, is an async callable asked
+        on every heartbeat whether the session still exists; the stream ends
+        when it doesn't.
+        """
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        waiter = (loop, wakeup)
+        now = time.monotonic()
+        with self._lock:
+            self._maybe_sweep(now)
+            channel = self._channel(session_id, now)
+            channel.waiters.add(waiter)
+        try:
+            if snapshot is not None:
+                yield format_event(last_id, 'state', json.dumps(snapshot, cls=ChallengeJSONEncoder, separators=(',', ':')))
+            while True:
+                with self._lock:
+                    wakeup.clear()
+                    events = channel.since(last_id)
+                    if events is None:
+                        last_id = channel.last_id
+                    closed = channel.closed
+                    idle = time.monotonic() - channel.last_active
+                if events is None:
+                    # Fell behind the buffer; the client has to resync
+                    yield format_event(last_id, 'reset', '{}')
+                    continue
+                for event_id, name, payload in events:
+                    last_id = event_id
+                    yield format_event(event_id, name, payload)
+                if closed:
+                    return
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    # Nobody notices a client that went away, so don't wait forever
+                    if idle >= self.idle_ttl or (alive is not None and not await alive()):
+                        return
+                    yield ': heartbeat\n\n'
+        finally:
+            with self._lock:
+                channel.waiters.discard(waiter)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'channels': len(self._channels),
+                'streams': sum(len(channel.waiters) for channel in self._channels.values()),
+            }
+
+
+def format_event(event_id, name, payload):
+    return f'id: {event_id}\nevent: {name}\ndata: {payload}\n\n'
+
+
+_config = get_config()
+session_events = EventBus(_config['BUFFER'], _config['HEARTBEAT'], _config['IDLE_TTL'])
@@ -0,0 +1,119 @@
+"""
+Keystroke timeline analysis for the hold_key and type_sequence challenges.
+
+The client records every keydown/keyup and uploads the timeline as packed
+uint16 pairs: (code, milliseconds since the previous event). The low 15 bits
+of code are the key (its lower-case ASCII code, 8 for Backspace, 32 for
+Space) and the high bit is set on keyup. Code 0 marks the end of the
+recording, so a key still held when the attempt was sent has an end time.
+
+analyze_timeline() derives everything the verifiers need with array
+operations over the whole timeline:
+
+- the longest hold of one key
+- the typed text, with Backspace applied
+- inter-key interval statistics, used to spot machine-generated input
+"""
+import numpy as np
+
+from .packed import decode_array
+
+# A typed alphabet is ~60 events; a 3 second hold with key repeat is ~100
+MAX_EVENTS = 2048
+KEY_UP = 0x8000
+KEY_MASK = 0x7FFF
+BACKSPACE = 8
+KEY_CODES = {'space': 32, 'backspace': BACKSPACE}
+# Human typing is never this regular or this fast
+MIN_SCRIPTED_KEYSTROKES = 5
+SCRIPTED_MAX_STD_MS = 3
+SCRIPTED_MAX_MEAN_MS = 20
+
+
+class TimelineError(ValueError):
+    """Raised when a timeline is well-formed but can't be analysed"""
+
+
+def key_code(name):
+    """Timeline code of a key given by name ('space') or character ('a')"""
+    name = name.lower()
+    if name in KEY_CODES:
+        return KEY_CODES[name]
+    if len(name) == 1:
+        return ord(name)
+    raise TimelineError(f'unknown key {name!r}')
+
+
+def decode_timeline(data):
+    """Decode a packed timeline into an (n, 2) uint16 array of (code, delta_ms)"""
+    return decode_array(data, np.uint16, MAX_EVENTS, columns=2)
+
+
+def _hold_ms(keys, up, times, target):
+    """Longest time target was held down, in milliseconds"""
+    events = np.flatnonzero(keys == target)
+    if not len(events):
+        return 0.0
+    down = ~up[events]
+    # A press starts at a keydown not preceded by another keydown of the same
+    # key; the browser's auto-repeat keydowns in between are ignored
+    starts = events[down & ~np.concatenate(([False], down[:-1]))]
+    if not len(starts):
+        return 0.0
+    releases = events[~down]
+    # Pair each press with the first release after it; a key still held ends
+    # with the recording
+    nxt = np.searchsorted(releases, starts)
+    ends = np.full(len(starts), times[-1])
+    released = nxt < len(releases)
+    ends[released] = times[releases[nxt[released]]]
+    return float((ends - times[starts]).max())
+
+
+def _typed(keys, up, times):
+    """Typed text with Backspace applied, plus the keydown times of typed characters"""
+    down = ~up
+    chars = down & (keys > 32) & (keys < 127)
+    edits = np.flatnonzero(chars | (down & (keys == BACKSPACE)))
+    if not len(edits):
+        return '', times[:0]
+    is_char = chars[edits]
+    # Text length after each edit, clamped at zero for Backspace on empty input
+    length = np.cumsum(np.where(is_char, 1, -1))
+    length -= np.minimum(np.minimum.accumulate(length), 0)
+    # A character survives if the text never gets shorter than it afterwards
+    later_min = np.minimum.accumulate(length[::-1])[::-1]
+    survives = is_char & (np.append(later_min[1:], MAX_EVENTS) >= length)
+    text = keys[edits[survives]].astype(np.uint8).tobytes().decode('ascii')
+    return text.lower(), times[edits[is_char]]
+
+
+def analyze_timeline(events, hold_key=None):
+    """
+    Analyse a decoded timeline.
+
+    Returns a dict with the typed text, the hold time of hold_key (if given)
+    and statistics over the intervals between typed characters, all in
+    milliseconds.
+    """
+    keys = events[:, 0] & KEY_MASK
+    up = (events[:, 0] & KEY_UP) != 0
+    times = np.cumsum(events[:, 1], dtype=np.float64)
+
+    text, typed_at = _typed(keys, up, times)
+    intervals = np.diff(typed_at)
+    return {
+        'text': text,
+        'hold_ms': _hold_ms(keys, up, times, hold_key) if hold_key is not None and len(events) else 0.0,
+        'keystrokes': len(typed_at),
+        'interval_mean_ms': float(intervals.mean()) if len(intervals) else 0.0,
+        'interval_std_ms': float(intervals.std()) if len(intervals) else 0.0,
+        'interval_min_ms': float(intervals.min()) if len(intervals) else 0.0,
+    }
+
+
+def looks_scripted(analysis):
+    """True if the typing rhythm is too regular or too fast to be human"""
+    if analysis['keystrokes'] < MIN_SCRIPTED_KEYSTROKES:
+        return False
+    return analysis['interval_std_ms'] < SCRIPTED_MAX_STD_MS or analysis['interval_mean_ms'] < SCRIPTED_MAX_MEAN_MS
@@ -0,0 +1,238 @@
+"""
+Lyric corpus for the fill_lyrics challenge.
+
+A large corpus is kept in one indexed binary file that is memory-mapped
+read-only, so every worker process shares the same page-cache pages and
+nothing is parsed up front. Picking a lyric is one offset lookup and one
+record decode, whatever the corpus size:
+
+    header        b'TYLYRICS' | format version (uint16) | decade count (uint16)
+    decade table  per decade: decade (int16) | lyric count (uint32) | offset of its offset array (uint64)
+    offsets       per decade: lyric count x uint64, the start of each record
+    records       song, lyric, missing and answer lengths (uint16 each) | song | lyric | missing | answer
+
+All integers are little-endian and strings are UTF-8. The lyric is stored with
+the missing word already blanked out, and answer is the missing word in
+lyric_matching's normal form, so neither is worked out per request. Files are
+produced by `python manage.py build_lyric_corpus`.
+
+Without a usable corpus file the small built-in list in
+challenges.LYRICS_BY_DECADE is served from memory instead.
+"""
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+from django.conf import settings
+
+from .lyric_matching import normalize_answer
+
+
+MAGIC = b'TYLYRICS'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<8sHH')
+DECADE_ENTRY = struct.Struct('<hIQ')
+OFFSET = struct.Struct('<Q')
+RECORD_HEADER = struct.Struct('<HHHH')
+
+BLANK = '_____'
+MAX_FIELD_BYTES = 0xFFFF
+
+logger = logging.getLogger(__name__)
+
+
+class CorpusError(Exception):
+    """Raised when a corpus file is malformed"""
+
+
+def get_config():
+    return {'CORPUS': None, **getattr(settings, 'THISYOU_LYRICS', {})}
+
+
+def blank_lyric(lyric, missing):
+    """The lyric as shown to the player, with the missing word blanked out"""
+    return lyric.replace(missing, BLANK)
+
+
+def build_payload(decade, song, lyric, missing):
+    """fill_lyrics fields for one lyric, ready to merge into the template"""
+    return {
+        'song': song,
+        'lyric': lyric,
+        'answer': missing.lower(),
+        'full_answer': missing,
+        'description': f'Fill in the missing word from "{song}" (a popular song from the {decade}s).',
+    }
+
+
+class InMemoryCorpus:
+    """Corpus held as Python objects, for the built-in lyrics"""
+
+    def __init__(self, lyrics_by_decade):
+        self._lyrics = {
+            decade: tuple(
+                (lyric['song'], blank_lyric(lyric['lyric'], lyric['missing']), lyric['missing'],
+                 normalize_answer(lyric['missing']))
+                for lyric in lyrics
+            )
+            for decade, lyrics in lyrics_by_decade.items()
+            if lyrics
+        }
+        self.decades = tuple(sorted(self._lyrics))
+
+    def __contains__(self, decade):
+        return decade in self._lyrics
+
+    def count(self, decade):
+        return len(self._lyrics[decade])
+
+    def payload(self, decade, index):
+        return build_payload(decade, *self._lyrics[decade][index][:3])
+
+    def normalized_answer(self, decade, index):
+        return self._lyrics[decade][index][3]
+
+
+class MappedCorpus:
+    """Corpus read straight from a memory-mapped corpus file"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, 'rb') as f:
+            # The mapping stays valid after the file is closed, or replaced by a rebuild
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise CorpusError(f'{self.path} is too short to be a lyric corpus')
+        magic, version, decade_count = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise CorpusError(f'{self.path} is not a lyric corpus')
+        if version != FORMAT_VERSION:
+            raise CorpusError(f'{self.path} has unsupported corpus version {version}')
+        # decade -> (lyric count, offset of its offset array); a few entries at most
+        self._index = {}
+        for i in range(decade_count):
+            decade, count, offsets_at = DECADE_ENTRY.unpack_from(self._map, HEADER.size + i * DECADE_ENTRY.size)
+            if offsets_at + count * OFFSET.size > len(self._map):
+                raise CorpusError(f'{self.path} is truncated')
+            if count:
+                self._index[decade] = (count, offsets_at)
+        if not self._index:
+            raise CorpusError(f'{self.path} has no lyrics')
+        self.decades = tuple(sorted(self._index))
+
+    def __contains__(self, decade):
+        return decade in self._index
+
+    def count(self, decade):
+        return self._index[decade][0]
+
+    def _record(self, decade, index):
+        # (song, lyric, missing, answer) as bytes
+        count, offsets_at = self._index[decade]
+        if not 0 <= index < count:
+            raise IndexError(index)
+        (start,) = OFFSET.unpack_from(self._map, offsets_at + index * OFFSET.size)
+        fields = []
+        position = start + RECORD_HEADER.size
+        for length in RECORD_HEADER.unpack_from(self._map, start):
+            fields.append(self._map[position:position + length])
+            position += length
+        return fields
+
+    def close(self):
+        self._map.close()
+
+    def payload(self, decade, index):
+        song, lyric, missing, _ = self._record(decade, index)
+        return build_payload(decade, song.decode(), lyric.decode(), missing.decode())
+
+    def normalized_answer(self, decade, index):
+        return self._record(decade, index)[3].decode()
+
+
+def _encode_field(text):
+    data = text.encode()
+    if len(data) > MAX_FIELD_BYTES:
+        raise ValueError('field is longer than 65535 bytes')
+    return data
+
+
+def _write_records(f, decades, by_decade):
+    # Offset arrays come right after the decade table, records after them
+    offsets_at = HEADER.size + len(decades) * DECADE_ENTRY.size
+    record_at = offsets_at + sum(len(by_decade[decade]) for decade in decades) * OFFSET.size
+    f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(decades)))
+    for decade in decades:
+        f.write(DECADE_ENTRY.pack(decade, len(by_decade[decade]), offsets_at))
+        offsets_at += len(by_decade[decade]) * OFFSET.size
+    for decade in decades:
+        for record in by_decade[decade]:
+            f.write(OFFSET.pack(record_at))
+            record_at += RECORD_HEADER.size + sum(len(field) for field in record)
+    for decade in decades:
+        for record in by_decade[decade]:
+            f.write(RECORD_HEADER.pack(*(len(field) for field in record)))
+            for field in record:
+                f.write(field)
+
+
+def write_corpus(lyrics, path):
+    """
+    Write (decade, song, lyric, missing) tuples to a corpus file at path.
+
+    Lyrics are grouped by decade in the order given. The file is written next
+    to path, read back, and only then renamed over it, so running workers keep
+    their old mapping and a failed build never replaces a working corpus.
+    Returns a dict of lyric counts per decade; raises ValueError if there are
+    no lyrics and CorpusError if the written file doesn't read back.
+    """
+    by_decade = {}
+    for decade, song, lyric, missing in lyrics:
+        record = [
+            _encode_field(song),
+            _encode_field(blank_lyric(lyric, missing)),
+            _encode_field(missing),
+            _encode_field(normalize_answer(missing)),
+        ]
+        by_decade.setdefault(int(decade), []).append(record)
+    decades = sorted(by_decade)
+    if not decades:
+        raise ValueError('no lyrics to write')
+
+    path = str(path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _write_records(f, decades, by_decade)
+        # Read every decade back before it can replace the live corpus
+        corpus = MappedCorpus(tmp_path)
+        if corpus.decades != tuple(decades):
+            raise CorpusError(f'{tmp_path} does not read back as written')
+        for decade in decades:
+            if corpus.count(decade) != len(by_decade[decade]):
+                raise CorpusError(f'{tmp_path} does not read back as written')
+            corpus.payload(decade, 0)
+            corpus.payload(decade, corpus.count(decade) - 1)
+        corpus.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return {decade: len(by_decade[decade]) for decade in decades}
+
+
+def load_corpus(builtin):
+    """The configured corpus file, or the built-in lyrics if there is none or it is unusable"""
+    path = get_config()['CORPUS']
+    if path and os.path.exists(str(path)):
+        try:
+            return MappedCorpus(path)
+        except CorpusError as e:
+            logger.error('Lyric corpus not used, serving the built-in lyrics: %s', e)
+    return InMemoryCorpus(builtin)
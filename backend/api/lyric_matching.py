@@ -0,0 +1,129 @@
+"""
+Tolerant matching of fill_lyrics answers.
+
+Both the expected answer and the player's submission are reduced to a normal
+form: accents, case, punctuation and apostrophes are dropped (so "Don't",
+"dont" and "don’t" are equal), a dropped g is restored ("evenin'" ->
+"evening") and common colloquial spellings are mapped to one form ("gonna"
+-> "going to", "luv" -> "love"). Expected answers are normalized once when
+the lyric corpus is loaded or built, so scoring an attempt only normalizes
+the submission.
+
+The normalized submission then has to be within a small edit distance of the
+answer (insertions, deletions, substitutions and swaps of adjacent letters),
+scaled to the answer's length so short words have to be exact. The distance is
+computed on a diagonal band of width 2k + 1 and given up as soon as a whole row
+is over the limit. Submissions longer than MAX_SUBMISSION_CHARS, or whose
+length is more than k away from the answer's, are rejected before any of
+that, so the cost of an attempt is bounded by the answer length no matter
+what the player sends.
+"""
+import re
+import unicodedata
+
+# Longest lyric answer is a few words; anything longer is not an attempt
+MAX_SUBMISSION_CHARS = 100
+
+APOSTROPHES = str.maketrans({'’': "'", '‘': "'", 'ʼ': "'", '`': "'", '´': "'"})
+WORD = re.compile(r"[a-z0-9']+")
+
+# Colloquial spellings that lyrics and players use interchangeably
+SPELLINGS = {
+    'gonna': 'going to',
+    'wanna': 'want to',
+    'gotta': 'got to',
+    'tryna': 'trying to',
+    'cause': 'because',
+    'cuz': 'because',
+    'coz': 'because',
+    'til': 'until',
+    'till': 'until',
+    'ya': 'you',
+    'u': 'you',
+    'ur': 'your',
+    'thru': 'through',
+    'tho': 'though',
+    'nite': 'night',
+    'tonite': 'tonight',
+    'luv': 'love',
+    'ok': 'okay',
+    'em': 'them',
+    'n': 'and',
+}
+
+
+def normalize_answer(text):
+    """Normal form of an answer, as described in the module docstring"""
+    text = text[:MAX_SUBMISSION_CHARS]
+    if not text.isascii():
+        # Some characters decompose into many; an accent adds one
+        text = unicodedata.normalize('NFKD', text)[:2 * MAX_SUBMISSION_CHARS]
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    words = []
+    for word in WORD.findall(text.lower().translate(APOSTROPHES)):
+        if word.endswith("in'") and len(word) > 4:
+            word = word[:-1] + 'g'
+        word = word.replace("'", '')
+        if word:
+            words.append(SPELLINGS.get(word, word))
+    return ' '.join(words)
+
+
+def max_distance(answer):
+    """Edits allowed for a normalized answer"""
+    if len(answer) <= 4:
+        return 0
+    if len(answer) <= 8:
+        return 1
+    return 2
+
+
+def within_distance(a, b, k):
+    """
+    Whether the edit distance between a and b is at most k.
+
+    Optimal string alignment distance: an adjacent swap counts as one edit.
+    """
+    if abs(len(a) - len(b)) > k:
+        return False
+    if a == b:
+        return True
+    if k == 0:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    n = len(b)
+    over = k + 1
+    before = None
+    previous = [j if j <= k else over for j in range(n + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (n + 1)
+        if i <= k:
+            current[0] = i
+        row_min = current[0]
+        char = a[i - 1]
+        for j in range(max(1, i - k), min(n, i + k) + 1):
+            value = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char != b[j - 1]),
+            )
+            if before is not None and j > 1 and char == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > k:
+            return False
+        before, previous = previous, current
+    return previous[n] <= k
+
+
+def matches(submission, expected):
+    """Whether a raw submission is accepted for an already normalized answer"""
+    if len(submission) > MAX_SUBMISSION_CHARS:
+        return False
+    submitted = normalize_answer(submission)
+    if not submitted:
+        return False
+    return within_distance(submitted, expected, max_distance(expected))
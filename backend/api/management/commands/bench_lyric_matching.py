@@ -0,0 +1,54 @@
+"""
+Time fill_lyrics answer matching, including adversarial submissions.
+
+Every case is matched against the same normalized answer, so the numbers
+show how the cost of one attempt depends on what the player sends. Oversized
+and far-off submissions should cost about as much as exact ones.
+
+    python manage.py bench_lyric_matching --iterations 20000
+    python manage.py bench_lyric_matching --answer "Polaroid"
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.lyric_matching import MAX_SUBMISSION_CHARS, matches, normalize_answer
+
+
+def cases(answer):
+    """(name, submission) pairs for one expected answer"""
+    swapped = answer[1] + answer[0] + answer[2:] if len(answer) > 1 else answer
+    return [
+        ('exact', answer),
+        ('shouted, punctuated', f'  {answer.upper()}!!! '),
+        ('one typo', answer[:-1] + ('x' if answer[-1] != 'x' else 'y')),
+        ('swapped letters', swapped),
+        ('wrong word', 'z' * len(answer)),
+        ('longest accepted length', 'q' * MAX_SUBMISSION_CHARS),
+        ('answer repeated', (answer + ' ') * (MAX_SUBMISSION_CHARS // (len(answer) + 1))),
+        ('10 KB of text', 'la ' * 3400),
+        ('1 MB of text', 'a' * 10 ** 6),
+        ('decomposing characters', 'ﷺ' * MAX_SUBMISSION_CHARS),
+        ('combining marks', 'e' + '́' * (MAX_SUBMISSION_CHARS - 1)),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark fill_lyrics answer matching with normal and adversarial submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+        parser.add_argument('--answer', default='California', help='Expected answer to match against')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        expected = normalize_answer(options['answer'])
+        self.stdout.write(f'answer: {options["answer"]!r} (normalized {expected!r})')
+        self.stdout.write(f'{"case":<26} {"length":>8} {"match":>6} {"us per attempt":>15}')
+        for name, submission in cases(options['answer']):
+            result = matches(submission, expected)
+            start = time.perf_counter()
+            for _ in range(iterations):
+                matches(submission, expected)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{name:<26} {len(submission):>8} {str(result):>6} {elapsed / iterations * 1e6:15.2f}')
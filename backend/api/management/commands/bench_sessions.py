@@ -0,0 +1,47 @@
+"""
+Compare the per-request session cost of the in-memory store and stateless
+signed tokens.
+
+    python manage.py bench_sessions --iterations 20000
+"""
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from api import session_tokens, views
+from api.session_store import InMemorySessionStore
+
+
+class Command(BaseCommand):
+    help = 'Benchmark session load/save through the in-memory store vs signed tokens'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        user_info = {'name': 'Benchmark', 'age': 30, 'personality': 'Bold'}
+        session = views.unpack_session([5, 42, 0b10111, 5, user_info['name'], user_info['age'], user_info['personality'], 1])
+        session_id = str(uuid.uuid4())
+
+        store = InMemorySessionStore(max_entries=iterations + 1)
+        store.create(session_id, session)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            loaded = store.get(session_id)
+            store.save(session_id, loaded)
+        memory_elapsed = time.perf_counter() - start
+
+        token = session_tokens.dumps(session_id, views.pack_session(session))
+        start = time.perf_counter()
+        for _ in range(iterations):
+            _, state = session_tokens.loads(token, session_id)
+            loaded = views.unpack_session(state)
+            token = session_tokens.dumps(session_id, views.pack_session(loaded))
+        token_elapsed = time.perf_counter() - start
+
+        self.stdout.write(f'iterations:        {iterations}')
+        self.stdout.write(f'in-memory store:   {memory_elapsed / iterations * 1e6:.2f} us per load+save')
+        self.stdout.write(f'signed token:      {token_elapsed / iterations * 1e6:.2f} us per load+save')
+        self.stdout.write(f'token size:        {len(token)} bytes')
@@ -0,0 +1,132 @@
+"""
+Compare cold start and per-request overhead of settings profiles.
+
+Each profile is started RUNS times in a fresh interpreter, which times
+django.setup(), loading the WSGI application and URL configuration, and
+the first request, then serves REQUESTS more through the WSGI handler. The
+background writers, snapshots and the offload pool are switched off in the
+child processes, so they don't touch the database or the session snapshot
+and the numbers are Django and the API only. Medians are reported.
+
+    python manage.py bench_startup
+    python manage.py bench_startup thisyou.settings_api --runs 10 --requests 5000
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run with python -c, so nothing is imported before the clock starts
+CHILD = r'''
+import time
+started = time.perf_counter()
+import io, json, sys
+
+from django.conf import settings
+
+settings.THISYOU_SESSION_SNAPSHOT = {'ENABLED': False}
+settings.THISYOU_RESULTS_LOG = {'ENABLED': False}
+settings.THISYOU_STATS = {'CHECKPOINT': False}
+settings.THISYOU_OFFLOAD = {**settings.THISYOU_OFFLOAD, 'ENABLED': False}
+
+import django
+from wsgiref.util import setup_testing_defaults
+
+django.setup()
+setup_done = time.perf_counter()
+
+from django.core.wsgi import get_wsgi_application
+
+application = get_wsgi_application()
+app_done = time.perf_counter()
+
+
+def call(method, path, body=b''):
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'HTTP_HOST': 'localhost',
+        'wsgi.input': io.BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(response)
+    response.close()
+    if not statuses[0].startswith('200'):
+        raise SystemExit(f'{method} {path}: {statuses[0]}')
+
+
+# Resolving the first URL imports the URL configuration and the views
+call('GET', '/api/challenges/catalog/')
+first_done = time.perf_counter()
+
+requests = int(sys.argv[1])
+per_request = {}
+for name, method, path, body in [
+    ('catalog', 'GET', '/api/challenges/catalog/', b''),
+    ('start_session', 'POST', '/api/session/start/', b'{"name": "Bench", "age": 30}'),
+]:
+    start = time.perf_counter()
+    for _ in range(requests):
+        call(method, path, body)
+    per_request[name] = (time.perf_counter() - start) / requests
+
+print(json.dumps({
+    'setup': setup_done - started,
+    'app': app_done - setup_done,
+    'first_request': first_done - app_done,
+    'ready': first_done - started,
+    'modules': len(sys.modules),
+    'per_request': per_request,
+}))
+'''
+
+
+def run_child(profile, requests):
+    """Measurements from one fresh interpreter"""
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': profile}
+    completed = subprocess.run(
+        [sys.executable, '-c', CHILD, str(requests)],
+        cwd=str(settings.BASE_DIR), env=env, capture_output=True, text=True,
+    )
+    if completed.returncode:
+        raise CommandError(f'{profile} failed:\n{completed.stderr or completed.stdout}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+class Command(BaseCommand):
+    help = 'Benchmark startup time and per-request overhead of settings profiles'
+    # The checks would load the whole app in this process, which isn't measured
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('profiles', nargs='*', default=['thisyou.settings', 'thisyou.settings_api'],
+                            help='Settings modules to compare')
+        parser.add_argument('--runs', type=int, default=5, help='Fresh processes per profile')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and run')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"profile":<24} {"setup ms":>9} {"app ms":>7} {"first ms":>9} {"ready ms":>9} '
+            f'{"modules":>8} {"catalog us":>11} {"start us":>9}'
+        )
+        for profile in options['profiles']:
+            runs = [run_child(profile, options['requests']) for _ in range(options['runs'])]
+
+            def median(key, endpoint=None):
+                values = [run['per_request'][endpoint] if endpoint else run[key] for run in runs]
+                return statistics.median(values)
+
+            self.stdout.write(
+                f'{profile:<24} {median("setup") * 1e3:9.1f} {median("app") * 1e3:7.1f} '
+                f'{median("first_request") * 1e3:9.1f} {median("ready") * 1e3:9.1f} '
+                f'{median("modules"):8.0f} '
+                f'{median(None, "catalog") * 1e6:11.1f} {median(None, "start_session") * 1e6:9.1f}'
+            )
@@ -0,0 +1,44 @@
+"""
+Time every registered challenge verifier in isolation.
+
+Verifiers are called directly in this process (never through the offload
+pool), so the numbers are pure parse + score cost.
+
+    python manage.py bench_verifiers --iterations 20000
+    python manage.py bench_verifiers --type draw_circle
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.challenges import CHALLENGE_TEMPLATES, materialize_challenge, new_session
+from api.verifiers import VERIFIERS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark each challenge verifier with its example attempt'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+        parser.add_argument('--type', dest='challenge_type', help='Only benchmark this challenge type')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        session = new_session({'name': 'Benchmark', 'age': 30, 'personality': 'Bold'})
+        positions = {template['type']: idx for idx, template in enumerate(CHALLENGE_TEMPLATES)}
+
+        types = [options['challenge_type']] if options['challenge_type'] else sorted(VERIFIERS)
+        for challenge_type in types:
+            verifier = VERIFIERS.get(challenge_type)
+            if verifier is None:
+                raise CommandError(f'No verifier registered for {challenge_type}')
+            if challenge_type in positions:
+                challenge = materialize_challenge(session, positions[challenge_type])
+            else:
+                challenge = {'id': challenge_type, 'type': challenge_type}
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                verifier.check(session, challenge, verifier.example)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{challenge_type:<20} {elapsed / iterations * 1e6:8.2f} us per attempt')
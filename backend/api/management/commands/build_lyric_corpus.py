@@ -0,0 +1,80 @@
+"""
+Build the memory-mapped lyric corpus file served by the fill_lyrics challenge.
+
+    python manage.py build_lyric_corpus lyrics.jsonl
+    python manage.py build_lyric_corpus lyrics.csv --output /srv/thisyou/lyrics.corpus
+
+The source is JSON Lines or CSV (chosen by extension) with decade, song,
+lyric and missing fields, where missing is the word blanked out of lyric.
+Without a source the built-in lyrics are written, which is handy for trying
+the file format out. The output defaults to THISYOU_LYRICS['CORPUS'].
+Rows whose missing word doesn't appear in the lyric are skipped. The existing
+corpus is only replaced once the new file has been written and read back.
+"""
+import csv
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.challenges import LYRICS_BY_DECADE
+from api.lyric_corpus import CorpusError, get_config, write_corpus
+
+FIELDS = ('decade', 'song', 'lyric', 'missing')
+
+
+def read_source(path):
+    """Yield one dict per lyric from a .jsonl or .csv file"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def builtin_rows():
+    for decade, lyrics in LYRICS_BY_DECADE.items():
+        for lyric in lyrics:
+            yield {'decade': decade, **lyric}
+
+
+class Command(BaseCommand):
+    help = 'Build the indexed lyric corpus file from a JSON Lines or CSV source'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', help='.jsonl or .csv file (default: the built-in lyrics)')
+        parser.add_argument('--output', help='Corpus file to write (default: THISYOU_LYRICS["CORPUS"])')
+
+    def handle(self, *args, **options):
+        output = options['output'] or get_config()['CORPUS']
+        if not output:
+            raise CommandError('No output given and THISYOU_LYRICS["CORPUS"] is not set')
+        rows = read_source(options['source']) if options['source'] else builtin_rows()
+
+        skipped = 0
+
+        def lyrics():
+            nonlocal skipped
+            for row in rows:
+                try:
+                    decade, song, lyric, missing = (row[field] for field in FIELDS)
+                    decade = int(decade)
+                except (KeyError, TypeError, ValueError):
+                    skipped += 1
+                    continue
+                if not missing or missing not in lyric:
+                    skipped += 1
+                    continue
+                yield decade, song, lyric, missing
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            counts = write_corpus(lyrics(), output)
+        except (OSError, ValueError, CorpusError) as e:
+            raise CommandError(f'Could not build {output}, it was left unchanged: {e}')
+
+        for decade, count in counts.items():
+            self.stdout.write(f'{decade}s: {count} lyrics')
+        self.stdout.write(f'{sum(counts.values())} lyrics written to {output}, {skipped} rows skipped')
@@ -0,0 +1,293 @@
+"""
+In-process load test of the full session lifecycle.
+
+Each simulated player runs start_session -> get_challenges -> verify_challenge
+for every challenge -> complete_session through Django's test client, so the
+whole middleware and view stack is exercised without a network in between.
+With --finalize the verdict comes with the last verify_challenge instead.
+A share of players abandon their session part way, like real ones do, and
+their sessions stay live in the store.
+
+    python manage.py loadtest --players 500 --concurrency 16 --abandon-rate 0.2
+    python manage.py loadtest --mode asgi --concurrency 200 --output loadtest.json
+
+Reports requests/sec, p50/p95/p99 latency per endpoint and resident memory per
+live session, and writes the same numbers as JSON with --output so runs can be
+compared.
+
+The session snapshot, results log and stats checkpoints are switched off for
+the run, so synthetic players never reach db.sqlite3 or sessions.snapshot.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from api import offload
+from api.verifiers import VERIFIERS
+
+# Settings that would make the run persist anything; applied before the views
+# (and the session store, results log and aggregates they build) are imported
+ISOLATED_SETTINGS = {
+    'THISYOU_SESSION_SNAPSHOT': {'ENABLED': False},
+    'THISYOU_RESULTS_LOG': {'ENABLED': False},
+    'THISYOU_STATS': {'CHECKPOINT': False},
+}
+
+
+def resident_bytes():
+    """Current resident set size of this process, or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Recorder:
+    """Collects latencies per endpoint from any number of threads or tasks"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self):
+        result = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            ms = np.asarray(values) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            result[endpoint] = {
+                'requests': len(values),
+                'errors': self.errors.get(endpoint, 0),
+                'mean_ms': round(float(ms.mean()), 3),
+                'p50_ms': round(float(p50), 3),
+                'p95_ms': round(float(p95), 3),
+                'p99_ms': round(float(p99), 3),
+                'max_ms': round(float(ms.max()), 3),
+            }
+        return result
+
+
+def attempt_for(challenge):
+    """A realistic attempt payload for a challenge, taken from its verifier"""
+    verifier = VERIFIERS.get(challenge['type'])
+    return dict(verifier.example) if verifier is not None else {}
+
+
+class Player:
+    """One scripted run through the API, shared by the sync and async drivers"""
+
+    def __init__(self, rng, abandon_rate, finalize=False):
+        self.user_info = {
+            'name': f'Player {rng.randrange(10 ** 6)}',
+            'age': rng.randint(16, 80),
+            'personality': rng.choice(['Bold', 'Calm', 'Chaotic', 'Curious']),
+        }
+        # Abandoning players quit after a random number of answers
+        self.quit_after = rng.randint(0, 11) if rng.random() < abandon_rate else None
+        # Take the verdict from the last verify_challenge instead of calling complete_session
+        self.finalize = finalize
+
+    def requests(self):
+        """
+        Generator of (endpoint, method, path, data) tuples.
+
+        The driver sends back each response body, or None if the request failed.
+        """
+        started = yield 'start_session', 'post', '/api/session/start/', {'user_info': self.user_info}
+        if started is None:
+            return
+        session = {'session_id': started['session_id']}
+        # Stateless mode: carry the latest token along
+        if started.get('session_token'):
+            session['session_token'] = started['session_token']
+        current = yield 'get_challenges', 'get', '/api/challenges/', session
+        if current is None:
+            return
+        session['session_token'] = current.get('session_token', session.get('session_token'))
+        challenge = current['challenge']
+        answered = 0
+        while challenge is not None:
+            if self.quit_after is not None and answered >= self.quit_after:
+                return
+            result = yield 'verify_challenge', 'post', '/api/challenges/verify/', {
+                **session,
+                'challenge_id': challenge['id'],
+                'attempt_data': attempt_for(challenge),
+                'finalize': self.finalize,
+            }
+            if result is None:
+                return
+            session['session_token'] = result.get('session_token', session.get('session_token'))
+            answered += 1
+            challenge = result['next_challenge']
+        if not self.finalize:
+            yield 'complete_session', 'post', f'/api/session/{session["session_id"]}/complete/', session
+
+
+def run_sync_player(client, player, recorder):
+    requests = player.requests()
+    body = None
+    while True:
+        try:
+            endpoint, method, path, data = requests.send(body)
+        except StopIteration:
+            return
+        start = time.perf_counter()
+        if method == 'get':
+            response = client.get(path, data)
+        else:
+            response = client.post(path, data, content_type='application/json')
+        ok = response.status_code < 400
+        recorder.add(endpoint, time.perf_counter() - start, ok)
+        body = response.json() if ok else None
+
+
+async def run_async_player(client, player, recorder):
+    requests = player.requests()
+    body = None
+    while True:
+        try:
+            endpoint, method, path, data = requests.send(body)
+        except StopIteration:
+            return
+        start = time.perf_counter()
+        if method == 'get':
+            response = await client.get(path, data)
+        else:
+            response = await client.post(path, data, content_type='application/json')
+        ok = response.status_code < 400
+        recorder.add(endpoint, time.perf_counter() - start, ok)
+        body = response.json() if ok else None
+
+
+class Command(BaseCommand):
+    help = 'Drive full verification sessions through the API in-process and report throughput and latency'
+    # The checks would import the views before handle() can isolate them
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=200, help='Number of simulated sessions')
+        parser.add_argument('--concurrency', type=int, default=8, help='Players running at the same time')
+        parser.add_argument('--abandon-rate', type=float, default=0.2, help='Share of players who never complete')
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'], default='wsgi',
+                            help='Sync test client in threads, or async test client in one event loop')
+        parser.add_argument('--memory-sessions', type=int, default=5000,
+                            help='Live sessions to create when measuring memory per session (0 to skip)')
+        parser.add_argument('--finalize', action='store_true',
+                            help='Get the verdict from the last attempt instead of calling complete_session')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        for name, value in ISOLATED_SETTINGS.items():
+            setattr(settings, name, value)
+        from api import views
+
+        rng = random.Random(options['seed'])
+        players = [Player(rng, options['abandon_rate'], options['finalize']) for _ in range(options['players'])]
+        recorder = Recorder()
+        offload.start()
+
+        # The test clients always send Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            start = time.perf_counter()
+            if options['mode'] == 'wsgi':
+                self.run_wsgi(players, recorder, options['concurrency'])
+            else:
+                asyncio.run(self.run_asgi(players, recorder, options['concurrency']))
+            elapsed = time.perf_counter() - start
+            memory = self.measure_memory(options['memory_sessions'])
+
+        endpoints = recorder.summary()
+        total_requests = sum(stats['requests'] for stats in endpoints.values())
+        results = {
+            'config': {key: options[key] for key in ('players', 'concurrency', 'abandon_rate', 'mode', 'finalize', 'seed')},
+            'session_store': type(views.sessions).__name__,
+            'stateless_sessions': views.STATELESS_SESSIONS,
+            'elapsed_seconds': round(elapsed, 3),
+            'requests': total_requests,
+            'requests_per_second': round(total_requests / elapsed, 1) if elapsed else None,
+            'endpoints': endpoints,
+            'memory': memory,
+        }
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'results written to {options["output"]}')
+
+    def run_wsgi(self, players, recorder, concurrency):
+        local = threading.local()
+
+        def run(player):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            run_sync_player(local.client, player, recorder)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(run, players))
+
+    async def run_asgi(self, players, recorder, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(player):
+            async with semaphore:
+                await run_async_player(client, player, recorder)
+
+        await asyncio.gather(*(run(player) for player in players))
+
+    def measure_memory(self, count):
+        """Resident memory growth per session while count sessions are live"""
+        from api import views
+        if not count or views.STATELESS_SESSIONS:
+            return {'live_sessions': len(views.sessions) if not views.STATELESS_SESSIONS else 0}
+        client = Client()
+        before_sessions = len(views.sessions)
+        before = resident_bytes()
+        for i in range(count):
+            client.post('/api/session/start/', {'user_info': {'name': f'Idle {i}', 'age': 30}}, content_type='application/json')
+        after = resident_bytes()
+        created = len(views.sessions) - before_sessions
+        result = {'live_sessions': len(views.sessions), 'measured_sessions': created}
+        if before is not None and after is not None and created > 0:
+            result['bytes_per_session'] = round((after - before) / created)
+        return result
+
+    def report(self, results):
+        self.stdout.write(
+            f'{results["config"]["players"]} players, concurrency {results["config"]["concurrency"]}, '
+            f'{results["config"]["mode"]}, store {results["session_store"]}'
+        )
+        self.stdout.write(
+            f'{results["requests"]} requests in {results["elapsed_seconds"]:.2f}s '
+            f'({results["requests_per_second"]} req/s)'
+        )
+        self.stdout.write(f'{"endpoint":<20} {"requests":>8} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+        for endpoint, stats in results['endpoints'].items():
+            self.stdout.write(
+                f'{endpoint:<20} {stats["requests"]:>8} {stats["errors"]:>6} '
+                f'{stats["p50_ms"]:>8.2f} {stats["p95_ms"]:>8.2f} {stats["p99_ms"]:>8.2f}'
+            )
+        memory = results['memory']
+        self.stdout.write(f'live sessions: {memory["live_sessions"]}')
+        if 'bytes_per_session' in memory:
+            self.stdout.write(f'resident memory per live session: {memory["bytes_per_session"]} bytes')
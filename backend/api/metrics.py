@@ -0,0 +1,228 @@
+"""
+Request and verification metrics, exposed at /api/metrics in Prometheus text
+format.
+
+Every counter and histogram is split into a fixed number of SHARDS, each with
+its own lock. Threads are spread over the shards round-robin the first time
+they record anything, so concurrent requests rarely wait on the same lock,
+and the scrape sums the shards. Threads come and go (runserver starts one per
+request) without adding shards. Histograms use fixed bucket bounds, so an
+observation is one bisect plus two list updates.
+
+- MetricsMiddleware times every request by route name
+- Verifier records time per challenge type
+- the complete views count verdicts
+- session store, snapshot, offload pool, event stream and results log stats
+  are read at scrape time
+"""
+import itertools
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+# Seconds; covers a cached catalog hit up to a timed-out offload
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+SHARDS = 16
+
+# Shard index of the current thread, shared by all metrics
+_thread_shard = threading.local()
+_next_shard = itertools.count()
+
+
+def _shard_index():
+    try:
+        return _thread_shard.index
+    except AttributeError:
+        # next() on itertools.count is atomic under the GIL
+        index = _thread_shard.index = next(_next_shard) % SHARDS
+        return index
+
+
+class _Sharded:
+    """SHARDS locked shards of some per-label state, summed when scraped"""
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._shards = [({}, threading.Lock()) for _ in range(SHARDS)]
+
+    def _shard(self):
+        """(shard, lock) for the current thread"""
+        return self._shards[_shard_index()]
+
+    def _snapshot(self):
+        snapshot = []
+        for shard, lock in self._shards:
+            with lock:
+                snapshot.append([(label_values, _copy(value)) for label_values, value in shard.items()])
+        return snapshot
+
+    def _format(self, label_values, extra=''):
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labels, label_values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}'
+
+
+def _copy(value):
+    return list(value) if isinstance(value, list) else value
+
+
+class Counter(_Sharded):
+    def inc(self, label_values, amount=1):
+        shard, lock = self._shard()
+        with lock:
+            shard[label_values] = shard.get(label_values, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for items in self._snapshot():
+            for label_value, count in items:
+                totals[label_value] = totals.get(label_value, 0) + count
+        return totals
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for label_values, count in sorted(self.collect().items()):
+            lines.append(f'{self.name}{self._format(label_values)} {count}')
+        return lines
+
+
+class Histogram(_Sharded):
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, label_values, seconds):
+        bucket = bisect_left(self.buckets, seconds)
+        shard, lock = self._shard()
+        with lock:
+            entry = shard.get(label_values)
+            if entry is None:
+                # Bucket counts (the last one is +Inf), then the sum
+                entry = shard[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[bucket] += 1
+            entry[-1] += seconds
+
+    def collect(self):
+        totals = {}
+        for items in self._snapshot():
+            for label_value, entry in items:
+                total = totals.setdefault(label_value, [0] * len(entry[:-1]) + [0.0])
+                for i, value in enumerate(entry):
+                    total[i] += value
+        return totals
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, entry in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), entry[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{self._format(label_values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{self._format(label_values)} {entry[-1]}')
+            lines.append(f'{self.name}_count{self._format(label_values)} {cumulative}')
+        return lines
+
+
+request_duration = Histogram('thisyou_request_duration_seconds', 'API request latency by route.', ('route',))
+responses = Counter('thisyou_responses_total', 'API responses by route and status class.', ('route', 'status'))
+verify_duration = Histogram('thisyou_verify_duration_seconds', 'Verification time by challenge type.', ('challenge_type',))
+verdicts = Counter('thisyou_verdicts_total', 'Verdicts handed out when sessions complete.', ('verdict',))
+challenges_skipped = Counter('thisyou_challenges_skipped_total', 'Challenges skipped because the verdict was already decided.', ('verdict',))
+
+
+class MetricsMiddleware:
+    """Time each request and label it with its route name"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _record(self, request, response, start):
+        match = getattr(request, 'resolver_match', None)
+        route = match.url_name if match is not None and match.url_name else 'unmatched'
+        request_duration.observe((route,), time.perf_counter() - start)
+        responses.inc((route, f'{response.status_code // 100}xx'))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, start)
+        return response
+
+
+def _gauge(name, help_text, value):
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+
+
+def _counter(name, help_text, value):
+    return [f'# HELP {name}_total {help_text}', f'# TYPE {name}_total counter', f'{name}_total {value}']
+
+
+# Keys of each component's stats() that only ever go up
+SESSION_STORE_COUNTERS = {'hits', 'misses', 'evictions', 'expirations', 'conflicts'}
+SNAPSHOT_COUNTERS = {'restored', 'snapshots', 'errors'}
+OFFLOAD_COUNTERS = {'submitted', 'completed', 'rejected', 'timeouts', 'errors', 'total_seconds'}
+RESULTS_LOG_COUNTERS = {'written', 'dropped', 'batches', 'errors'}
+
+
+def _stats(prefix, description, stats, counters):
+    lines = []
+    for key, value in sorted(stats.items()):
+        if key in counters:
+            # total_seconds -> <prefix>_seconds_total
+            name = key[len('total_'):] if key.startswith('total_') else key
+            lines += _counter(f'{prefix}_{name}', f'{description} {key} since start.', value)
+        else:
+            lines += _gauge(f'{prefix}_{key}', f'{description} {key}.', value)
+    return lines
+
+
+def render():
+    """All metrics in Prometheus text exposition format"""
+    # Imported here because views imports this module
+    from . import offload
+    from .events import session_events
+    from .results_log import results_log
+    from .views import STATELESS_SESSIONS, session_snapshots, sessions
+
+    lines = []
+    for metric in (request_duration, responses, verify_duration, verdicts, challenges_skipped):
+        lines += metric.render()
+
+    if not STATELESS_SESSIONS:
+        store_stats = sessions.stats()
+        lines += _gauge('thisyou_live_sessions', 'Sessions currently held by the session store.', store_stats.pop('size'))
+        lines += _stats('thisyou_session_store', 'Session store', store_stats, SESSION_STORE_COUNTERS)
+
+    if session_snapshots is not None:
+        lines += _stats('thisyou_session_snapshot', 'Session snapshot', session_snapshots.stats(), SNAPSHOT_COUNTERS)
+
+    pool = offload.get_pool()
+    if pool is not None:
+        lines += _stats('thisyou_offload', 'Offload pool', pool.stats(), OFFLOAD_COUNTERS)
+
+    lines += _stats('thisyou_event', 'Server-sent event', session_events.stats(), ())
+
+    lines += _stats('thisyou_results_log', 'Results log', results_log.stats(), RESULTS_LOG_COUNTERS)
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,217 @@
+"""
+Process pool for CPU-heavy challenge verification.
+
+Verifiers marked heavy (stroke geometry, signal analysis) are run in a small
+ProcessPoolExecutor instead of the request thread, so one expensive attempt
+doesn't hold up a worker that other requests are waiting on.
+
+- the pool is bounded: when MAX_PENDING tasks are already in flight, new ones
+  are not queued but rejected straight away
+- every task has a TIMEOUT; the request stops waiting after it
+- async views await the task with arun() instead, so the event loop keeps
+  serving other requests while a worker is busy
+- rejected and timed-out tasks return None and the caller falls back to a
+  degraded result, which is flagged in the API response and always counts
+  as a failed attempt, so flooding the pool can't be used to skip scoring
+- start() spins up and warms every worker process; it is called from the
+  WSGI/ASGI entry points so the first player doesn't pay for it
+
+Configured via THISYOU_OFFLOAD in settings.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'WORKERS': 2,
+    'MAX_PENDING': 64,
+    'TIMEOUT': 0.5,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THISYOU_OFFLOAD', {})}
+
+
+class OffloadPool:
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _get_executor(self):
+        # A pool inherited through fork (e.g. gunicorn --preload) is unusable
+        # in the child, so each process builds its own
+        if self._executor is None or self._pid != os.getpid():
+            if self._pid != os.getpid():
+                self.pending = 0
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_warm_worker,
+            )
+            self._pid = os.getpid()
+        return self._executor
+
+    def start(self):
+        """Create the worker processes now and wait until each is warm"""
+        with self._lock:
+            executor = self._get_executor()
+        futures = [executor.submit(_noop) for _ in range(self.workers)]
+        concurrent.futures.wait(futures)
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def _task_done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def _submit(self, func, args):
+        """Submit a task, returning (future, executor) or None if it can't be queued"""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return None
+            self.pending += 1
+            self.submitted += 1
+            executor = self._get_executor()
+
+        try:
+            future = executor.submit(func, *args)
+        except RuntimeError:
+            # Executor shut down or broken
+            with self._lock:
+                self.pending -= 1
+                self.errors += 1
+                self._executor = None
+            return None
+        future.add_done_callback(self._task_done)
+        return future, executor
+
+    def _failed(self, future, executor, exc):
+        """Account for a task that didn't produce a result"""
+        with self._lock:
+            if isinstance(exc, (concurrent.futures.TimeoutError, asyncio.TimeoutError)):
+                future.cancel()
+                self.timeouts += 1
+            elif isinstance(exc, concurrent.futures.process.BrokenProcessPool):
+                # A worker died; start a fresh pool on the next task
+                self.errors += 1
+                if self._executor is executor:
+                    self._executor = None
+            else:
+                self.errors += 1
+
+    def _completed(self, start):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.completed += 1
+            self.total_seconds += elapsed
+            if elapsed > self.max_seconds:
+                self.max_seconds = elapsed
+
+    def run(self, func, *args):
+        """
+        Run func(*args) in a worker process and return its result.
+
+        Returns None if the pool is saturated or the task doesn't finish within
+        the timeout.
+        """
+        start = time.perf_counter()
+        submitted = self._submit(func, args)
+        if submitted is None:
+            return None
+        future, executor = submitted
+        try:
+            result = future.result(timeout=self.timeout)
+        except Exception as e:
+            self._failed(future, executor, e)
+            return None
+        self._completed(start)
+        return result
+
+    async def arun(self, func, *args):
+        """Like run(), but awaits the worker instead of blocking the thread"""
+        start = time.perf_counter()
+        submitted = self._submit(func, args)
+        if submitted is None:
+            return None
+        future, executor = submitted
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except Exception as e:
+            self._failed(future, executor, e)
+            return None
+        self._completed(start)
+        return result
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'pending': self.pending,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'total_seconds': self.total_seconds,
+            'max_seconds': self.max_seconds,
+        }
+
+
+def _noop():
+    return None
+
+
+def _warm_worker():
+    # Import the verifiers (and NumPy) and run each heavy one once, so the
+    # first real task doesn't pay for imports and first-call setup
+    from .verifiers import VERIFIERS
+    for verifier in VERIFIERS.values():
+        if verifier.heavy:
+            verifier.check({'user_info': {}}, {'id': verifier.challenge_type, 'type': verifier.challenge_type}, verifier.example)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The process-wide OffloadPool, or None if offloading is disabled"""
+    global _pool
+    if _pool is None:
+        config = get_config()
+        if not config['ENABLED']:
+            return None
+        with _pool_lock:
+            if _pool is None:
+                _pool = OffloadPool(config['WORKERS'], config['MAX_PENDING'], config['TIMEOUT'])
+                atexit.register(_pool.shutdown)
+    return _pool
+
+
+def start():
+    """Warm up the pool for this process, if offloading is enabled"""
+    pool = get_pool()
+    if pool is not None:
+        pool.start()
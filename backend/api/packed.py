@@ -0,0 +1,47 @@
+"""
+Decoding of packed binary attempt payloads.
+
+Clients send large sample series (stroke points, eye-openness signals,
+keystroke timelines) as base64-encoded little-endian typed arrays instead of
+JSON lists of objects. decode_array() enforces a size limit before decoding
+anything and returns a read-only NumPy view over the decoded bytes, so no
+Python object is created per sample.
+"""
+import base64
+import binascii
+
+import numpy as np
+
+
+class PackedDataError(ValueError):
+    """Raised when a packed payload is malformed or too large"""
+
+
+def decode_array(data, dtype, max_items, columns=1):
+    """
+    Decode a base64 string into a NumPy array of the given dtype.
+
+    With columns > 1 the result is reshaped to (n, columns). Raises
+    PackedDataError if the payload isn't valid base64, doesn't contain a whole
+    number of rows, or holds more than max_items rows.
+    """
+    if not isinstance(data, str):
+        raise PackedDataError('packed data must be a base64 string')
+    dtype = np.dtype(dtype).newbyteorder('<')
+    row_size = dtype.itemsize * columns
+    # Check the limit on the encoded length so oversized bodies are never decoded
+    if len(data) > (max_items * row_size + 2) // 3 * 4:
+        raise PackedDataError('packed data too large')
+    try:
+        raw = base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        raise PackedDataError('packed data is not valid base64')
+    if len(raw) % row_size:
+        raise PackedDataError('packed data has a partial row')
+    array = np.frombuffer(raw, dtype=dtype)
+    return array.reshape(-1, columns) if columns > 1 else array
+
+
+def encode_array(array, dtype):
+    """Inverse of decode_array(), mainly for benchmarks and tooling"""
+    return base64.b64encode(np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()).decode('ascii')
@@ -0,0 +1,224 @@
+"""
+Append-only log of gameplay results in SQLite, written off the request path.
+
+verify_challenge and complete_session only append a tuple to an in-memory
+queue. A background thread drains the queue every FLUSH_INTERVAL seconds (or
+sooner once BATCH_SIZE rows are waiting) and writes everything in one
+transaction to the WAL-mode database, so requests never wait for SQLite.
+
+Tables:
+- api_result_attempt: one row per verified attempt
+- api_result_run: one row per completed session, with its verdict and timings
+
+Loss window: rows still queued when the process dies without a clean exit
+(SIGKILL, OOM, power loss) are lost, which is at most FLUSH_INTERVAL seconds of
+results. On a normal shutdown the queue is flushed at exit. If the queue ever
+holds MAX_QUEUE rows (the database is locked or unreachable for a long time),
+new rows are dropped and counted instead of growing memory.
+
+Off by default, since it keeps player data (session ids and outcomes).
+
+Configured via THISYOU_RESULTS_LOG in settings.
+"""
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+
+DEFAULTS = {
+    # Off unless asked for: it stores every player's outcomes
+    'ENABLED': False,
+    # Database file; None means the project's default database
+    'DATABASE': None,
+    'FLUSH_INTERVAL': 1.0,
+    'BATCH_SIZE': 500,
+    'MAX_QUEUE': 100000,
+}
+
+ATTEMPT = 'attempt'
+RUN = 'run'
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS api_result_attempt ('
+    'session_id TEXT NOT NULL, '
+    'position INTEGER NOT NULL, '
+    'challenge_id TEXT NOT NULL, '
+    'success INTEGER NOT NULL, '
+    'degraded INTEGER NOT NULL, '
+    'answered_at REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS api_result_run ('
+    'session_id TEXT NOT NULL, '
+    'verdict TEXT NOT NULL, '
+    'confidence_level INTEGER NOT NULL, '
+    'successes INTEGER NOT NULL, '
+    'total INTEGER NOT NULL, '
+    'results TEXT NOT NULL, '
+    'started_at REAL, '
+    'completed_at REAL NOT NULL, '
+    'duration_seconds REAL)',
+)
+
+INSERTS = {
+    ATTEMPT: 'INSERT INTO api_result_attempt VALUES (?, ?, ?, ?, ?, ?)',
+    RUN: 'INSERT INTO api_result_run VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THISYOU_RESULTS_LOG', {})}
+
+
+class ResultsLog:
+    def __init__(self, path, flush_interval=1.0, batch_size=500, max_queue=100000):
+        self.path = str(path)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._thread_pid = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _append(self, kind, row):
+        self._ensure_flusher()
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._queue.append((kind, row))
+            full = len(self._queue) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def log_attempt(self, session_id, position, challenge_id, success, degraded):
+        self._append(ATTEMPT, (session_id, position, challenge_id, int(success), int(degraded), time.time()))
+
+    def log_run(self, session_id, session, result):
+        completed_at = time.time()
+        started_at = session.get('started_at')
+        # Success bits in answer order, e.g. '1101'
+        results = ''.join('1' if r['success'] else '0' for r in session['results'])
+        self._append(RUN, (
+            session_id, result['verdict'], result['confidence_level'], result['successes'], result['total'],
+            results, started_at, completed_at, completed_at - started_at if started_at else None,
+        ))
+
+    def _connection(self):
+        # Called with the flush lock held
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def flush(self):
+        """Write everything queued so far, one transaction per batch"""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                if not batch:
+                    return
+                try:
+                    self._write(batch)
+                except sqlite3.Error:
+                    self.errors += 1
+                    # Put the batch back and try again on the next flush
+                    with self._lock:
+                        self._queue.extendleft(reversed(batch))
+                    return
+
+    def _write(self, batch):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for kind, insert in INSERTS.items():
+                rows = [row for row_kind, row in batch if row_kind == kind]
+                if rows:
+                    conn.executemany(insert, rows)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self.written += len(batch)
+        self.batches += 1
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _ensure_flusher(self):
+        # One background thread per process, started on first use (after any fork)
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='results-log-flush', daemon=True).start()
+
+    def close(self):
+        self._stop.set()
+        self._wakeup.set()
+        self.flush()
+
+    def stats(self):
+        return {
+            'queued': len(self._queue),
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'errors': self.errors,
+        }
+
+
+class NullResultsLog:
+    """Stand-in used when the results log is disabled"""
+
+    def log_attempt(self, *args):
+        pass
+
+    def log_run(self, *args):
+        pass
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+def _build():
+    config = get_config()
+    if not config['ENABLED']:
+        return NullResultsLog()
+    log = ResultsLog(
+        config['DATABASE'] or settings.DATABASES['default']['NAME'],
+        config['FLUSH_INTERVAL'],
+        config['BATCH_SIZE'],
+        config['MAX_QUEUE'],
+    )
+    atexit.register(log.close)
+    return log
+
+
+results_log = _build()
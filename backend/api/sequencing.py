@@ -0,0 +1,105 @@
+"""
+Challenge sequencing and verdict bands.
+
+Every answer moves a session's confidence by a bounded random step (up 15-25
+on success, down 5-15 on failure, kept within 0-100), and the verdict only
+depends on which band the final confidence lands in and on whether every
+challenge was passed:
+
+    Verified                90 or more, no failed challenge
+    Probably You            60 or more
+    Suspiciously You-Like   30 or more
+    Absolutely Not You      below 30
+
+So from a session's confidence, its results so far and the number of
+challenges left, the lowest and highest band it can still end in are known:
+every remaining challenge failed by the largest step, or passed by it. When
+both are the same band, none of the remaining challenges can change the
+verdict, and advance() skips them all. The session then ends early with the
+verdict it would have got anyway, and views that support 'finalize' hand it
+out straight away.
+
+Because a failure can cost up to 15 points, a band can only be settled in the
+last few challenges; sessions never end with a different verdict than they
+would have playing everything.
+
+Configured via THISYOU_SEQUENCING in settings.
+"""
+import random
+
+from django.conf import settings
+
+
+DEFAULTS = {
+    # Skip the remaining challenges once the verdict band can't change
+    'EARLY_VERDICT': True,
+}
+
+# Confidence change ranges, inclusive
+SUCCESS_GAIN = (15, 25)
+FAILURE_LOSS = (5, 15)
+MIN_CONFIDENCE = 0
+MAX_CONFIDENCE = 100
+
+# Lowest band first
+ABSOLUTELY_NOT = 'Absolutely Not You'
+SUSPICIOUS = 'Suspiciously You-Like'
+PROBABLY = 'Probably You'
+VERIFIED = 'Verified'
+BANDS = (ABSOLUTELY_NOT, SUSPICIOUS, PROBABLY, VERIFIED)
+BAND_RANK = {band: rank for rank, band in enumerate(BANDS)}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THISYOU_SEQUENCING', {})}
+
+
+def next_confidence(confidence, success):
+    """Confidence after one more answered challenge"""
+    if success:
+        return min(MAX_CONFIDENCE, confidence + random.randint(*SUCCESS_GAIN))
+    return max(MIN_CONFIDENCE, confidence - random.randint(*FAILURE_LOSS))
+
+
+def verdict_band(confidence, all_passed):
+    """Verdict for a final confidence level"""
+    if confidence >= 90 and all_passed:
+        return VERIFIED
+    if confidence >= 60:
+        return PROBABLY
+    if confidence >= 30:
+        return SUSPICIOUS
+    return ABSOLUTELY_NOT
+
+
+def reachable_bands(confidence, all_passed, remaining):
+    """(lowest, highest) verdict a session can still end with"""
+    if not remaining:
+        band = verdict_band(confidence, all_passed)
+        return band, band
+    lowest = max(MIN_CONFIDENCE, confidence - FAILURE_LOSS[1] * remaining)
+    highest = min(MAX_CONFIDENCE, confidence + SUCCESS_GAIN[1] * remaining)
+    return verdict_band(lowest, False), verdict_band(highest, all_passed)
+
+
+def decided_verdict(session):
+    """The verdict band a session is certain to end with, or None"""
+    remaining = len(session['sequence']) - session['current_challenge']
+    all_passed = all(result['success'] for result in session['results'])
+    lowest, highest = reachable_bands(session['confidence_level'], all_passed, remaining)
+    return lowest if lowest == highest else None
+
+
+def advance(session):
+    """
+    Move a session past the challenge just answered.
+
+    Returns the number of challenges skipped because the verdict was already
+    decided.
+    """
+    session['current_challenge'] += 1
+    remaining = len(session['sequence']) - session['current_challenge']
+    if remaining and get_config()['EARLY_VERDICT'] and decided_verdict(session) is not None:
+        session['current_challenge'] = len(session['sequence'])
+        return remaining
+    return 0
@@ -0,0 +1,60 @@
+"""
+Per-session mutual exclusion for request handlers.
+
+A verify call reads the current challenge, scores it and advances the session;
+two concurrent calls for the same session must not interleave. Rather than one
+global lock (which would serialize every player) or one lock per session
+(which would need its own cleanup), session ids are hashed onto a fixed table
+of locks. Two players only ever wait for each other if their ids land on the
+same stripe, which with the default 1024 stripes is rare.
+
+Async views share the same table through locked_async(), which takes an
+uncontended lock directly on the event loop and only waits for a contended
+one in a worker thread.
+
+This only covers threads of one process. Across processes (SQLiteSessionStore
+under several workers) the stores' optimistic version check catches the
+conflicting write instead.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+
+
+class StripedLock:
+    def __init__(self, stripes=1024):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        """The lock guarding key, for use in a with statement"""
+        return self._locks[hash(key) % len(self._locks)]
+
+    def locked_async(self, key):
+        """Async context manager holding the lock for key"""
+        return _AsyncLockHolder(self(key))
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class _AsyncLockHolder:
+    def __init__(self, lock):
+        self.lock = lock
+
+    async def __aenter__(self):
+        if self.lock.acquire(blocking=False):
+            return
+        acquired = asyncio.get_running_loop().run_in_executor(None, self.lock.acquire)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # The thread still gets the lock eventually; hand it straight back
+            acquired.add_done_callback(lambda _: self.lock.release())
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self.lock.release()
+
+
+session_lock = StripedLock(getattr(settings, 'THISYOU_SESSION_LOCK_STRIPES', 1024))
@@ -0,0 +1,484 @@
+"""
+Snapshot and restore of in-memory sessions across restarts.
+
+InMemorySessionStore loses every live session when its worker exits, so a
+deploy or worker recycle would answer every player mid-run with "Invalid
+session". When enabled, the store is written to a snapshot file at exit and
+every INTERVAL seconds, and reloaded when the store is created on startup.
+
+The file is a binary stream of chunks of up to CHUNK_SIZE sessions, so writing
+or reading it never needs more than one chunk in memory:
+
+    header   b'TYSNAP' | format version (uint16) | written at (float64)
+    chunk    b'\x01' | session count (uint32) | RECORD per session |
+             result bits | sequences | names | personalities
+    end      b'\x00'
+
+All integers are little-endian. A session keeps what pack_session() keeps for
+session tokens (position, confidence, result bits, player info and the
+overrides) plus its version, start time and last access, so idle time carries
+across the restart and sessions that expired meanwhile are not restored.
+Attempt messages are not kept. Only sessions with uuid ids (the ids
+start_session hands out) are written.
+
+A chunk is stored column-wise: the fixed-size RECORDs of all its sessions,
+then each variable-length field of all its sessions back to back, in the same
+order (the lengths are in the records). So a chunk is packed and unpacked as a
+whole with numpy, and only reading fields out of the session dicts, or
+building them back, is done per session. A session that doesn't fit the
+format is left out.
+
+Snapshots are written to a temporary file of their own and renamed over the
+previous one, so a crash mid-write leaves the last complete snapshot in place
+and concurrent writers never mix their output. A file with an unknown version
+is ignored; a truncated one is restored up to the break. Only the process that
+restored the store writes it: forked children (such as offload pool workers)
+hold a stale copy and never snapshot it. Snapshots are installed by the
+server entry points (thisyou/wsgi.py and asgi.py), so management commands
+never read or write the file. With several workers each one writes
+the same file, so the last to exit wins; use SQLiteSessionStore to share
+sessions between workers instead.
+
+Configured via THISYOU_SESSION_SNAPSHOT in settings.
+"""
+import atexit
+import gc
+import logging
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .challenges import CHALLENGE_TEMPLATES, DEFAULT_SEQUENCE, ChallengeOverrides
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    # Snapshot file; None means sessions.snapshot next to manage.py
+    'PATH': None,
+    # Seconds between background snapshots; 0 to only write one at exit
+    'INTERVAL': 60,
+}
+
+MAGIC = b'TYSNAP'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<6sHd')
+CHUNK = b'\x01'
+END = b'\x00'
+CHUNK_COUNT = struct.Struct('<I')
+
+# Session id, last access, started at (NaN if unknown), version, current
+# challenge, confidence, result count, lyric decade, lyric index (-1 if unset),
+# age (-1 if unknown), sequence length (0 for the default sequence), name
+# length, personality length
+RECORD = np.dtype([
+    ('id', 'V16'), ('last_access', '<f8'), ('started_at', '<f8'), ('version', '<u4'),
+    ('current_challenge', '<u2'), ('confidence', 'u1'), ('result_count', '<u2'), ('lyric_decade', '<i2'),
+    ('lyric_index', '<i4'), ('age', '<i2'), ('sequence_length', 'u1'), ('name_length', '<u2'),
+    ('personality_length', '<u2'),
+])
+
+# Sessions copied out of the store per lock acquisition, and per chunk
+CHUNK_SIZE = 4096
+# Largest chunk a reader accepts, so a corrupt count can't ask for gigabytes
+MAX_CHUNK_SIZE = 1 << 16
+READ_SIZE = 1 << 20
+
+ENCODE_ERRORS = (AttributeError, KeyError, TypeError, ValueError, OverflowError)
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file isn't one this version can read"""
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THISYOU_SESSION_SNAPSHOT', {})}
+
+
+def _age(value):
+    try:
+        age = int(value)
+    except (TypeError, ValueError):
+        return -1
+    return age if 0 <= age < 2 ** 15 else -1
+
+
+def _int_column(column, dtype, default=None):
+    """A float column as dtype, with NaN (None) as default; ValueError if a value doesn't fit"""
+    if default is not None:
+        column = np.where(np.isnan(column), default, column)
+    info = np.iinfo(dtype)
+    # NaN fails every comparison, so a missing required value is caught too
+    if not ((column >= info.min) & (column <= info.max) & (column == np.floor(column))).all():
+        raise ValueError(f'value out of range for {np.dtype(dtype).name}')
+    return column.astype(dtype)
+
+
+def _encode_strings(values):
+    """UTF-8 encoding of str(value) for each value, as (joined bytes, byte lengths)"""
+    strings = [value if type(value) is str else str(value or '') for value in values]
+    joined = ''.join(strings)
+    lengths = np.fromiter(map(len, strings), np.int64, len(strings))
+    # ASCII-only (the common case) can be encoded in one go
+    if joined.isascii() and lengths.max() <= 0xFFFF:
+        return joined.encode('ascii'), lengths
+    encoded = [string.encode()[:0xFFFF] for string in strings]
+    return b''.join(encoded), np.fromiter(map(len, encoded), np.int64, len(encoded))
+
+
+def _pack_chunk(chunk):
+    # The session dicts are read in a single pass; everything after that works
+    # on whole columns
+    rows = [
+        (session_id, last_access, session.get('started_at'), session['version'], session['current_challenge'],
+         session['confidence_level'], len(results), overrides.lyric_decade, overrides.lyric_index,
+         user_info.get('age'), user_info.get('name'), user_info.get('personality'), results, session['sequence'])
+        for session_id, last_access, session in chunk
+        for user_info, overrides, results in ((session['user_info'], session['overrides'], session['results']),)
+    ]
+    (session_ids, last_access, started_at, versions, current_challenges, confidences, result_counts,
+     lyric_decades, lyric_indexes, ages, names, personalities, results, sequences) = zip(*rows)
+    count = len(rows)
+
+    session_ids = ''.join(session_ids)
+    if len(session_ids) != 36 * count or any(session_ids[i::36] != '-' * count for i in (8, 13, 18, 23)):
+        raise ValueError('not a uuid')
+    # None becomes NaN
+    numbers = np.array(
+        (last_access, started_at, versions, current_challenges, confidences, result_counts, lyric_decades, lyric_indexes),
+        dtype=np.float64,
+    )
+    records = np.empty(count, RECORD)
+    records['id'] = np.frombuffer(bytes.fromhex(session_ids.replace('-', '')), 'V16')
+    records['last_access'] = numbers[0]
+    records['started_at'] = numbers[1]
+    records['version'] = _int_column(numbers[2], np.uint32)
+    records['current_challenge'] = _int_column(numbers[3], np.uint16)
+    records['confidence'] = _int_column(numbers[4], np.uint8)
+    result_counts = _int_column(numbers[5], np.uint16).astype(np.int64)
+    records['result_count'] = result_counts
+    records['lyric_decade'] = _int_column(numbers[6], np.int16, -1)
+    records['lyric_index'] = _int_column(numbers[7], np.int32, -1)
+    if all(type(age) is int for age in ages if age is not None):
+        ages = np.array([-1 if age is None else age for age in ages], dtype=np.int64)
+        ages[(ages < 0) | (ages >= 2 ** 15)] = -1
+    else:
+        ages = [_age(age) for age in ages]
+    records['age'] = ages
+
+    # Result bits: every session's flags in one array, each session padded to
+    # whole bytes, then packed least significant bit first
+    flags = np.array([result['success'] for session_results in results for result in session_results], dtype=bool)
+    bits_lengths = (result_counts + 7) // 8
+    owner = np.repeat(np.arange(count), result_counts)
+    position = np.arange(len(flags)) - (np.cumsum(result_counts) - result_counts)[owner]
+    padded = np.zeros(8 * int(bits_lengths.sum()), dtype=bool)
+    padded[8 * (np.cumsum(bits_lengths) - bits_lengths)[owner] + position] = flags
+
+    sequences = [
+        b'' if sequence is DEFAULT_SEQUENCE or sequence == DEFAULT_SEQUENCE else bytes(sequence)
+        for sequence in sequences
+    ]
+    sequence_lengths = np.fromiter(map(len, sequences), np.int64, count)
+    if sequence_lengths.max() > 0xFF:
+        raise ValueError('sequence is too long')
+    records['sequence_length'] = sequence_lengths
+    names, records['name_length'] = _encode_strings(names)
+    personalities, records['personality_length'] = _encode_strings(personalities)
+
+    return b''.join((
+        CHUNK,
+        CHUNK_COUNT.pack(count),
+        records.tobytes(),
+        np.packbits(padded, bitorder='little').tobytes(),
+        b''.join(sequences),
+        names,
+        personalities,
+    ))
+
+
+def encode_chunk(chunk):
+    """
+    A list of (session_id, last_access, session) as one chunk.
+
+    Returns (bytes, number of sessions in it). Sessions that can't be
+    snapshotted are left out rather than failing the whole snapshot.
+    """
+    if not chunk:
+        return b'', 0
+    try:
+        return _pack_chunk(chunk), len(chunk)
+    except ENCODE_ERRORS:
+        if len(chunk) == 1:
+            return b'', 0
+    # Split around the culprits; each half becomes a chunk of its own
+    middle = len(chunk) // 2
+    first, first_count = encode_chunk(chunk[:middle])
+    second, second_count = encode_chunk(chunk[middle:])
+    return first + second, first_count + second_count
+
+
+def _result_entries(sequence, count, bits):
+    return tuple(
+        {'challenge_id': CHALLENGE_TEMPLATES[sequence[idx]]['id'], 'success': bool(bits >> idx & 1), 'message': ''}
+        for idx in range(count)
+    )
+
+
+def _read(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise EOFError
+    return data
+
+
+def _spans(lengths):
+    """(starts, ends) of consecutive runs of the given lengths, as lists"""
+    ends = np.cumsum(lengths)
+    return (ends - lengths).tolist(), ends.tolist()
+
+
+def decode_chunk(f, results_cache):
+    """
+    Generator of (session_id, last_access, session) for the chunk whose body
+    (everything after the tag) starts at f's position. Raises EOFError if the
+    file ends first.
+
+    Result entries are never modified once appended to a session, so sessions
+    with the default sequence share them through results_cache.
+    """
+    (count,) = CHUNK_COUNT.unpack(_read(f, CHUNK_COUNT.size))
+    if count > MAX_CHUNK_SIZE:
+        raise SnapshotError(f'Chunk of {count} sessions is too large')
+    records = np.frombuffer(_read(f, count * RECORD.itemsize), RECORD)
+    result_counts = records['result_count'].astype(np.int64)
+    bits_lengths = (result_counts + 7) // 8
+    sequence_lengths = records['sequence_length'].astype(np.int64)
+    name_lengths = records['name_length'].astype(np.int64)
+    personality_lengths = records['personality_length'].astype(np.int64)
+    bits = _read(f, int(bits_lengths.sum()))
+    sequences = _read(f, int(sequence_lengths.sum()))
+    names = _read(f, int(name_lengths.sum()))
+    personalities = _read(f, int(personality_lengths.sum()))
+
+    hex_ids = records['id'].tobytes().hex()
+    columns = zip(
+        range(0, 32 * count, 32),
+        records['last_access'].tolist(),
+        records['started_at'].tolist(),
+        records['version'].tolist(),
+        records['current_challenge'].tolist(),
+        records['confidence'].tolist(),
+        result_counts.tolist(),
+        records['lyric_decade'].tolist(),
+        records['lyric_index'].tolist(),
+        records['age'].tolist(),
+        *_spans(bits_lengths),
+        *_spans(sequence_lengths),
+        *_spans(name_lengths),
+        *_spans(personality_lengths),
+    )
+    for (at, last_access, started_at, version, current_challenge, confidence, result_count, lyric_decade,
+         lyric_index, age, bits_start, bits_end, sequence_start, sequence_end, name_start, name_end,
+         personality_start, personality_end) in columns:
+        result_bits = int.from_bytes(bits[bits_start:bits_end], 'little')
+        if sequence_end > sequence_start:
+            sequence = tuple(sequences[sequence_start:sequence_end])
+            results = list(_result_entries(sequence, result_count, result_bits))
+        else:
+            sequence = DEFAULT_SEQUENCE
+            entries = results_cache.get((result_count, result_bits))
+            if entries is None:
+                entries = results_cache[result_count, result_bits] = _result_entries(sequence, result_count, result_bits)
+            results = list(entries)
+        session = {
+            'user_info': {
+                'name': names[name_start:name_end].decode(errors='replace'),
+                'age': age if age >= 0 else None,
+                'personality': personalities[personality_start:personality_end].decode(errors='replace'),
+            },
+            'sequence': sequence,
+            'current_challenge': current_challenge,
+            'results': results,
+            'confidence_level': confidence,
+            'overrides': ChallengeOverrides(
+                lyric_decade if lyric_decade >= 0 else None,
+                lyric_index if lyric_index >= 0 else None,
+            ),
+            'started_at': None if math.isnan(started_at) else started_at,
+            'version': version,
+        }
+        session_id = f'{hex_ids[at:at + 8]}-{hex_ids[at + 8:at + 12]}-{hex_ids[at + 12:at + 16]}-{hex_ids[at + 16:at + 20]}-{hex_ids[at + 20:at + 32]}'
+        yield session_id, last_access, session
+
+
+def write_snapshot(store, path):
+    """Write every session in store to path, returning the number written"""
+    path = str(path)
+    # A temporary file per write, so concurrent writers can't interleave
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+    written = 0
+    # Last access times are monotonic inside the store, wall clock in the file
+    offset = time.time() - time.monotonic()
+    try:
+        with open(fd, 'wb', buffering=READ_SIZE) as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, time.time()))
+            for chunk in store.entry_chunks(CHUNK_SIZE):
+                data, count = encode_chunk([
+                    (session_id, last_access + offset, session) for session_id, last_access, session in chunk
+                ])
+                f.write(data)
+                written += count
+            f.write(END)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return written
+
+
+def read_snapshot(path):
+    """
+    Generator of (session_id, last_access, session) from a snapshot file.
+
+    last_access is wall clock time. Raises SnapshotError if the file has the
+    wrong magic or version and stops early (raising EOFError) if it is truncated.
+    """
+    results_cache = {}
+    with open(str(path), 'rb', buffering=READ_SIZE) as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise SnapshotError('Snapshot header is incomplete')
+        magic, version, _ = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise SnapshotError('Not a session snapshot')
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f'Unsupported snapshot version {version}')
+        while True:
+            tag = _read(f, 1)
+            if tag == END:
+                return
+            if tag != CHUNK:
+                raise SnapshotError(f'Unknown record type {tag[0]}')
+            yield from decode_chunk(f, results_cache)
+
+
+class SessionSnapshotter:
+    """Keeps one InMemorySessionStore snapshotted to a file"""
+
+    def __init__(self, store, path, interval=60):
+        self.store = store
+        self.path = str(path)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Forked children inherit a stale copy of the store; only this process writes it
+        self.pid = os.getpid()
+        self.restored = 0
+        self.written = 0
+        self.snapshots = 0
+        self.errors = 0
+        self.last_duration = 0.0
+
+    def restore(self):
+        """Load sessions from the snapshot file into the store"""
+        if not os.path.exists(self.path):
+            return 0
+        # Wall clock in the file, monotonic inside the store
+        offset = time.monotonic() - time.time()
+        restored = 0
+        chunk = []
+        # Every restored session is a handful of new containers; letting the
+        # cyclic GC rescan the growing heap meanwhile would cost more than decoding
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for session_id, last_access, session in read_snapshot(self.path):
+                chunk.append((session_id, last_access + offset, session))
+                if len(chunk) == CHUNK_SIZE:
+                    restored += self.store.restore(chunk)
+                    chunk = []
+        except (SnapshotError, EOFError, OSError, IndexError, ValueError) as e:
+            self.errors += 1
+            logger.warning('Session snapshot %s could not be fully restored: %r', self.path, e)
+        finally:
+            restored += self.store.restore(chunk)
+            if gc_was_enabled:
+                gc.enable()
+        self.restored += restored
+        return restored
+
+    def snapshot(self):
+        """Write the store to the snapshot file"""
+        if os.getpid() != self.pid:
+            return
+        with self._lock:
+            start = time.perf_counter()
+            # As in restore(): the chunks being packed would otherwise keep
+            # triggering full collections over the whole store
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                self.written = write_snapshot(self.store, self.path)
+            except Exception:
+                # Keep the background thread alive for the next attempt
+                self.errors += 1
+                logger.exception('Session snapshot %s could not be written', self.path)
+                return
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+            self.snapshots += 1
+            self.last_duration = time.perf_counter() - start
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.interval):
+            self.snapshot()
+
+    def start(self):
+        """Start background snapshots in this process"""
+        if self.interval:
+            threading.Thread(target=self._snapshot_loop, name='session-snapshot', daemon=True).start()
+
+    def close(self):
+        self._stop.set()
+        self.snapshot()
+
+    def stats(self):
+        return {
+            'restored': self.restored,
+            'written': self.written,
+            'snapshots': self.snapshots,
+            'errors': self.errors,
+            'last_duration_seconds': round(self.last_duration, 6),
+        }
+
+
+def install(store):
+    """
+    Restore store from its snapshot and keep snapshotting it.
+
+    Returns the SessionSnapshotter, or None if snapshots are disabled or the
+    store keeps sessions somewhere that survives a restart already.
+    """
+    config = get_config()
+    if not config['ENABLED'] or not hasattr(store, 'entry_chunks'):
+        return None
+    snapshotter = SessionSnapshotter(
+        store,
+        config['PATH'] or settings.BASE_DIR / 'sessions.snapshot',
+        config['INTERVAL'],
+    )
+    snapshotter.restore()
+    snapshotter.start()
+    atexit.register(snapshotter.close)
+    return snapshotter
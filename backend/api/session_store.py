@@ -0,0 +1,374 @@
+"""
+Session storage backends for verification sessions.
+
+Views talk to the store through get/create/save/delete so the backend can be
+swapped via the THISYOU_SESSION_STORE setting without touching view code.
+The async views use aget/acreate/asave/adelete; by default these run the sync
+method in a worker thread, and backends that never block override them.
+
+Every session carries a version number. save() only succeeds if the stored
+session still has the version the caller read, and bumps it; otherwise it
+raises SessionConflict. That turns two racing writers for one session into
+one success and one cheap, detectable failure.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .challenges import DEFAULT_SEQUENCE, ChallengeOverrides
+
+
+DEFAULT_SESSION_STORE = {
+    'BACKEND': 'api.session_store.InMemorySessionStore',
+    'OPTIONS': {},
+}
+
+
+def encode_session(session):
+    """Serialize a session dict to compact JSON for out-of-process backends"""
+    data = dict(session)
+    data['sequence'] = list(session['sequence'])
+    data['overrides'] = session['overrides'].to_list()
+    return json.dumps(data, separators=(',', ':'))
+
+
+def decode_session(text):
+    """Inverse of encode_session()"""
+    session = json.loads(text)
+    sequence = tuple(session['sequence'])
+    # Share the default sequence instead of keeping a copy per session
+    session['sequence'] = DEFAULT_SEQUENCE if sequence == DEFAULT_SEQUENCE else sequence
+    session['overrides'] = ChallengeOverrides.from_list(session['overrides'])
+    session.setdefault('version', 0)
+    return session
+
+
+class SessionConflict(Exception):
+    """Raised by save() when the session changed since it was read"""
+
+
+class BaseSessionStore:
+    """Interface every session backend implements"""
+
+    def get(self, session_id):
+        """Return the session dict, or None if it doesn't exist"""
+        raise NotImplementedError
+
+    def create(self, session_id, session):
+        """Store a brand new session"""
+        raise NotImplementedError
+
+    def save(self, session_id, session):
+        """
+        Persist changes made to a session returned by get().
+
+        Raises SessionConflict if the session was saved by someone else since.
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """Remove a session, ignoring unknown ids"""
+        raise NotImplementedError
+
+    async def aget(self, session_id):
+        return await sync_to_async(self.get, thread_sensitive=False)(session_id)
+
+    async def acreate(self, session_id, session):
+        return await sync_to_async(self.create, thread_sensitive=False)(session_id, session)
+
+    async def asave(self, session_id, session):
+        return await sync_to_async(self.save, thread_sensitive=False)(session_id, session)
+
+    async def adelete(self, session_id):
+        return await sync_to_async(self.delete, thread_sensitive=False)(session_id)
+
+    async def acontains(self, session_id):
+        return await sync_to_async(self.__contains__, thread_sensitive=False)(session_id)
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, session_id):
+        """Whether a live session exists; unlike get() this doesn't count as an access"""
+        return self.get(session_id) is not None
+
+    def stats(self):
+        """Return a dict of counters describing the store"""
+        return {'size': len(self)}
+
+
+class InMemorySessionStore(BaseSessionStore):
+    """
+    Per-process store with idle TTL and LRU eviction.
+
+    Entries are kept in an OrderedDict ordered by last access, so the oldest
+    (least recently used) session is always at the front. That makes both LRU
+    eviction and expiry sweeping cheap: we only ever pop from the front until
+    we hit a live entry.
+    """
+
+    def __init__(self, ttl=1800, max_entries=10000, sweep_interval=60):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._data = OrderedDict()  # session_id -> (last_access, session)
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.conflicts = 0
+
+    def _maybe_sweep(self, now):
+        # Called with the lock held
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        cutoff = now - self.ttl
+        while self._data:
+            session_id, (last_access, _) = next(iter(self._data.items()))
+            if last_access > cutoff:
+                break
+            del self._data[session_id]
+            self.expirations += 1
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._maybe_sweep(now)
+            entry = self._data.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            last_access, session = entry
+            if now - last_access > self.ttl:
+                del self._data[session_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data[session_id] = (now, session)
+            self._data.move_to_end(session_id)
+            self.hits += 1
+            return session
+
+    def create(self, session_id, session):
+        self._put(session_id, session, time.monotonic())
+
+    def _put(self, session_id, session, now):
+        with self._lock:
+            self._maybe_sweep(now)
+            self._data[session_id] = (now, session)
+            self._data.move_to_end(session_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def save(self, session_id, session):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(session_id)
+            # get() hands out the stored dict itself, so a conflict is only
+            # possible if the session was replaced in the meantime
+            if entry is not None and entry[1] is not session and entry[1]['version'] != session['version']:
+                self.conflicts += 1
+                raise SessionConflict(session_id)
+            session['version'] += 1
+        self._put(session_id, session, now)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def entry_chunks(self, chunk_size=1024):
+        """
+        Generator of lists of (session_id, last_access, session), covering
+        every live session.
+
+        Only the ids are copied up front; sessions are fetched chunk_size at a
+        time, so requests are never blocked for long. Sessions created after
+        the call aren't included.
+        """
+        with self._lock:
+            session_ids = list(self._data)
+        for start in range(0, len(session_ids), chunk_size):
+            with self._lock:
+                chunk = [(session_id, self._data.get(session_id)) for session_id in session_ids[start:start + chunk_size]]
+            yield [(session_id, entry[0], entry[1]) for session_id, entry in chunk if entry is not None]
+
+    def restore(self, entries):
+        """
+        Put back (session_id, last_access, session) entries saved by entry_chunks(),
+        oldest first. Sessions that have expired since, or whose id is taken,
+        are skipped. Returns the number restored.
+        """
+        cutoff = time.monotonic() - self.ttl
+        restored = 0
+        with self._lock:
+            data = self._data
+            for session_id, last_access, session in entries:
+                if last_access > cutoff and session_id not in data:
+                    data[session_id] = (last_access, session)
+                    restored += 1
+            while len(data) > self.max_entries:
+                data.popitem(last=False)
+                self.evictions += 1
+        return restored
+
+    # The lock is only ever held for a few dict operations, so it is fine to
+    # take it on the event loop instead of hopping to a thread
+    async def aget(self, session_id):
+        return self.get(session_id)
+
+    async def acreate(self, session_id, session):
+        self.create(session_id, session)
+
+    async def asave(self, session_id, session):
+        self.save(session_id, session)
+
+    async def adelete(self, session_id):
+        self.delete(session_id)
+
+    async def acontains(self, session_id):
+        return session_id in self
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, session_id):
+        # Leaves the TTL and LRU order alone, so polling doesn't keep a session alive
+        with self._lock:
+            entry = self._data.get(session_id)
+            return entry is not None and time.monotonic() - entry[0] <= self.ttl
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'conflicts': self.conflicts,
+        }
+
+
+class SQLiteSessionStore(BaseSessionStore):
+    """
+    Store shared by every worker process on one host.
+
+    Each session is one row in a WAL-mode SQLite database (the project's
+    db.sqlite3 by default), written with a single-row upsert. WAL lets readers
+    in other workers proceed while one worker writes, so a verify call can land
+    on any worker. Saves are a compare-and-swap on the version column. Connections
+    are opened lazily per thread and re-opened after a fork.
+    """
+
+    def __init__(self, path=None, table='api_session', ttl=1800, sweep_interval=60, timeout=5):
+        self.path = str(path or settings.DATABASES['default']['NAME'])
+        self.table = table
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.timeout = timeout
+        self._local = threading.local()
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.conflicts = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} ('
+            'session_id TEXT PRIMARY KEY, '
+            'data TEXT NOT NULL, '
+            'version INTEGER NOT NULL DEFAULT 0, '
+            'updated_at REAL NOT NULL)'
+        )
+        try:
+            # Tables created before sessions were versioned
+            conn.execute(f'ALTER TABLE {self.table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_updated_at ON {self.table} (updated_at)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _maybe_sweep(self, conn, now):
+        mono = time.monotonic()
+        if mono - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = mono
+        cursor = conn.execute(f'DELETE FROM {self.table} WHERE updated_at < ?', (now - self.ttl,))
+        self.expirations += cursor.rowcount
+
+    def get(self, session_id):
+        # Wall clock rather than monotonic: the timestamp is shared between processes
+        now = time.time()
+        conn = self._connection()
+        self._maybe_sweep(conn, now)
+        row = conn.execute(
+            f'SELECT data FROM {self.table} WHERE session_id = ? AND updated_at >= ?',
+            (session_id, now - self.ttl),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode_session(row[0])
+
+    def create(self, session_id, session):
+        self._connection().execute(
+            f'INSERT INTO {self.table} (session_id, data, version, updated_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(session_id) DO UPDATE SET '
+            'data = excluded.data, version = excluded.version, updated_at = excluded.updated_at',
+            (session_id, encode_session(session), session['version'], time.time()),
+        )
+
+    def save(self, session_id, session):
+        expected = session['version']
+        session['version'] = expected + 1
+        cursor = self._connection().execute(
+            f'UPDATE {self.table} SET data = ?, version = ?, updated_at = ? WHERE session_id = ? AND version = ?',
+            (encode_session(session), expected + 1, time.time(), session_id, expected),
+        )
+        if cursor.rowcount == 0:
+            session['version'] = expected
+            self.conflicts += 1
+            raise SessionConflict(session_id)
+
+    def delete(self, session_id):
+        self._connection().execute(f'DELETE FROM {self.table} WHERE session_id = ?', (session_id,))
+
+    def __len__(self):
+        return self._connection().execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': 0,
+            'expirations': self.expirations,
+            'conflicts': self.conflicts,
+        }
+
+
+def get_session_store():
+    """Build the session store configured in settings.THISYOU_SESSION_STORE"""
+    config = getattr(settings, 'THISYOU_SESSION_STORE', DEFAULT_SESSION_STORE)
+    backend = import_string(config.get('BACKEND', DEFAULT_SESSION_STORE['BACKEND']))
+    return backend(**config.get('OPTIONS', {}))
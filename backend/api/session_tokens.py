@@ -0,0 +1,80 @@
+"""
+Stateless session tokens.
+
+In stateless mode (THISYOU_STATELESS_SESSIONS = True) the whole session state
+travels with the client as a signed token instead of living in a session store.
+The token is a compact JSON list signed with HMAC-SHA256 keyed on SECRET_KEY
+(via django.core.signing), so any node can serve any request.
+
+Replay protection:
+- every token is bound to its session id and challenge index, so a token can
+  only ever be used to answer the challenge it was issued for
+- tokens carry a timestamp and expire after THISYOU_SESSION_TOKEN_MAX_AGE
+- each worker remembers the (session id, index) pairs it has already consumed
+  in a small LRU, which rejects re-submitting the same token to the same worker.
+  This is best effort only - a replay that lands on a different node is caught
+  by nothing but the expiry above.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import signing
+
+
+TOKEN_SALT = 'thisyou.session_token'
+TOKEN_VERSION = 1
+
+
+class InvalidSessionToken(Exception):
+    pass
+
+
+class SpentTokenCache:
+    """Bounded LRU of (session_id, index) pairs that have already been used"""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key):
+        """Mark key as used, returning False if it was already used"""
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen[key] = None
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return True
+
+
+spent_tokens = SpentTokenCache(getattr(settings, 'THISYOU_SESSION_TOKEN_SPENT_CACHE', 100000))
+
+
+def dumps(session_id, state):
+    """Sign a compact state list for session_id and return the token string"""
+    return signing.dumps([TOKEN_VERSION, session_id] + list(state), salt=TOKEN_SALT, compress=True)
+
+
+def loads(token, session_id=None):
+    """
+    Verify a token and return (session_id, state).
+
+    Raises InvalidSessionToken if the signature is bad, the token has expired,
+    or it was issued for a different session.
+    """
+    if not token:
+        raise InvalidSessionToken('Missing session token')
+    max_age = getattr(settings, 'THISYOU_SESSION_TOKEN_MAX_AGE', 1800)
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=max_age)
+    except signing.SignatureExpired:
+        raise InvalidSessionToken('Session token expired')
+    except signing.BadSignature:
+        raise InvalidSessionToken('Invalid session token')
+    if not isinstance(payload, list) or len(payload) < 2 or payload[0] != TOKEN_VERSION:
+        raise InvalidSessionToken('Invalid session token')
+    if session_id is not None and payload[1] != session_id:
+        raise InvalidSessionToken('Session token does not match session')
+    return payload[1], payload[2:]
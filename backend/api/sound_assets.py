@@ -0,0 +1,184 @@
+"""
+Sound clips for the select_sound challenge.
+
+Every file in the sounds directory is hashed when the process starts and is
+served under a content-addressed name (bloop.mp3 -> bloop.3f2a9c1d4e5b.mp3).
+The challenge templates link to those names, so the URL changes whenever a clip
+does. That lets responses be cached by browsers and CDNs for a year as
+immutable, and each clip is fetched once. The plain names still work, with
+a short max-age, for clients holding an old challenge payload.
+
+Responses never pull audio through Python memory:
+
+- the file is handed to the server as a file object (FileResponse), which
+  WSGI servers with wsgi.file_wrapper such as gunicorn send with sendfile(),
+  including partial responses
+- with ACCEL_REDIRECT set, the response only carries an X-Accel-Redirect
+  header and nginx sends the file (and handles Range) itself
+
+Single byte ranges (Range: bytes=...) are answered with 206 so players can
+seek and browsers can stream. Multiple ranges get the whole file.
+
+Configured via THISYOU_SOUNDS in settings.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+
+DEFAULTS = {
+    # Directory holding the clips; None means api/static/sounds
+    'DIRECTORY': None,
+    # nginx internal location the directory is also exposed at, e.g. '/protected/sounds/'
+    'ACCEL_REDIRECT': None,
+}
+
+URL_PREFIX = '/api/static/sounds/'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=3600'
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THISYOU_SOUNDS', {})}
+
+
+class SoundAsset:
+    __slots__ = ('name', 'path', 'size', 'digest', 'hashed_name', 'content_type', 'etag')
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.size = os.path.getsize(path)
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                sha.update(block)
+        self.digest = sha.hexdigest()[:12]
+        stem, extension = os.path.splitext(name)
+        self.hashed_name = f'{stem}.{self.digest}{extension}'
+        self.content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.etag = f'"{self.digest}"'
+
+
+def scan(directory):
+    """SoundAsset for every regular file in directory, keyed by file name"""
+    assets = {}
+    if directory and os.path.isdir(directory):
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if entry.is_file() and not entry.name.startswith('.'):
+                assets[entry.name] = SoundAsset(entry.name, entry.path)
+    return assets
+
+
+class FileRange:
+    """Read-only view of length bytes of an open file, starting at start"""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+        # The file position is also where sendfile() starts
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    (start, end) for a single-range Range header, inclusive.
+
+    Returns None to serve the whole file (no header, or one we don't handle)
+    and raises ValueError if the range can't be satisfied.
+    """
+    match = RANGE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the last n bytes
+        length = int(last)
+        if not length:
+            raise ValueError('empty suffix range')
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('range not satisfiable')
+    return start, end
+
+
+def serve(request, asset, immutable):
+    """Response for a GET or HEAD of asset"""
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if '*' in etags or any((etag[2:] if etag.startswith('W/') else etag) == asset.etag for etag in etags):
+        response = HttpResponseNotModified()
+        response['ETag'] = asset.etag
+        response['Cache-Control'] = IMMUTABLE if immutable else REVALIDATE
+        return response
+
+    accel_prefix = get_config()['ACCEL_REDIRECT']
+    if accel_prefix:
+        response = HttpResponse(content_type=asset.content_type)
+        response['X-Accel-Redirect'] = accel_prefix + asset.name
+    else:
+        byte_range = None
+        # A stale If-Range means the client's partial copy is outdated
+        if request.headers.get('If-Range', asset.etag) == asset.etag:
+            try:
+                byte_range = parse_range(request.headers.get('Range'), asset.size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{asset.size}'
+                return response
+        f = open(asset.path, 'rb')
+        if byte_range is None:
+            response = FileResponse(f, content_type=asset.content_type)
+        else:
+            start, end = byte_range
+            response = FileResponse(FileRange(f, start, end - start + 1), content_type=asset.content_type, status=206)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{asset.size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = asset.etag
+    response['Cache-Control'] = IMMUTABLE if immutable else REVALIDATE
+    return response
+
+
+def _directory():
+    return get_config()['DIRECTORY'] or os.path.join(os.path.dirname(__file__), 'static', 'sounds')
+
+
+ASSETS = scan(str(_directory()))
+# URL name -> (asset, whether the name is content-addressed)
+BY_URL_NAME = {
+    **{name: (asset, False) for name, asset in ASSETS.items()},
+    **{asset.hashed_name: (asset, True) for asset in ASSETS.values()},
+}
+
+
+def asset_url(url):
+    """Content-addressed URL for a sound URL, or the URL itself if the file isn't there"""
+    if url.startswith(URL_PREFIX):
+        asset = ASSETS.get(url[len(URL_PREFIX):])
+        if asset is not None:
+            return URL_PREFIX + asset.hashed_name
+    return url
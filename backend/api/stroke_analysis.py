@@ -0,0 +1,96 @@
+"""
+Roundness scoring for the draw_circle challenge.
+
+The client uploads the raw stroke as packed int16 (x, y) canvas coordinates.
+A least-squares circle is fitted to the points and the drawing is judged on
+three numbers, all computed with vectorized NumPy operations:
+
+- residual: RMS distance of the points from the fitted circle, relative to
+  its radius (0 is a perfect circle)
+- closure: gap between the first and last point, relative to the radius
+- coverage: fraction of the angular sectors around the center the stroke
+  passes through
+"""
+import numpy as np
+
+from .packed import decode_array
+
+# Longest stroke accepted, in points (32 KB of int16 pairs). The frontend
+# thins its strokes well below this.
+MAX_STROKE_POINTS = 8192
+# Long strokes are evenly downsampled to this many points before fitting
+MAX_FIT_POINTS = 512
+COVERAGE_SECTORS = 36
+
+MIN_POINTS = 8
+MIN_RADIUS = 10.0
+MAX_RESIDUAL = 0.15
+MAX_CLOSURE = 0.5
+MIN_COVERAGE = 0.85
+
+
+def decode_stroke(data):
+    """Decode a base64 stroke into an (n, 2) int16 array of points"""
+    return decode_array(data, np.int16, MAX_STROKE_POINTS, columns=2)
+
+
+def fit_circle(points):
+    """
+    Fit a circle to an (n, 2) array of points.
+
+    Returns a dict with the center, radius, residual, closure and coverage, or
+    None if there are too few points or they don't define a circle.
+    """
+    if len(points) < MIN_POINTS:
+        return None
+    step = -(-len(points) // MAX_FIT_POINTS)
+    pts = points[::step].astype(np.float64)
+    # Work relative to the centroid to keep the normal equations well conditioned
+    origin = pts.mean(axis=0)
+    x = pts[:, 0] - origin[0]
+    y = pts[:, 1] - origin[1]
+
+    # Algebraic least-squares fit of x^2 + y^2 + D*x + E*y + F = 0
+    A = np.column_stack((x, y, np.ones_like(x)))
+    b = -(x * x + y * y)
+    try:
+        D, E, F = np.linalg.solve(A.T @ A, A.T @ b)
+    except np.linalg.LinAlgError:
+        return None
+    cx = -D / 2
+    cy = -E / 2
+    radius_sq = cx * cx + cy * cy - F
+    if not np.isfinite(radius_sq) or radius_sq <= 0:
+        return None
+    radius = float(np.sqrt(radius_sq))
+
+    dx = x - cx
+    dy = y - cy
+    distances = np.hypot(dx, dy)
+    residual = float(np.sqrt(np.mean((distances - radius) ** 2)) / radius)
+
+    first = points[0].astype(np.float64)
+    last = points[-1].astype(np.float64)
+    closure = float(np.hypot(*(last - first)) / radius)
+
+    sectors = ((np.arctan2(dy, dx) + np.pi) * (COVERAGE_SECTORS / (2 * np.pi))).astype(np.intp) % COVERAGE_SECTORS
+    coverage = np.count_nonzero(np.bincount(sectors, minlength=COVERAGE_SECTORS)) / COVERAGE_SECTORS
+
+    return {
+        'center': (float(cx + origin[0]), float(cy + origin[1])),
+        'radius': radius,
+        'residual': residual,
+        'closure': closure,
+        'coverage': float(coverage),
+    }
+
+
+def is_round_enough(fit):
+    """Whether a fit_circle() result passes as a circle"""
+    return (
+        fit is not None
+        and fit['radius'] >= MIN_RADIUS
+        and fit['residual'] <= MAX_RESIDUAL
+        and fit['closure'] <= MAX_CLOSURE
+        and fit['coverage'] >= MIN_COVERAGE
+    )
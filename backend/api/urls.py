@@ -1,9 +1,22 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Under ASGI the session views can run natively on the event loop
+if getattr(settings, 'THISYOU_ASYNC_VIEWS', False):
+    session_views = async_views
+else:
+    session_views = views
 
 urlpatterns = [
-    path('challenges/', views.get_challenges, name='get_challenges'),
-    path('challenges/verify/', views.verify_challenge, name='verify_challenge'),
-    path('session/start/', views.start_session, name='start_session'),
-    path('session/<str:session_id>/complete/', views.complete_session, name='complete_session'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('challenges/', session_views.get_challenges, name='get_challenges'),
+    path('challenges/catalog/', views.challenge_catalog, name='challenge_catalog'),
+    path('challenges/verify/', session_views.verify_challenge, name='verify_challenge'),
+    path('challenges/verify/batch/', views.verify_challenge_batch, name='verify_challenge_batch'),
+    path('stats/', views.stats_view, name='stats'),
+    path('static/sounds/<str:name>', views.sound_asset, name='sound_asset'),
+    path('session/start/', session_views.start_session, name='start_session'),
+    path('session/<str:session_id>/complete/', session_views.complete_session, name='complete_session'),
+    path('session/<str:session_id>/events/', async_views.session_event_stream, name='session_event_stream'),
 ]
@@ -0,0 +1,511 @@
+"""
+Challenge verifiers.
+
+Each challenge type has one Verifier object registered in VERIFIERS. A verifier
+parses and validates the client's attempt_data, then scores it against the
+session and challenge. Dispatch is a single dict lookup on the challenge type,
+and every verifier keeps its own call/timing counters so slow or failing types
+show up individually.
+
+To add a challenge type, subclass Verifier and decorate it with @register.
+Verifiers with heavy = True are run in the offload process pool.
+
+NumPy and the analysis modules built on it are imported the first time an
+attempt or example needs them, not with this module. With offloading on, the
+heavy verifiers only run in the pool workers, so a web worker starts without
+them and only loads them for the first keystroke attempt it scores itself.
+"""
+import functools
+import importlib
+import threading
+import time
+
+from . import lyric_matching, metrics, offload
+from .challenges import LYRICS, thaw
+
+
+class _DeferredModule:
+    """Stand-in for a module that imports it when an attribute is first used"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        # Later lookups find the attribute directly and skip __getattr__
+        setattr(self, attr, value)
+        return value
+
+
+np = _DeferredModule('numpy')
+packed = _DeferredModule('api.packed')
+blink_analysis = _DeferredModule('api.blink_analysis')
+keystroke_analysis = _DeferredModule('api.keystroke_analysis')
+stroke_analysis = _DeferredModule('api.stroke_analysis')
+
+
+class InvalidAttempt(ValueError):
+    """Raised by Verifier.parse() when attempt_data is malformed"""
+
+
+class Verifier:
+    challenge_type = None
+    # Representative attempt_data, used by the bench_verifiers command and to warm
+    # pool workers (heavy verifiers build theirs on first use)
+    example = {}
+    # CPU-heavy verifiers are run in the offload process pool
+    heavy = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.successes = 0
+        self.invalid = 0
+        self.degraded = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def parse(self, attempt_data):
+        """Extract and validate the fields this verifier needs"""
+        return attempt_data
+
+    def score(self, session, challenge, parsed):
+        """Return (success, message) for a parsed attempt"""
+        raise NotImplementedError
+
+    def should_offload(self, attempt_data):
+        """Whether this attempt is worth sending to the process pool"""
+        return self.heavy
+
+    def check(self, session, challenge, attempt_data):
+        """Parse and score an attempt, returning (success, message, invalid)"""
+        try:
+            if not isinstance(attempt_data, dict):
+                raise InvalidAttempt('attempt_data must be an object')
+            success, message = self.score(session, challenge, self.parse(attempt_data))
+            return bool(success), message, False
+        except InvalidAttempt:
+            return False, 'Invalid attempt data. Please try again.', True
+
+    def _offload_args(self, session, challenge, attempt_data):
+        # Only send the worker what it needs; templates aren't picklable
+        return run_verifier, self.challenge_type, {'user_info': session['user_info']}, thaw(challenge), attempt_data
+
+    def _record(self, start, result):
+        # None means offloading failed; fall back to a degraded result, which
+        # is never a pass (or a full pool would be a way around scoring)
+        degraded = result is None
+        if degraded:
+            result = (
+                False,
+                'Verification systems are busy. Attempt could not be analysed.',
+                False,
+            )
+        success, message, invalid = result
+        elapsed = time.perf_counter() - start
+        metrics.verify_duration.observe((self.challenge_type,), elapsed)
+        with self._lock:
+            self.calls += 1
+            self.successes += success
+            self.invalid += invalid
+            self.degraded += degraded
+            self.total_seconds += elapsed
+            if elapsed > self.max_seconds:
+                self.max_seconds = elapsed
+        return success, message, degraded
+
+    def __call__(self, session, challenge, attempt_data):
+        """Verify an attempt, returning (success, message, degraded)"""
+        start = time.perf_counter()
+        pool = offload.get_pool() if self.should_offload(attempt_data) else None
+        if pool is not None:
+            result = pool.run(*self._offload_args(session, challenge, attempt_data))
+        else:
+            result = self.check(session, challenge, attempt_data)
+        return self._record(start, result)
+
+    async def acall(self, session, challenge, attempt_data):
+        """Async version of __call__ that awaits offloaded work"""
+        start = time.perf_counter()
+        pool = offload.get_pool() if self.should_offload(attempt_data) else None
+        if pool is not None:
+            result = await pool.arun(*self._offload_args(session, challenge, attempt_data))
+        else:
+            result = self.check(session, challenge, attempt_data)
+        return self._record(start, result)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'successes': self.successes,
+            'invalid': self.invalid,
+            'degraded': self.degraded,
+            'total_seconds': self.total_seconds,
+            'max_seconds': self.max_seconds,
+        }
+
+
+VERIFIERS = {}
+
+
+def register(cls):
+    """Class decorator adding an instance of a Verifier to VERIFIERS"""
+    VERIFIERS[cls.challenge_type] = cls()
+    return cls
+
+
+def verify_attempt(session, challenge, attempt_data):
+    """
+    Score an attempt at a challenge, returning (success, message, degraded).
+
+    degraded is True when a heavy verifier couldn't run in time and a fallback
+    result was used instead.
+    """
+    verifier = VERIFIERS.get(challenge['type'])
+    if verifier is None:
+        return False, '', False
+    return verifier(session, challenge, attempt_data)
+
+
+async def averify_attempt(session, challenge, attempt_data):
+    """Async version of verify_attempt() for the async views"""
+    verifier = VERIFIERS.get(challenge['type'])
+    if verifier is None:
+        return False, '', False
+    return await verifier.acall(session, challenge, attempt_data)
+
+
+def run_verifier(challenge_type, session, challenge, attempt_data):
+    """Entry point for offloaded verification inside a pool worker"""
+    return VERIFIERS[challenge_type].check(session, challenge, attempt_data)
+
+
+def verifier_stats():
+    """Per challenge type counters for every registered verifier"""
+    return {challenge_type: verifier.stats() for challenge_type, verifier in VERIFIERS.items()}
+
+
+def get_str(attempt_data, key, default=''):
+    value = attempt_data.get(key, default)
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise InvalidAttempt(f'{key} must be a string')
+    return value
+
+
+def get_number(attempt_data, key, default=0):
+    value = attempt_data.get(key, default)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise InvalidAttempt(f'{key} must be a number')
+    return value
+
+
+@register
+class SelectImagesVerifier(Verifier):
+    challenge_type = 'select_images'
+    example = {'selected': [1, 3]}
+
+    def parse(self, attempt_data):
+        selected = attempt_data.get('selected', [])
+        if not isinstance(selected, list):
+            raise InvalidAttempt('selected must be a list')
+        return selected
+
+    def score(self, session, challenge, selected):
+        correct = [img['id'] for img in challenge.get('images', ()) if img.get('has_vibes')]
+        try:
+            success = set(selected) == set(correct)
+        except TypeError:
+            raise InvalidAttempt('selected must contain image ids')
+        message = 'Thank you for your cooperation. That was deeply insufficient.' if not success else 'Verification successful. Proceeding with caution.'
+        return success, message
+
+
+@register
+class ButtonClickVerifier(Verifier):
+    challenge_type = 'button_click'
+    example = {'clicked': True}
+
+    def parse(self, attempt_data):
+        return bool(attempt_data.get('clicked', False))
+
+    def score(self, session, challenge, clicked):
+        return clicked, 'Button click registered. Identity confirmed with moderate certainty.'
+
+
+@register
+class TextInputVerifier(Verifier):
+    challenge_type = 'text_input'
+    example = {'text': 'Benchmark', 'attempts': 1}
+
+    def parse(self, attempt_data):
+        return get_str(attempt_data, 'text').lower().strip(), get_number(attempt_data, 'attempts', 1)
+
+    def score(self, session, challenge, parsed):
+        entered_name, attempts = parsed
+        user_name = (session['user_info'].get('name') or '').lower().strip()
+
+        if challenge.get('attempts_required', 1) == 2:
+            # Succeeds if name matches OR on second attempt
+            name_matches = user_name == entered_name
+            success = name_matches or attempts >= 2
+            if name_matches:
+                message = 'Name verification successful. Please proceed.'
+            elif attempts >= 2:
+                message = 'Name verification complete. Proceeding with caution.'
+            else:
+                message = 'Please try again. System requires additional verification.'
+        else:
+            success = user_name == entered_name
+            message = 'Name verified.' if success else 'Name mismatch detected.'
+        return success, message
+
+
+@register
+class SecurityQuestionVerifier(Verifier):
+    challenge_type = 'security_question'
+    example = {'answer': 'Blue'}
+
+    def parse(self, attempt_data):
+        return get_str(attempt_data, 'answer')
+
+    def score(self, session, challenge, answer):
+        # Always succeeds with any answer
+        return bool(answer), 'Security question answered. Verification status: ambiguous.'
+
+
+def _example_stroke(points=2000, radius=120.0, center=200.0):
+    angles = np.linspace(0, 2 * np.pi, points)
+    stroke = np.column_stack((center + radius * np.cos(angles), center + radius * np.sin(angles)))
+    return packed.encode_array(stroke.round(), np.int16)
+
+
+@register
+class DrawCircleVerifier(Verifier):
+    challenge_type = 'draw_circle'
+    heavy = True
+
+    @functools.cached_property
+    def example(self):
+        return {'circle_data': {'stroke': _example_stroke()}}
+
+    def parse(self, attempt_data):
+        circle_data = attempt_data.get('circle_data') or {}
+        if not isinstance(circle_data, dict):
+            raise InvalidAttempt('circle_data must be an object')
+        stroke = circle_data.get('stroke')
+        try:
+            points = stroke_analysis.decode_stroke(stroke) if stroke else None
+        except packed.PackedDataError as e:
+            raise InvalidAttempt(str(e))
+        return points, bool(attempt_data.get('used_premade', False))
+
+    def score(self, session, challenge, parsed):
+        points, used_premade = parsed
+        # The premade circle is always accepted
+        if used_premade:
+            return True, 'Circle verification complete. Shape analysis: inconclusive.'
+        fit = stroke_analysis.fit_circle(points) if points is not None else None
+        if stroke_analysis.is_round_enough(fit):
+            roundness = max(0, round(100 * (1 - fit['residual'])))
+            return True, f'Circle verification complete. Roundness: {roundness}%. Shape analysis: inconclusive.'
+        return False, 'Circle verification failed. Please attempt to draw a more circular circle.'
+
+
+@register
+class FillLyricsVerifier(Verifier):
+    challenge_type = 'fill_lyrics'
+    example = {'answer': 'fantasy'}
+
+    def parse(self, attempt_data):
+        return get_str(attempt_data, 'answer')
+
+    def score(self, session, challenge, answer):
+        # materialize_challenge() recorded which lyric was asked
+        overrides = session.get('overrides')
+        if overrides is not None and overrides.lyric_index is not None:
+            expected = LYRICS.normalized_answer(overrides.lyric_decade, overrides.lyric_index)
+        else:
+            expected = lyric_matching.normalize_answer(challenge.get('full_answer', ''))
+        success = lyric_matching.matches(answer, expected)
+        message = 'Lyric completion accepted. Cultural verification: pending.' if success else 'Incorrect answer. Please try again.'
+        return success, message
+
+
+@register
+class MatchPersonalityVerifier(Verifier):
+    challenge_type = 'match_personality'
+    example = {'toaster_id': 3}
+
+    def parse(self, attempt_data):
+        return attempt_data.get('toaster_id')
+
+    def score(self, session, challenge, selected_toaster_id):
+        correct_personality = (challenge.get('correct_personality') or '').lower()
+
+        # Find the selected toaster
+        selected_toaster = None
+        for toaster in challenge.get('toasters', ()):
+            if toaster['id'] == selected_toaster_id:
+                selected_toaster = toaster
+                break
+
+        if selected_toaster:
+            selected_personality = selected_toaster.get('personality', '').lower()
+            success = selected_personality == correct_personality
+            message = 'Personality-to-toaster matching complete. Compatibility: questionable.' if success else 'Personality mismatch detected. Please try again.'
+        else:
+            success = False
+            message = 'Invalid selection. Please try again.'
+        return success, message
+
+
+@register
+class SelectSoundVerifier(Verifier):
+    challenge_type = 'select_sound'
+    example = {'sound_id': 2}
+
+    def parse(self, attempt_data):
+        return attempt_data.get('sound_id')
+
+    def score(self, session, challenge, sound_id):
+        # Any sound selection works
+        return sound_id is not None, 'Sound selection registered. Humor verification: subjective.'
+
+
+@register
+class MovingButtonVerifier(Verifier):
+    challenge_type = 'moving_button'
+    example = {'clicked': True}
+
+    def parse(self, attempt_data):
+        return bool(attempt_data.get('clicked', False))
+
+    def score(self, session, challenge, clicked):
+        return clicked, 'Moving button successfully clicked. Agility confirmed.'
+
+
+def _example_eye_signal(samples=300, frame_ms=33):
+    ear = np.full(samples, 0.3)
+    for start in range(40, samples - 10, 60):
+        ear[start:start + 5] = 0.12
+    return packed.encode_array(np.column_stack((ear * blink_analysis.EAR_SCALE, np.full(samples, frame_ms))).round(), np.uint16)
+
+
+@register
+class BlinkCameraVerifier(Verifier):
+    challenge_type = 'blink_camera'
+    heavy = True
+
+    @functools.cached_property
+    def example(self):
+        return {'eye_signal': _example_eye_signal()}
+
+    def should_offload(self, attempt_data):
+        # Manual (button) attempts have nothing to analyse
+        return isinstance(attempt_data, dict) and 'eye_signal' in attempt_data
+
+    def parse(self, attempt_data):
+        eye_signal = attempt_data.get('eye_signal')
+        if eye_signal:
+            try:
+                ear, timestamps = blink_analysis.decode_eye_signal(eye_signal)
+            except packed.PackedDataError as e:
+                raise InvalidAttempt(str(e))
+            # count_blinks() reports 0 for a signal too short to analyse
+            if len(ear) < blink_analysis.MIN_SAMPLES:
+                raise InvalidAttempt('eye_signal is too short')
+            return blink_analysis.count_blinks(ear, timestamps)
+        # No camera: the player counted their own blinks with the manual
+        # button. Nothing backs that number up, so it isn't scored.
+        return None
+
+    def score(self, session, challenge, blink_count):
+        if blink_count is None:
+            return False, 'Blinks could not be measured without a camera. Self-reported blinking: not accepted.'
+        required = challenge.get('required_blinks', 7)
+        # Allow 1 off, but a signal without a single blink never passes
+        success = max(1, required - 1) <= blink_count <= required + 1
+        message = f'Blink count: {blink_count}. Required: {required}. Verification: {"successful" if success else "suspicious"}.'
+        return success, message
+
+
+@register
+class VoiceRecognitionVerifier(Verifier):
+    challenge_type = 'voice_recognition'
+    example = {'phrase': 'this is me'}
+
+    def parse(self, attempt_data):
+        return get_str(attempt_data, 'phrase').lower()
+
+    def score(self, session, challenge, phrase):
+        required = challenge.get('required_phrase', 'this is me').lower()
+        success = required in phrase or len(phrase) > 5  # Lenient
+        return success, 'Voice recognition complete. Audio analysis: inconclusive.'
+
+
+def _example_timeline(text='', hold=None, gap_ms=130):
+    events = []
+    for i, char in enumerate(text):
+        code = keystroke_analysis.key_code(char)
+        events += [(code, gap_ms + i % 7 * 10), (code | keystroke_analysis.KEY_UP, 60)]
+    if hold is not None:
+        code = keystroke_analysis.key_code(hold[0])
+        repeats = int(hold[1] * 1000 / 33)
+        events += [(code, 0)] + [(code, 33)] * repeats + [(code | keystroke_analysis.KEY_UP, 33)]
+    events.append((0, 0))
+    return packed.encode_array(events, np.uint16)
+
+
+def parse_timeline(attempt_data):
+    try:
+        return keystroke_analysis.decode_timeline(attempt_data.get('events'))
+    except packed.PackedDataError as e:
+        raise InvalidAttempt(str(e))
+
+
+@register
+class HoldKeyVerifier(Verifier):
+    challenge_type = 'hold_key'
+
+    @functools.cached_property
+    def example(self):
+        return {'events': _example_timeline(hold=('space', 3.2))}
+
+    def parse(self, attempt_data):
+        return parse_timeline(attempt_data)
+
+    def score(self, session, challenge, events):
+        try:
+            key = keystroke_analysis.key_code(challenge.get('key', 'space'))
+        except keystroke_analysis.TimelineError:
+            return False, 'Key hold verification unavailable.'
+        duration = round(keystroke_analysis.analyze_timeline(events, hold_key=key)['hold_ms'] / 1000, 1)
+        required = challenge.get('duration', 3)
+        success = duration >= required
+        message = f'Key hold duration: {duration}s. Commitment level: {"adequate" if success else "insufficient"}.'
+        return success, message
+
+
+@register
+class TypeSequenceVerifier(Verifier):
+    challenge_type = 'type_sequence'
+
+    @functools.cached_property
+    def example(self):
+        return {'events': _example_timeline('abcdefghijklmnopqrstuvwxyz')}
+
+    def parse(self, attempt_data):
+        return keystroke_analysis.analyze_timeline(parse_timeline(attempt_data))
+
+    def score(self, session, challenge, analysis):
+        required = challenge.get('sequence', 'abcdefghijklmnopqrstuvwxyz').lower().replace(' ', '')
+        if keystroke_analysis.looks_scripted(analysis):
+            return False, 'Alphabet typing verification failed. Keyboard proficiency: suspiciously high.'
+        success = analysis['text'] == required
+        if not success:
+            return False, 'Alphabet typing verification failed. Please type the sequence as shown.'
+        return True, 'Alphabet typing verification complete. Keyboard proficiency: noted.'
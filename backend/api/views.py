@@ -1,556 +1,468 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_GET, require_safe
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-import random
+import hashlib
 import uuid
 import json
-from datetime import datetime
+from . import metrics, sequencing, session_tokens, sound_assets
+from .aggregates import aggregates
+from .events import session_events
+from .results_log import results_log
+from .challenges import (
+    CATALOG,
+    CHALLENGE_TEMPLATES,
+    ChallengeOverrides,
+    get_lyric_decade,
+    materialize_challenge,
+    new_session,
+    thaw,
+)
+from .session_locks import session_lock
+from .session_snapshot import install as install_session_snapshots
+from .session_store import SessionConflict, get_session_store
+from .verifiers import verify_attempt
 
-# In-memory storage for sessions (in production, use a database)
-sessions = {}
+# Session storage backend (see THISYOU_SESSION_STORE in settings)
+sessions = get_session_store()
 
-# Lyrics database by decade (song, lyric with missing word(s), answer)
-LYRICS_BY_DECADE = {
-    2020: [
-        {'song': 'Blinding Lights', 'lyric': 'I been tryna call, I been on my own for long enough', 'missing': 'call', 'full_lyric': 'I been tryna call, I been on my own for long enough'},
-        {'song': 'Watermelon Sugar', 'lyric': 'Tastes like strawberries on a summer evenin\'', 'missing': 'strawberries', 'full_lyric': 'Tastes like strawberries on a summer evenin\''},
-    ],
-    2010: [
-        {'song': 'Someone Like You', 'lyric': 'Never mind, I\'ll find someone like you', 'missing': 'you', 'full_lyric': 'Never mind, I\'ll find someone like you'},
-        {'song': 'Rolling in the Deep', 'lyric': 'We could have had it all, rolling in the deep', 'missing': 'deep', 'full_lyric': 'We could have had it all, rolling in the deep'},
-        {'song': 'Call Me Maybe', 'lyric': 'Hey, I just met you, and this is crazy', 'missing': 'crazy', 'full_lyric': 'Hey, I just met you, and this is crazy'},
-    ],
-    2000: [
-        {'song': 'Hey Ya!', 'lyric': 'Shake it like a Polaroid picture', 'missing': 'Polaroid', 'full_lyric': 'Shake it like a Polaroid picture'},
-        {'song': 'I\'m a Believer', 'lyric': 'I thought love was only true in fairy tales', 'missing': 'fairy', 'full_lyric': 'I thought love was only true in fairy tales'},
-        {'song': 'Complicated', 'lyric': 'Why\'d you have to go and make things so complicated?', 'missing': 'complicated', 'full_lyric': 'Why\'d you have to go and make things so complicated?'},
-    ],
-    1990: [
-        {'song': 'Wonderwall', 'lyric': 'Today is gonna be the day that they\'re gonna throw it back to you', 'missing': 'day', 'full_lyric': 'Today is gonna be the day that they\'re gonna throw it back to you'},
-        {'song': 'Smells Like Teen Spirit', 'lyric': 'Here we are now, entertain us', 'missing': 'entertain', 'full_lyric': 'Here we are now, entertain us'},
-        {'song': 'I Will Always Love You', 'lyric': 'And I will always love you', 'missing': 'always', 'full_lyric': 'And I will always love you'},
-    ],
-    1980: [
-        {'song': 'Billie Jean', 'lyric': 'Billie Jean is not my lover', 'missing': 'lover', 'full_lyric': 'Billie Jean is not my lover'},
-        {'song': 'Sweet Dreams', 'lyric': 'Sweet dreams are made of this', 'missing': 'this', 'full_lyric': 'Sweet dreams are made of this'},
-        {'song': 'Take On Me', 'lyric': 'Take on me, take me on', 'missing': 'on', 'full_lyric': 'Take on me, take me on'},
-    ],
-    1970: [
-        {'song': 'Bohemian Rhapsody', 'lyric': 'Is this the real life? Is this just fantasy?', 'missing': 'fantasy', 'full_lyric': 'Is this the real life? Is this just fantasy?'},
-        {'song': 'Hotel California', 'lyric': 'Welcome to the Hotel California', 'missing': 'California', 'full_lyric': 'Welcome to the Hotel California'},
-        {'song': 'Stairway to Heaven', 'lyric': 'And she\'s buying a stairway to heaven', 'missing': 'heaven', 'full_lyric': 'And she\'s buying a stairway to heaven'},
-    ],
-    1960: [
-        {'song': 'Hey Jude', 'lyric': 'Hey Jude, don\'t be afraid', 'missing': 'afraid', 'full_lyric': 'Hey Jude, don\'t be afraid'},
-        {'song': 'Let It Be', 'lyric': 'Let it be, let it be', 'missing': 'be', 'full_lyric': 'Let it be, let it be'},
-        {'song': 'I Can\'t Get No Satisfaction', 'lyric': 'I can\'t get no satisfaction', 'missing': 'satisfaction', 'full_lyric': 'I can\'t get no satisfaction'},
-    ],
-}
+# When enabled, session state is carried by signed tokens instead of the store
+STATELESS_SESSIONS = getattr(settings, 'THISYOU_STATELESS_SESSIONS', False)
+
+# Carries in-memory sessions across restarts (see THISYOU_SESSION_SNAPSHOT).
+# Installed by start_session_snapshots() from the server entry points.
+session_snapshots = None
+
+def start_session_snapshots():
+    """Restore and keep snapshotting the session store for this server process"""
+    global session_snapshots
+    if session_snapshots is None and not STATELESS_SESSIONS:
+        session_snapshots = install_session_snapshots(sessions)
+
+# The challenge catalog never changes while the process runs, so it is encoded
+# once here and served as-is. Its version doubles as a strong ETag.
+CATALOG_VERSION = hashlib.sha256(json.dumps(thaw(CATALOG), sort_keys=True).encode()).hexdigest()[:16]
+CATALOG_BODY = json.dumps({'version': CATALOG_VERSION, 'challenges': thaw(CATALOG)}, separators=(',', ':')).encode()
+CATALOG_ETAG = f'"{CATALOG_VERSION}"'
+
+def pack_session(session):
+    """Reduce a session to the compact state list carried in a session token"""
+    result_bits = 0
+    for idx, result in enumerate(session['results']):
+        if result['success']:
+            result_bits |= 1 << idx
+    
+    user_info = session['user_info']
+    return [
+        session['current_challenge'],
+        session['confidence_level'],
+        result_bits,
+        len(session['results']),
+        user_info.get('name', ''),
+        user_info.get('age'),
+        user_info.get('personality', ''),
+        # Remember which lyric was picked so every request asks the same one
+        session['overrides'].lyric_index,
+    ]
+
+def unpack_session(state):
+    """Rebuild a session dict from the state list produced by pack_session"""
+    current_challenge, confidence_level, result_bits, result_count, name, age, personality, lyric_index = state
+    session = new_session({'name': name, 'age': age, 'personality': personality})
+    session['current_challenge'] = current_challenge
+    session['confidence_level'] = confidence_level
+    # Not carried by tokens
+    session['started_at'] = None
+    if lyric_index is not None:
+        session['overrides'] = ChallengeOverrides(get_lyric_decade(session['user_info']), lyric_index)
+    
+    sequence = session['sequence']
+    session['results'] = [
+        {'challenge_id': CHALLENGE_TEMPLATES[sequence[idx]]['id'], 'success': bool(result_bits >> idx & 1), 'message': ''}
+        for idx in range(result_count)
+    ]
+    return session
+
+def load_session(session_id, session_token=None):
+    """
+    Look up a session, returning (session_id, session).
+
+    In stateless mode the session is decoded from the signed token instead and
+    session_tokens.InvalidSessionToken is raised if it doesn't verify.
+    """
+    if STATELESS_SESSIONS:
+        session_id, state = session_tokens.loads(session_token, session_id)
+        return session_id, unpack_session(state)
+    session = sessions.get(session_id) if session_id else None
+    return session_id, session
 
-def get_birth_decade(age):
-    """Calculate birth decade from age"""
-    current_year = datetime.now().year
-    birth_year = current_year - int(age) if age else current_year - 25
-    # Round down to nearest decade
-    decade = (birth_year // 10) * 10
-    # Clamp to available decades
-    available_decades = sorted(LYRICS_BY_DECADE.keys())
-    if decade < min(available_decades):
-        return min(available_decades)
-    if decade > max(available_decades):
-        return max(available_decades)
-    # Find closest decade
-    closest = min(available_decades, key=lambda x: abs(x - decade))
-    return closest
+def save_session(session_id, session):
+    """Persist a session, returning the new session token in stateless mode"""
+    if STATELESS_SESSIONS:
+        return session_tokens.dumps(session_id, pack_session(session))
+    sessions.save(session_id, session)
+    return None
 
-def get_lyric_challenge(birth_decade):
-    """Get a random lyric challenge for the given decade"""
-    if birth_decade not in LYRICS_BY_DECADE:
-        birth_decade = 2000  # Default
-    lyrics = LYRICS_BY_DECADE[birth_decade]
-    lyric_data = random.choice(lyrics)
+def record_result(session, challenge, success, message, degraded=False):
+    """
+    Apply a scored attempt to the session and move on to the next challenge.
+
+    Once the verdict can't change any more the remaining challenges are
+    skipped (see api/sequencing.py). Returns the attempt for log_attempts(),
+    which is only called once the session has been saved, so an attempt that
+    ends in a conflict isn't counted twice when the client retries.
+    """
+    attempt = (session['current_challenge'], challenge['id'], success, degraded)
+    session['results'].append({
+        'challenge_id': challenge['id'],
+        'success': success,
+        'message': message,
+    })
     
-    # Create lyric with missing word(s) - replace the missing word with blank
-    lyric_with_blank = lyric_data['lyric'].replace(lyric_data['missing'], '_____')
+    session['confidence_level'] = sequencing.next_confidence(session['confidence_level'], success)
     
-    return {
-        'song': lyric_data['song'],
-        'lyric': lyric_with_blank,
-        'answer': lyric_data['missing'].lower(),
-        'full_answer': lyric_data['missing'],
-    }
+    return attempt + (sequencing.advance(session),)
+
+def log_attempts(session_id, session, attempts):
+    """Write attempts returned by record_result() to the results log and aggregates"""
+    for position, challenge_id, success, degraded, skipped in attempts:
+        results_log.log_attempt(session_id, position, challenge_id, success, degraded)
+        aggregates.record_attempt(challenge_id, success)
+        if skipped:
+            metrics.challenges_skipped.inc((sequencing.decided_verdict(session),), skipped)
 
-# Challenge definitions
-CHALLENGES = {
-    'semi_serious': [
-        {
-            'id': 'click_this_is_me',
-            'type': 'button_click',
-            'title': 'Click "This is me" button',
-            'description': 'Please click the button below to confirm your identity.',
-        },
-        {
-            'id': 'enter_name',
-            'type': 'text_input',
-            'title': 'Enter your name',
-            'description': 'Please enter the name you provided earlier.',
-            'field_name': 'name',
-            'attempts_required': 2,
-        },
-        {
-            'id': 'security_question',
-            'type': 'security_question',
-            'title': 'Answer your security question',
-            'description': 'Please answer the security question you definitely remember setting.',
-            'question': 'What was the name of your first pet\'s favorite color?',
-        },
-    ],
-    'silly': [
-        {
-            'id': 'draw_circle',
-            'type': 'draw_circle',
-            'title': 'Draw a perfect circle',
-            'description': 'Prove you are human by drawing a perfect circle.',
-        },
-        {
-            'id': 'fill_lyrics',
-            'type': 'fill_lyrics',
-            'title': 'Complete the lyric',
-            'description': 'Fill in the missing word(s) from a popular song from your birth decade.',
-            # Will be populated dynamically based on user's birth year
-        },
-        {
-            'id': 'match_toaster',
-            'type': 'match_personality',
-            'title': 'Match your personality to a toaster',
-            'description': 'Select the toaster that best matches your personality.',
-            # Will be populated dynamically with all personality options
-            'toasters': []
-        },
-        {
-            'id': 'funniest_sound',
-            'type': 'select_sound',
-            'title': 'Choose the funniest sound effect',
-            'description': 'Confirm your identity by selecting the funniest sound effect.',
-            'sounds': [
-                {'id': 1, 'name': 'Bloop', 'file': '/api/static/sounds/bloop.mp3'},
-                {'id': 2, 'name': 'Boing', 'file': '/api/static/sounds/boing.mp3'},
-                {'id': 3, 'name': 'Honk', 'file': '/api/static/sounds/honk.mp3'},
-                {'id': 4, 'name': 'Squeak', 'file': '/api/static/sounds/squeak.mp3'},
-            ]
-        },
-        {
-            'id': 'moving_button',
-            'type': 'moving_button',
-            'title': 'Click this button to confirm',
-            'description': 'Please click the button below to confirm your identity.',
-        },
-    ],
-    'physical': [
-        {
-            'id': 'blink_camera',
-            'type': 'blink_camera',
-            'title': 'Blink at the camera once',
-            'description': 'Please blink at your camera exactly 7 times to verify your humanity.',
-            'required_blinks': 1,
-        },
-        {
-            'id': 'say_this_is_me',
-            'type': 'voice_recognition',
-            'title': 'Say "this is me" out loud',
-            'description': 'Please say "this is me" out loud and press continue.',
-            'required_phrase': 'this is me',
-        },
-        {
-            'id': 'hold_spacebar',
-            'type': 'hold_key',
-            'title': 'Hold spacebar to demonstrate commitment',
-            'description': 'Please hold the spacebar key for 3 seconds to demonstrate your commitment.',
-            'key': 'space',
-            'duration': 3,
-        },
-        {
-            'id': 'type_alphabet',
-            'type': 'type_sequence',
-            'title': 'Type the alphabet',
-            'description': 'Please type the alphabet from A to Z to verify your identity.',
-            'sequence': 'abcdefghijklmnopqrstuvwxyz',
-        },
-    ],
+VERDICT_TITLES = {
+    sequencing.VERIFIED: 'Certified Entity',
+    sequencing.PROBABLY: 'Alleged Person',
+    sequencing.SUSPICIOUS: 'Questionable Entity',
+    sequencing.ABSOLUTELY_NOT: 'Impostor Suspect',
 }
 
+def get_verdict(session):
+    """Final verdict for a session, as returned by complete_session"""
+    confidence = session['confidence_level']
+    successes = sum(1 for r in session['results'] if r['success'])
+    total = len(session['results'])
+    
+    verdict = sequencing.verdict_band(confidence, successes == total)
+    title = f'{VERDICT_TITLES[verdict]}: {session["user_info"].get("name", "Unknown")}'
+    
+    result = {
+        'verdict': verdict,
+        'title': title,
+        'confidence_level': confidence,
+        'successes': successes,
+        'total': total,
+    }
+    
+    return result
+
+def record_verdict(session_id, session, result):
+    """Count and log a verdict handed out by complete_session or a finalized batch"""
+    metrics.verdicts.inc((result['verdict'],))
+    aggregates.record_verdict(result['verdict'], result['confidence_level'])
+    results_log.log_run(session_id, session, result)
+
+def claim_completion(session_id):
+    """
+    Whether a session may be completed now.
+
+    Stored sessions are deleted once completed. A stateless session's tokens
+    stay valid, so the first completion is remembered like a spent token and
+    later ones are refused rather than counted again.
+    """
+    return not STATELESS_SESSIONS or session_tokens.spent_tokens.consume((session_id, 'complete'))
+
+def finish_session(session_id, session):
+    """Hand out the verdict for a session and close it"""
+    result = get_verdict(session)
+    record_verdict(session_id, session, result)
+    if not STATELESS_SESSIONS:
+        sessions.delete(session_id)
+    session_events.publish(session_id, 'complete', result, close=True)
+    return result
+
+@require_GET
+def challenge_catalog(request):
+    """Static challenge definitions, pre-encoded and cacheable"""
+    # Clients that pin the version in the URL can cache it forever
+    if request.GET.get('v') == CATALOG_VERSION:
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, max-age=3600'
+    
+    # If-None-Match uses weak comparison, so W/"..." matches too
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if '*' in etags or any((etag[2:] if etag.startswith('W/') else etag) == CATALOG_ETAG for etag in etags):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(CATALOG_BODY, content_type='application/json')
+    response['ETag'] = CATALOG_ETAG
+    response['Cache-Control'] = cache_control
+    return response
+
+@require_safe
+def sound_asset(request, name):
+    """A sound clip, with Range support and immutable caching for hashed names"""
+    found = sound_assets.BY_URL_NAME.get(name)
+    if found is None:
+        raise Http404('Unknown sound')
+    asset, immutable = found
+    return sound_assets.serve(request, asset, immutable)
+
+@require_GET
+def stats_view(request):
+    """Aggregate outcomes across all completed sessions"""
+    return JsonResponse(aggregates.summary())
+
+@require_GET
+def metrics_view(request):
+    """Prometheus metrics for this process"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @api_view(['POST'])
 def start_session(request):
     """Start a new verification session"""
     session_id = str(uuid.uuid4())
     user_info = request.data.get('user_info', {})
+    if not isinstance(user_info, dict):
+        return Response({'error': 'user_info must be an object'}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Include ALL challenges
-    challenge_sequence = []
-    challenge_sequence.extend(CHALLENGES['semi_serious'])
-    challenge_sequence.extend(CHALLENGES['silly'])
-    challenge_sequence.extend(CHALLENGES['physical'])
-    
-    sessions[session_id] = {
-        'user_info': user_info,
-        'challenges': challenge_sequence,
-        'current_challenge': 0,
-        'results': [],
-        'confidence_level': 0,
-    }
+    session = new_session(user_info)
     
     # Populate first challenge if it needs dynamic data
-    first_challenge = challenge_sequence[0] if challenge_sequence else None
-    if first_challenge:
-        # Populate match_personality challenge
-        if first_challenge.get('type') == 'match_personality':
-            user_personality = user_info.get('personality', '')
-            all_personalities = ['Traditional', 'Modern', 'Bold', 'Tech-savvy', 'Quirky', 'Mysterious']
-            toaster_names = {
-                'Traditional': 'Classic White',
-                'Modern': 'Stainless Steel',
-                'Bold': 'Retro Red',
-                'Tech-savvy': 'Smart Toaster',
-                'Quirky': 'Rainbow Toaster',
-                'Mysterious': 'Black Toaster'
-            }
-            
-            toasters = []
-            for idx, personality in enumerate(all_personalities, 1):
-                toasters.append({
-                    'id': idx,
-                    'name': toaster_names.get(personality, personality + ' Toaster'),
-                    'personality': personality
-                })
-            
-            first_challenge['toasters'] = toasters
-            first_challenge['correct_personality'] = user_personality
-        
-        # Populate fill_lyrics challenge
-        elif first_challenge.get('type') == 'fill_lyrics':
-            user_age = user_info.get('age')
-            if user_age:
-                birth_decade = get_birth_decade(user_age)
-                lyric_challenge = get_lyric_challenge(birth_decade)
-                first_challenge['lyric'] = lyric_challenge['lyric']
-                first_challenge['song'] = lyric_challenge['song']
-                first_challenge['answer'] = lyric_challenge['answer']
-                first_challenge['full_answer'] = lyric_challenge['full_answer']
-                first_challenge['description'] = f'Fill in the missing word from "{lyric_challenge["song"]}" (a popular song from the {birth_decade}s).'
+    compact = bool(request.data.get('compact'))
+    first_challenge = materialize_challenge(session, 0, compact) if session['sequence'] else None
     
-    return Response({
+    data = {
         'session_id': session_id,
-        'total_challenges': len(challenge_sequence),
+        'total_challenges': len(session['sequence']),
         'first_challenge': first_challenge,
-    }, status=status.HTTP_200_OK)
+        'catalog_version': CATALOG_VERSION,
+    }
+    if STATELESS_SESSIONS:
+        data['session_token'] = save_session(session_id, session)
+    else:
+        sessions.create(session_id, session)
+    
+    return Response(data, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 def get_challenges(request):
     """Get the current challenge for a session"""
-    session_id = request.query_params.get('session_id')
-    
-    if not session_id or session_id not in sessions:
+    try:
+        session_id, session = load_session(request.query_params.get('session_id'), request.query_params.get('session_token'))
+    except session_tokens.InvalidSessionToken as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if session is None:
         return Response({'error': 'Invalid session'}, status=status.HTTP_400_BAD_REQUEST)
     
-    session = sessions[session_id]
     current_idx = session['current_challenge']
     
-    if current_idx >= len(session['challenges']):
+    if current_idx >= len(session['sequence']):
         return Response({'error': 'All challenges completed'}, status=status.HTTP_400_BAD_REQUEST)
     
-    challenge = session['challenges'][current_idx].copy()
+    # Populate dynamic fields (toasters, lyric) on top of the shared template
+    compact = bool(request.query_params.get('compact'))
+    challenge = materialize_challenge(session, current_idx, compact)
     
-    # Populate match_personality challenge dynamically with all personality options
-    if challenge.get('type') == 'match_personality' and (not challenge.get('toasters') or len(challenge.get('toasters', [])) == 0):
-        user_personality = session['user_info'].get('personality', '')
-        # All personality options from the form
-        all_personalities = ['Traditional', 'Modern', 'Bold', 'Tech-savvy', 'Quirky', 'Mysterious']
-        toaster_names = {
-            'Traditional': 'Classic White',
-            'Modern': 'Stainless Steel',
-            'Bold': 'Retro Red',
-            'Tech-savvy': 'Smart Toaster',
-            'Quirky': 'Rainbow Toaster',
-            'Mysterious': 'Black Toaster'
-        }
-        
-        toasters = []
-        for idx, personality in enumerate(all_personalities, 1):
-            toasters.append({
-                'id': idx,
-                'name': toaster_names.get(personality, personality + ' Toaster'),
-                'personality': personality
-            })
-        
-        challenge['toasters'] = toasters
-        challenge['correct_personality'] = user_personality  # Store the correct answer
-        session['challenges'][current_idx].update(challenge)
+    try:
+        session_token = save_session(session_id, session)
+    except SessionConflict:
+        return Response({'error': 'Session was updated by another request'}, status=status.HTTP_409_CONFLICT)
     
-    # Populate fill_lyrics challenge dynamically based on user's age
-    if challenge.get('type') == 'fill_lyrics' and not challenge.get('lyric'):
-        user_age = session['user_info'].get('age')
-        if user_age:
-            birth_decade = get_birth_decade(user_age)
-            lyric_challenge = get_lyric_challenge(birth_decade)
-            challenge['lyric'] = lyric_challenge['lyric']
-            challenge['song'] = lyric_challenge['song']
-            challenge['answer'] = lyric_challenge['answer']
-            challenge['full_answer'] = lyric_challenge['full_answer']
-            challenge['description'] = f'Fill in the missing word from "{lyric_challenge["song"]}" (a popular song from the {birth_decade}s).'
-            # Update the challenge in the session too
-            session['challenges'][current_idx].update(challenge)
-        else:
-            # Default if no age provided
-            birth_decade = 2000
-            lyric_challenge = get_lyric_challenge(birth_decade)
-            challenge['lyric'] = lyric_challenge['lyric']
-            challenge['song'] = lyric_challenge['song']
-            challenge['answer'] = lyric_challenge['answer']
-            challenge['full_answer'] = lyric_challenge['full_answer']
-            challenge['description'] = f'Fill in the missing word from "{lyric_challenge["song"]}" (a popular song from the {birth_decade}s).'
-            # Update the challenge in the session too
-            session['challenges'][current_idx].update(challenge)
-    
-    return Response({
+    data = {
         'challenge': challenge,
         'challenge_number': current_idx + 1,
-        'total_challenges': len(session['challenges']),
+        'total_challenges': len(session['sequence']),
         'confidence_level': session['confidence_level'],
-    }, status=status.HTTP_200_OK)
+        'catalog_version': CATALOG_VERSION,
+    }
+    if session_token:
+        data['session_token'] = session_token
+    return Response(data, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
 def verify_challenge(request):
-    """Verify a challenge attempt"""
-    session_id = request.data.get('session_id')
+    """
+    Verify a challenge attempt.
+
+    With 'finalize' set, the session is closed and its verdict returned as soon
+    as there is no next challenge, so the client doesn't need to call
+    complete_session.
+    """
     attempt_data = request.data.get('attempt_data', {})
     
-    if not session_id or session_id not in sessions:
-        return Response({'error': 'Invalid session'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    session = sessions[session_id]
-    current_idx = session['current_challenge']
-    
-    if current_idx >= len(session['challenges']):
-        return Response({'error': 'All challenges completed'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    challenge = session['challenges'][current_idx]
-    success = False
-    message = ''
-    
-    # Verify based on challenge type
-    if challenge['type'] == 'select_images':
-        selected = attempt_data.get('selected', [])
-        correct = [img['id'] for img in challenge['images'] if img['has_vibes']]
-        success = set(selected) == set(correct)
-        message = 'Thank you for your cooperation. That was deeply insufficient.' if not success else 'Verification successful. Proceeding with caution.'
-    
-    elif challenge['type'] == 'button_click':
-        success = attempt_data.get('clicked', False)
-        message = 'Button click registered. Identity confirmed with moderate certainty.'
-    
-    elif challenge['type'] == 'text_input':
-        user_name = session['user_info'].get('name', '').lower().strip()
-        entered_name = attempt_data.get('text', '').lower().strip()
-        attempts = attempt_data.get('attempts', 1)
+    # Requests for the same session are handled one at a time
+    with session_lock(request.data.get('session_id')):
+        try:
+            session_id, session = load_session(request.data.get('session_id'), request.data.get('session_token'))
+        except session_tokens.InvalidSessionToken as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if session is None:
+            return Response({'error': 'Invalid session'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if challenge.get('attempts_required', 1) == 2:
-            # Succeeds if name matches OR on second attempt
-            name_matches = user_name == entered_name
-            success = name_matches or attempts >= 2
-            if name_matches:
-                message = 'Name verification successful. Please proceed.'
-            elif attempts >= 2:
-                message = 'Name verification complete. Proceeding with caution.'
-            else:
-                message = 'Please try again. System requires additional verification.'
-        else:
-            success = user_name == entered_name
-            message = 'Name verified.' if success else 'Name mismatch detected.'
-    
-    elif challenge['type'] == 'security_question':
-        # Always succeeds with any answer
-        success = bool(attempt_data.get('answer', ''))
-        message = 'Security question answered. Verification status: ambiguous.'
-    
-    elif challenge['type'] == 'draw_circle':
-        # Check if circle is "perfect" (very lenient)
-        circle_data = attempt_data.get('circle_data', {})
-        success = circle_data.get('is_circle', False) or attempt_data.get('used_premade', False)
-        message = 'Circle verification complete. Shape analysis: inconclusive.' if success else 'Circle verification failed. Please attempt to draw a more circular circle.'
-    
-    elif challenge['type'] == 'fill_lyrics':
-        answer = attempt_data.get('answer', '').lower().strip()
-        correct_answer = challenge.get('answer', '').lower().strip()
-        # Check if answer matches (case-insensitive, allow partial matches)
-        success = answer == correct_answer or correct_answer in answer or answer in correct_answer
-        if not success and len(answer) > 2:
-            # Very lenient fallback - any reasonable answer works
-            success = True
-        message = 'Lyric completion accepted. Cultural verification: pending.' if success else 'Incorrect answer. Please try again.'
-    
-    elif challenge['type'] == 'match_personality':
-        selected_toaster_id = attempt_data.get('toaster_id')
-        correct_personality = challenge.get('correct_personality', '').lower()
+        current_idx = session['current_challenge']
+        
+        if current_idx >= len(session['sequence']):
+            return Response({'error': 'All challenges completed'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        challenge = materialize_challenge(session, current_idx)
+        
+        # A resubmitted attempt arrives after the first one moved the session on
+        challenge_id = request.data.get('challenge_id')
+        if challenge_id is not None and challenge_id != challenge['id']:
+            return Response({'error': 'Challenge already answered'}, status=status.HTTP_409_CONFLICT)
+        
+        # A token can only answer the challenge it was issued for, once. Spent
+        # only now, so a rejected request doesn't use up the token.
+        if STATELESS_SESSIONS and not session_tokens.spent_tokens.consume((session_id, current_idx)):
+            return Response({'error': 'Session token already used'}, status=status.HTTP_409_CONFLICT)
+        
+        success, message, degraded = verify_attempt(session, challenge, attempt_data)
+        attempt = record_result(session, challenge, success, message, degraded)
+        
+        next_challenge = None
+        if session['current_challenge'] < len(session['sequence']):
+            next_challenge = materialize_challenge(session, session['current_challenge'], bool(request.data.get('compact')))
+        
+        finalize = next_challenge is None and bool(request.data.get('finalize')) and claim_completion(session_id)
+        session_token = None
+        if not finalize:
+            try:
+                session_token = save_session(session_id, session)
+            except SessionConflict:
+                return Response({'error': 'Session was updated by another request'}, status=status.HTTP_409_CONFLICT)
+        log_attempts(session_id, session, [attempt])
+        
+        data = {
+            'success': success,
+            'message': message,
+            'degraded': degraded,
+            'confidence_level': session['confidence_level'],
+            'next_challenge': next_challenge,
+            'challenge_number': session['current_challenge'] + 1 if next_challenge else None,
+            'total_challenges': len(session['sequence']),
+            'catalog_version': CATALOG_VERSION,
+        }
+        session_events.publish(session_id, 'result', {'challenge_id': challenge['id'], **data})
+        data['verdict'] = finish_session(session_id, session) if finalize else None
+        if session_token:
+            data['session_token'] = session_token
+        return Response(data, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+def verify_challenge_batch(request):
+    """
+    Verify several challenge attempts in one round trip.
+
+    Expects an ordered list of {'challenge_id': ..., 'attempt_data': {...}} in
+    'attempts'. Attempts are checked in order against the session and
+    processing stops at the first one that isn't for the current challenge.
+    With 'finalize' set, the verdict is computed and the session closed as soon
+    as there is no next challenge (the last one was answered, or the verdict
+    was decided early), like complete_session does.
+    """
+    attempts = request.data.get('attempts', [])
+    if not isinstance(attempts, list):
+        return Response({'error': 'attempts must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    with session_lock(request.data.get('session_id')):
+        try:
+            session_id, session = load_session(request.data.get('session_id'), request.data.get('session_token'))
+        except session_tokens.InvalidSessionToken as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if session is None:
+            return Response({'error': 'Invalid session'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = []
+        applied = []
+        stopped = None
+        for attempt in attempts:
+            current_idx = session['current_challenge']
+            if current_idx >= len(session['sequence']):
+                stopped = 'All challenges completed'
+                break
+        
+            challenge = materialize_challenge(session, current_idx)
+            if not isinstance(attempt, dict) or attempt.get('challenge_id') != challenge['id']:
+                stopped = f'Expected an attempt for {challenge["id"]}'
+                break
         
-        # Find the selected toaster
-        selected_toaster = None
-        for toaster in challenge.get('toasters', []):
-            if toaster['id'] == selected_toaster_id:
-                selected_toaster = toaster
+            # Same single-use rule as verify_challenge
+            if STATELESS_SESSIONS and not session_tokens.spent_tokens.consume((session_id, current_idx)):
+                stopped = 'Session token already used'
                 break
         
-        if selected_toaster:
-            selected_personality = selected_toaster.get('personality', '').lower()
-            success = selected_personality == correct_personality
-            message = 'Personality-to-toaster matching complete. Compatibility: questionable.' if success else 'Personality mismatch detected. Please try again.'
+            success, message, degraded = verify_attempt(session, challenge, attempt.get('attempt_data', {}))
+            applied.append(record_result(session, challenge, success, message, degraded))
+            results.append({
+                'challenge_id': challenge['id'],
+                'success': success,
+                'message': message,
+                'degraded': degraded,
+            })
+        
+        compact = bool(request.data.get('compact'))
+        next_challenge = None
+        if session['current_challenge'] < len(session['sequence']):
+            next_challenge = materialize_challenge(session, session['current_challenge'], compact)
+        
+        data = {
+            'results': results,
+            'stopped': stopped,
+            'confidence_level': session['confidence_level'],
+            'next_challenge': next_challenge,
+            'challenge_number': session['current_challenge'] + 1 if next_challenge else None,
+            'total_challenges': len(session['sequence']),
+            'catalog_version': CATALOG_VERSION,
+            'verdict': None,
+        }
+        
+        if request.data.get('finalize') and next_challenge is None and claim_completion(session_id):
+            log_attempts(session_id, session, applied)
+            data['verdict'] = get_verdict(session)
+            record_verdict(session_id, session, data['verdict'])
+            if not STATELESS_SESSIONS:
+                sessions.delete(session_id)
         else:
-            success = False
-            message = 'Invalid selection. Please try again.'
-    
-    elif challenge['type'] == 'select_sound':
-        # Any sound selection works
-        success = attempt_data.get('sound_id') is not None
-        message = 'Sound selection registered. Humor verification: subjective.'
-    
-    elif challenge['type'] == 'moving_button':
-        success = attempt_data.get('clicked', False)
-        message = 'Moving button successfully clicked. Agility confirmed.'
-    
-    elif challenge['type'] == 'blink_camera':
-        blink_count = attempt_data.get('blink_count', 0)
-        required = challenge.get('required_blinks', 7)
-        success = abs(blink_count - required) <= 1  # Allow 1 off
-        message = f'Blink count: {blink_count}. Required: {required}. Verification: {"successful" if success else "suspicious"}.'
-    
-    elif challenge['type'] == 'voice_recognition':
-        phrase = attempt_data.get('phrase', '').lower()
-        required = challenge.get('required_phrase', 'this is me').lower()
-        success = required in phrase or len(phrase) > 5  # Lenient
-        message = 'Voice recognition complete. Audio analysis: inconclusive.'
-    
-    elif challenge['type'] == 'hold_key':
-        duration = attempt_data.get('duration', 0)
-        required = challenge.get('duration', 3)
-        success = duration >= required
-        message = f'Key hold duration: {duration}s. Commitment level: {"adequate" if success else "insufficient"}.'
-    
-    elif challenge['type'] == 'type_sequence':
-        typed = attempt_data.get('typed', '').lower().replace(' ', '')
-        required = challenge.get('sequence', 'abcdefghijklmnopqrstuvwxyz')
-        success = typed == required or len(typed) >= 20  # Lenient
-        message = 'Alphabet typing verification complete. Keyboard proficiency: noted.'
-    
-    # Update session
-    session['results'].append({
-        'challenge_id': challenge['id'],
-        'success': success,
-        'message': message,
-    })
-    
-    if success:
-        session['confidence_level'] = min(100, session['confidence_level'] + random.randint(15, 25))
-    else:
-        session['confidence_level'] = max(0, session['confidence_level'] - random.randint(5, 15))
-    
-    session['current_challenge'] += 1
-    
-    next_challenge = None
-    if session['current_challenge'] < len(session['challenges']):
-        next_challenge = session['challenges'][session['current_challenge']].copy()
+            try:
+                session_token = save_session(session_id, session)
+            except SessionConflict:
+                return Response({'error': 'Session was updated by another request'}, status=status.HTTP_409_CONFLICT)
+            log_attempts(session_id, session, applied)
+            if session_token:
+                data['session_token'] = session_token
         
-        # Populate match_personality challenge if needed
-        if next_challenge.get('type') == 'match_personality' and (not next_challenge.get('toasters') or len(next_challenge.get('toasters', [])) == 0):
-            user_personality = session['user_info'].get('personality', '')
-            all_personalities = ['Traditional', 'Modern', 'Bold', 'Tech-savvy', 'Quirky', 'Mysterious']
-            toaster_names = {
-                'Traditional': 'Classic White',
-                'Modern': 'Stainless Steel',
-                'Bold': 'Retro Red',
-                'Tech-savvy': 'Smart Toaster',
-                'Quirky': 'Rainbow Toaster',
-                'Mysterious': 'Black Toaster'
-            }
-            
-            toasters = []
-            for idx, personality in enumerate(all_personalities, 1):
-                toasters.append({
-                    'id': idx,
-                    'name': toaster_names.get(personality, personality + ' Toaster'),
-                    'personality': personality
-                })
-            
-            next_challenge['toasters'] = toasters
-            next_challenge['correct_personality'] = user_personality
-            session['challenges'][session['current_challenge']].update(next_challenge)
+        if results:
+            session_events.publish(session_id, 'result', {
+                **results[-1],
+                'confidence_level': data['confidence_level'],
+                'next_challenge': next_challenge,
+                'challenge_number': data['challenge_number'],
+                'total_challenges': data['total_challenges'],
+                'catalog_version': CATALOG_VERSION,
+            })
+        if data['verdict']:
+            session_events.publish(session_id, 'complete', data['verdict'], close=True)
         
-        # Populate fill_lyrics challenge if needed
-        if next_challenge.get('type') == 'fill_lyrics' and not next_challenge.get('lyric'):
-            user_age = session['user_info'].get('age')
-            if user_age:
-                birth_decade = get_birth_decade(user_age)
-                lyric_challenge = get_lyric_challenge(birth_decade)
-                next_challenge['lyric'] = lyric_challenge['lyric']
-                next_challenge['song'] = lyric_challenge['song']
-                next_challenge['answer'] = lyric_challenge['answer']
-                next_challenge['full_answer'] = lyric_challenge['full_answer']
-                next_challenge['description'] = f'Fill in the missing word from "{lyric_challenge["song"]}" (a popular song from the {birth_decade}s).'
-                # Update the challenge in the session too
-                session['challenges'][session['current_challenge']].update(next_challenge)
-            else:
-                # Default if no age provided
-                birth_decade = 2000
-                lyric_challenge = get_lyric_challenge(birth_decade)
-                next_challenge['lyric'] = lyric_challenge['lyric']
-                next_challenge['song'] = lyric_challenge['song']
-                next_challenge['answer'] = lyric_challenge['answer']
-                next_challenge['full_answer'] = lyric_challenge['full_answer']
-                next_challenge['description'] = f'Fill in the missing word from "{lyric_challenge["song"]}" (a popular song from the {birth_decade}s).'
-                # Update the challenge in the session too
-                session['challenges'][session['current_challenge']].update(next_challenge)
-    
-    return Response({
-        'success': success,
-        'message': message,
-        'confidence_level': session['confidence_level'],
-        'next_challenge': next_challenge,
-        'challenge_number': session['current_challenge'] + 1 if next_challenge else None,
-        'total_challenges': len(session['challenges']),
-    }, status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
 def complete_session(request, session_id):
     """Complete a session and get final verdict"""
-    if session_id not in sessions:
+    try:
+        session_id, session = load_session(session_id, request.data.get('session_token'))
+    except session_tokens.InvalidSessionToken as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if session is None:
         return Response({'error': 'Invalid session'}, status=status.HTTP_400_BAD_REQUEST)
+    if not claim_completion(session_id):
+        return Response({'error': 'Session already completed'}, status=status.HTTP_409_CONFLICT)
     
-    session = sessions[session_id]
-    confidence = session['confidence_level']
-    successes = sum(1 for r in session['results'] if r['success'])
-    total = len(session['results'])
-    
-    # Determine verdict
-    if confidence >= 90 and successes == total:
-        verdict = 'Verified'
-        title = f'Certified Entity: {session["user_info"].get("name", "Unknown")}'
-    elif confidence >= 60:
-        verdict = 'Probably You'
-        title = f'Alleged Person: {session["user_info"].get("name", "Unknown")}'
-    elif confidence >= 30:
-        verdict = 'Suspiciously You-Like'
-        title = f'Questionable Entity: {session["user_info"].get("name", "Unknown")}'
-    else:
-        verdict = 'Absolutely Not You'
-        title = f'Impostor Suspect: {session["user_info"].get("name", "Unknown")}'
-    
-    # Clean up session
-    result = {
-        'verdict': verdict,
-        'title': title,
-        'confidence_level': confidence,
-        'successes': successes,
-        'total': total,
-    }
-    
-    del sessions[session_id]
+    result = finish_session(session_id, session)
     
     return Response(result, status=status.HTTP_200_OK)
@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'thisyou.settings')
 
 application = get_asgi_application()
+
+# Spin up the verification process pool before the first request arrives
+from api import offload  # noqa: E402
+offload.start()
+
+# Bring back the sessions that were live at the last shutdown
+from api.views import start_session_snapshots  # noqa: E402
+start_session_snapshots()
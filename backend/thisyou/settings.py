@@ -36,6 +36,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the timings include every other middleware
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -133,3 +135,108 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
 }
+
+# Verification session storage (see api/session_store.py)
+# ttl: seconds a session may sit idle before it is dropped
+# max_entries: hard cap, least recently used sessions are evicted first
+# To share sessions between several worker processes on one host, use
+# 'api.session_store.SQLiteSessionStore' (WAL-mode table in db.sqlite3) instead.
+THISYOU_SESSION_STORE = {
+    'BACKEND': 'api.session_store.InMemorySessionStore',
+    'OPTIONS': {
+        'ttl': 30 * 60,
+        'max_entries': 10000,
+        'sweep_interval': 60,
+    },
+}
+
+# Lyric corpus for the fill_lyrics challenge, memory-mapped and shared by all
+# workers (see api/lyric_corpus.py). Build it with
+# `python manage.py build_lyric_corpus lyrics.jsonl`; while the file doesn't
+# exist the built-in lyrics in api/challenges.py are used.
+THISYOU_LYRICS = {
+    'CORPUS': BASE_DIR / 'data' / 'lyrics.corpus',
+}
+
+# Clips for the select_sound challenge, served under content-hashed names with
+# immutable caching (see api/sound_assets.py). Set ACCEL_REDIRECT to an nginx
+# internal location for DIRECTORY to have nginx send the files instead.
+THISYOU_SOUNDS = {
+    'DIRECTORY': BASE_DIR / 'api' / 'static' / 'sounds',
+    'ACCEL_REDIRECT': None,
+}
+
+# Writes the in-memory session store to PATH at exit and every INTERVAL seconds
+# and reloads it when the server starts (thisyou/wsgi.py or asgi.py, not
+# management commands), so a restart doesn't drop players mid-run (see
+# api/session_snapshot.py). Has no effect with the SQLite store or stateless sessions.
+THISYOU_SESSION_SNAPSHOT = {
+    'ENABLED': True,
+    'PATH': BASE_DIR / 'sessions.snapshot',
+    'INTERVAL': 60,
+}
+
+# Once a session's verdict can't change any more, its remaining challenges are
+# skipped and it ends early with the same verdict (see api/sequencing.py).
+# Clients that send 'finalize' with an attempt get the verdict straight away.
+THISYOU_SEQUENCING = {
+    'EARLY_VERDICT': True,
+}
+
+# Number of locks session ids are hashed onto, so concurrent requests for one
+# session run one at a time (see api/session_locks.py)
+THISYOU_SESSION_LOCK_STRIPES = 1024
+
+# Stateless mode: session state travels with the client as an HMAC-signed
+# token (keyed on SECRET_KEY) instead of being kept in the session store.
+# See api/session_tokens.py.
+THISYOU_STATELESS_SESSIONS = False
+THISYOU_SESSION_TOKEN_MAX_AGE = 30 * 60
+
+# Serve the session views from api/async_views.py. Enable this when running
+# under ASGI (thisyou/asgi.py with uvicorn/daphne); under WSGI the sync views
+# are cheaper.
+THISYOU_ASYNC_VIEWS = False
+
+# Server-sent event streams (GET /api/session/<id>/events/, see api/events.py).
+# BUFFER events per session are kept for Last-Event-ID resume; idle streams get
+# a keep-alive comment every HEARTBEAT seconds. Streams are only served under
+# ASGI; under WSGI the endpoint answers 501.
+THISYOU_EVENTS = {
+    'BUFFER': 32,
+    'HEARTBEAT': 15,
+    'IDLE_TTL': 30 * 60,
+}
+
+# Running aggregates served at /api/stats/ (see api/aggregates.py). With
+# CHECKPOINT on, each worker adds its counts to the api_aggregate table every
+# CHECKPOINT_INTERVAL seconds; off, stats are per process and never written.
+THISYOU_STATS = {
+    'CHECKPOINT': False,
+    'DATABASE': None,  # defaults to DATABASES['default']
+    'CHECKPOINT_INTERVAL': 30,
+}
+
+# Append-only log of every attempt and completed run (see api/results_log.py).
+# Rows are queued in memory and written in batches every FLUSH_INTERVAL seconds,
+# so a crash loses at most that much; past MAX_QUEUE waiting rows new ones are dropped.
+# Off by default since it stores player data; point DATABASE outside the source
+# tree when turning it on.
+THISYOU_RESULTS_LOG = {
+    'ENABLED': False,
+    'DATABASE': None,  # defaults to DATABASES['default']
+    'FLUSH_INTERVAL': 1.0,
+    'BATCH_SIZE': 500,
+    'MAX_QUEUE': 100000,
+}
+
+# Process pool that CPU-heavy challenge verifiers run in (see api/offload.py).
+# Attempts that can't get a worker or don't finish within TIMEOUT seconds get a
+# degraded result (flagged as 'degraded' in the verify response), which counts
+# as a failed attempt.
+THISYOU_OFFLOAD = {
+    'ENABLED': True,
+    'WORKERS': 2,
+    'MAX_PENDING': 64,
+    'TIMEOUT': 0.5,
+}
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import UserInfoForm from './components/UserInfoForm';
 import ChallengeDisplay from './components/ChallengeDisplay';
@@ -20,6 +20,8 @@ function App() {
   const [message, setMessage] = useState(null);
   const [isVerifying, setIsVerifying] = useState(false);
   const [isTransitioning, setIsTransitioning] = useState(false);
+  // Signed session state, only returned when the backend runs in stateless mode
+  const sessionTokenRef = useRef(null);
 
   // Load saved user info on mount
   useEffect(() => {
@@ -44,6 +46,7 @@ function App() {
       });
       
       setSessionId(response.data.session_id);
+      sessionTokenRef.current = response.data.session_token || null;
       setUserInfo(info);
       setTotalChallenges(response.data.total_challenges);
       setCurrentChallenge(response.data.first_challenge);
@@ -69,10 +72,19 @@ function App() {
         `${API_BASE_URL}/challenges/verify/`,
         {
           session_id: sessionId,
+          session_token: sessionTokenRef.current,
+          // Lets the server reject a duplicate submission of the same challenge
+          challenge_id: currentChallenge && currentChallenge.id,
           attempt_data: attemptData,
+          // Close the session and send the verdict with the last answer
+          finalize: true,
         }
       );
 
+      if (response.data.session_token) {
+        sessionTokenRef.current = response.data.session_token;
+      }
+
       setMessage({
         type: response.data.success ? 'success' : 'error',
         text: response.data.message,
@@ -92,11 +104,17 @@ function App() {
           setIsTransitioning(false);
         }, 2000);
       } else {
-        // All challenges completed
+        // All challenges completed, or the verdict was already decided
         setIsTransitioning(true);
         setCurrentChallenge(null);
+        const finalVerdict = response.data.verdict;
         setTimeout(() => {
-          completeSession();
+          if (finalVerdict) {
+            setVerdict(finalVerdict);
+            setGameState('verdict');
+          } else {
+            completeSession();
+          }
         }, 2000);
       }
     } catch (error) {
@@ -109,7 +127,9 @@ function App() {
 
   const completeSession = async () => {
     try {
-      const response = await axios.post(`${API_BASE_URL}/session/${sessionId}/complete/`);
+      const response = await axios.post(`${API_BASE_URL}/session/${sessionId}/complete/`, {
+        session_token: sessionTokenRef.current,
+      });
       setVerdict(response.data);
       setGameState('verdict');
     } catch (error) {
@@ -121,6 +141,7 @@ function App() {
   const restartGame = () => {
     setGameState('info');
     setSessionId(null);
+    sessionTokenRef.current = null;
     // Keep userInfo - it's already saved in localStorage and will be loaded
     setCurrentChallenge(null);
     setChallengeNumber(0);
@@ -1,6 +1,26 @@
 import React, { useState, useRef, useEffect } from 'react';
 import * as faceapi from 'face-api.js';
 
+const EAR_SCALE = 10000;
+const MAX_UPLOAD_SAMPLES = 2048;
+
+// Pack [{ear, t}, ...] as base64 little-endian uint16 (EAR * 10000, ms since previous sample) pairs
+const packEyeSignal = (samples) => {
+  const recent = samples.slice(-MAX_UPLOAD_SAMPLES);
+  const view = new DataView(new ArrayBuffer(recent.length * 4));
+  for (let i = 0; i < recent.length; i++) {
+    const delta = i > 0 ? recent[i].t - recent[i - 1].t : 0;
+    view.setUint16(i * 4, Math.min(65535, Math.round(recent[i].ear * EAR_SCALE)), true);
+    view.setUint16(i * 4 + 2, Math.min(65535, Math.max(0, Math.round(delta))), true);
+  }
+  let binary = '';
+  const bytes = new Uint8Array(view.buffer);
+  for (let i = 0; i < bytes.length; i++) {
+    binary += String.fromCharCode(bytes[i]);
+  }
+  return btoa(binary);
+};
+
 function BlinkCameraChallenge({ challenge, onVerify }) {
   const [blinkCount, setBlinkCount] = useState(0);
   const [isActive, setIsActive] = useState(false);
@@ -15,6 +35,7 @@ function BlinkCameraChallenge({ challenge, onVerify }) {
   const lastBlinkTime = useRef(0);
   const eyesOpenRef = useRef(true);
   const blinkCooldownRef = useRef(0);
+  const eyeSamplesRef = useRef([]);
 
   // Load face-api.js models
   useEffect(() => {
@@ -102,7 +123,7 @@ function BlinkCameraChallenge({ challenge, onVerify }) {
       
     } catch (error) {
       console.error('Error accessing camera:', error);
-      setError('Camera access denied or unavailable. You can still proceed manually.');
+      setError('Camera access denied or unavailable. You can still proceed manually, but self-counted blinks will not pass verification.');
       // Still allow them to proceed with manual button
       setIsActive(true);
     }
@@ -142,6 +163,7 @@ function BlinkCameraChallenge({ challenge, onVerify }) {
           const leftEAR = calculateEAR(leftEye);
           const rightEAR = calculateEAR(rightEye);
           const avgEAR = (leftEAR + rightEAR) / 2;
+          eyeSamplesRef.current.push({ ear: avgEAR, t: performance.now() });
 
           // Threshold for blink detection (adjust as needed)
           const EAR_THRESHOLD = 0.25;
@@ -165,7 +187,7 @@ function BlinkCameraChallenge({ challenge, onVerify }) {
                 setIsComplete(true);
                 setTimeout(() => {
                   stopCamera();
-                  onVerify({ blink_count: newCount });
+                  onVerify(attemptData(newCount));
                 }, 500);
               }
             }
@@ -238,6 +260,16 @@ function BlinkCameraChallenge({ challenge, onVerify }) {
     }
   }, [isActive, modelsLoaded]);
 
+  // Send the raw eye signal when the camera tracked the face, so the server
+  // counts the blinks itself. A manual count is sent otherwise, which the
+  // server doesn't accept as proof
+  const attemptData = (count) => {
+    if (eyeSamplesRef.current.length > 0) {
+      return { eye_signal: packEyeSignal(eyeSamplesRef.current) };
+    }
+    return { blink_count: count };
+  };
+
   const handleBlink = () => {
     if (isComplete) return;
     
@@ -253,7 +285,7 @@ function BlinkCameraChallenge({ challenge, onVerify }) {
       setIsComplete(true);
       setTimeout(() => {
         stopCamera();
-        onVerify({ blink_count: newCount });
+        onVerify(attemptData(newCount));
       }, 500);
     }
   };
@@ -264,7 +296,7 @@ function BlinkCameraChallenge({ challenge, onVerify }) {
     // Allow completion with current blink count
     setIsComplete(true);
     stopCamera();
-    onVerify({ blink_count: blinkCount || challenge.required_blinks });
+    onVerify(attemptData(blinkCount));
   };
 
   return (
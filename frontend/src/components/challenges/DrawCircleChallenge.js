@@ -1,9 +1,31 @@
 import React, { useState, useRef, useEffect } from 'react';
 
+// Upper bound on points sent to the server; longer strokes are thinned evenly
+const MAX_UPLOAD_POINTS = 2048;
+
+// Pack [{x, y}, ...] as base64 little-endian int16 x,y pairs
+const packStroke = (points) => {
+  const step = Math.ceil(points.length / MAX_UPLOAD_POINTS) || 1;
+  const count = Math.ceil(points.length / step);
+  const view = new DataView(new ArrayBuffer(count * 4));
+  for (let i = 0; i < count; i++) {
+    const point = points[i * step];
+    view.setInt16(i * 4, Math.round(point.x), true);
+    view.setInt16(i * 4 + 2, Math.round(point.y), true);
+  }
+  let binary = '';
+  const bytes = new Uint8Array(view.buffer);
+  for (let i = 0; i < bytes.length; i++) {
+    binary += String.fromCharCode(bytes[i]);
+  }
+  return btoa(binary);
+};
+
 function DrawCircleChallenge({ challenge, onVerify }) {
   const canvasRef = useRef(null);
   const [isDrawing, setIsDrawing] = useState(false);
   const [usedPremade, setUsedPremade] = useState(false);
+  const pointsRef = useRef([]);
 
   useEffect(() => {
     const canvas = canvasRef.current;
@@ -19,6 +41,7 @@ function DrawCircleChallenge({ challenge, onVerify }) {
     if (!canvas) return;
     const ctx = canvas.getContext('2d');
     ctx.clearRect(0, 0, canvas.width, canvas.height);
+    pointsRef.current = [];
     setIsDrawing(false);
     setUsedPremade(false);
   };
@@ -41,6 +64,8 @@ function DrawCircleChallenge({ challenge, onVerify }) {
     if (!canvas) return;
     const ctx = canvas.getContext('2d');
     const coords = getCanvasCoordinates(e);
+    // Only the latest stroke is scored
+    pointsRef.current = [coords];
     ctx.beginPath();
     ctx.moveTo(coords.x, coords.y);
   };
@@ -51,6 +76,7 @@ function DrawCircleChallenge({ challenge, onVerify }) {
     if (!canvas) return;
     const ctx = canvas.getContext('2d');
     const coords = getCanvasCoordinates(e);
+    pointsRef.current.push(coords);
     ctx.lineTo(coords.x, coords.y);
     ctx.stroke();
   };
@@ -60,16 +86,9 @@ function DrawCircleChallenge({ challenge, onVerify }) {
   };
 
   const handleFinish = () => {
-    const canvas = canvasRef.current;
-    const imageData = canvas.getContext('2d').getImageData(0, 0, canvas.width, canvas.height);
-    
-    // Very simple circle detection (check if there's any drawing)
-    const hasDrawing = imageData.data.some((pixel, index) => {
-      return index % 4 === 3 && pixel > 0; // Check alpha channel
-    });
-
+    // Roundness is judged server-side from the raw stroke
     onVerify({
-      circle_data: { is_circle: hasDrawing },
+      circle_data: { stroke: packStroke(pointsRef.current) },
       used_premade: usedPremade,
     });
   };
@@ -89,7 +108,7 @@ function DrawCircleChallenge({ challenge, onVerify }) {
     
     setTimeout(() => {
       onVerify({
-        circle_data: { is_circle: true },
+        circle_data: {},
         used_premade: true,
       });
     }, 500);
@@ -1,4 +1,5 @@
 import React, { useState, useEffect, useRef } from 'react';
+import { recordKey, packTimeline } from './keystrokeTimeline';
 
 function HoldKeyChallenge({ challenge, onVerify }) {
   const [isHolding, setIsHolding] = useState(false);
@@ -8,6 +9,7 @@ function HoldKeyChallenge({ challenge, onVerify }) {
   const containerRef = useRef(null);
   const isHoldingRef = useRef(false);
   const completedRef = useRef(false);
+  const timelineRef = useRef([]);
 
   useEffect(() => {
     isHoldingRef.current = isHolding;
@@ -35,6 +37,10 @@ function HoldKeyChallenge({ challenge, onVerify }) {
             e.stopPropagation(); // Stop event from bubbling
           }
           
+          if (isInThisContainer && !completedRef.current) {
+            recordKey(timelineRef.current, e, false);
+          }
+
           // Start holding if not already holding and not completed, and we're in this container
           if (isInThisContainer && !isHoldingRef.current && !completedRef.current) {
             setIsHolding(true);
@@ -51,7 +57,7 @@ function HoldKeyChallenge({ challenge, onVerify }) {
                   isHoldingRef.current = false;
                   // Add delay before calling onVerify to allow key release
                   setTimeout(() => {
-                    onVerify({ duration: newDuration });
+                    onVerify({ events: packTimeline(timelineRef.current) });
                   }, 300);
                   return newDuration;
                 }
@@ -74,6 +80,10 @@ function HoldKeyChallenge({ challenge, onVerify }) {
             e.stopPropagation(); // Stop event from bubbling
           }
           
+          if (isInThisContainer && !completedRef.current) {
+            recordKey(timelineRef.current, e, true);
+          }
+
           if (isInThisContainer && isHoldingRef.current && !completedRef.current) {
             setIsHolding(false);
             if (intervalRef.current) {
@@ -1,4 +1,5 @@
 import React, { useState, useEffect, useRef } from 'react';
+import { recordKey, packTimeline } from './keystrokeTimeline';
 
 function TypeSequenceChallenge({ challenge, onVerify }) {
   const [typed, setTyped] = useState('');
@@ -6,6 +7,7 @@ function TypeSequenceChallenge({ challenge, onVerify }) {
   const [hasStartedTyping, setHasStartedTyping] = useState(false);
   const [canInteract, setCanInteract] = useState(false);
   const inputRef = useRef(null);
+  const timelineRef = useRef([]);
 
   // Delay interaction to prevent spacebar from previous challenge
   useEffect(() => {
@@ -31,6 +33,7 @@ function TypeSequenceChallenge({ challenge, onVerify }) {
     setIsComplete(false);
     setHasStartedTyping(false);
     setCanInteract(false); // Reset interaction state
+    timelineRef.current = [];
     if (inputRef.current) {
       inputRef.current.value = '';
     }
@@ -76,7 +79,7 @@ function TypeSequenceChallenge({ challenge, onVerify }) {
     if (typedClean === sequenceClean && typedClean.length > 0 && typedClean.length === sequenceClean.length) {
       setIsComplete(true);
       setTimeout(() => {
-        onVerify({ typed: typedClean });
+        onVerify({ events: packTimeline(timelineRef.current) });
       }, 500);
     }
   }, [typed, challenge.sequence, onVerify, hasStartedTyping, isComplete]);
@@ -96,12 +99,20 @@ function TypeSequenceChallenge({ challenge, onVerify }) {
       return;
     }
     
+    recordKey(timelineRef.current, e, false);
+
     // Allow spacebar in the input field - don't let other handlers interfere
     if (e.code === 'Space' || e.key === ' ') {
       e.stopPropagation();
     }
   };
 
+  const handleKeyUp = (e) => {
+    if (canInteract) {
+      recordKey(timelineRef.current, e, true);
+    }
+  };
+
   return (
     <div className="typing-container">
       {!canInteract && (
@@ -117,6 +128,7 @@ function TypeSequenceChallenge({ challenge, onVerify }) {
         value={typed}
         onChange={handleChange}
         onKeyDown={handleKeyDown}
+        onKeyUp={handleKeyUp}
         placeholder="Type the alphabet: a b c d e f..."
         disabled={!canInteract}
         style={{ 
@@ -0,0 +1,41 @@
+// Keystroke timelines for the hold_key and type_sequence challenges.
+// Each event is packed as a little-endian uint16 pair:
+// (key code, with 0x8000 set on keyup; ms since the previous event).
+// Code 0 marks the end of the recording.
+
+const MAX_EVENTS = 2048;
+const KEY_UP = 0x8000;
+
+// Lower-case ASCII code for printable keys, 8 for Backspace, 32 for Space
+export const keyCode = (e) => {
+  if (e.key === 'Backspace') return 8;
+  if (e.code === 'Space' || e.key === ' ') return 32;
+  if (e.key && e.key.length === 1) {
+    const code = e.key.toLowerCase().charCodeAt(0);
+    return code < 127 ? code : null;
+  }
+  return null;
+};
+
+export const recordKey = (timeline, e, isUp) => {
+  const code = keyCode(e);
+  if (code === null || timeline.length >= MAX_EVENTS - 1) return;
+  timeline.push({ code: isUp ? code | KEY_UP : code, t: performance.now() });
+};
+
+// Pack the recorded events plus an end marker as base64
+export const packTimeline = (timeline) => {
+  const events = [...timeline, { code: 0, t: performance.now() }];
+  const view = new DataView(new ArrayBuffer(events.length * 4));
+  for (let i = 0; i < events.length; i++) {
+    const delta = i > 0 ? events[i].t - events[i - 1].t : 0;
+    view.setUint16(i * 4, events[i].code, true);
+    view.setUint16(i * 4 + 2, Math.min(65535, Math.max(0, Math.round(delta))), true);
+  }
+  let binary = '';
+  const bytes = new Uint8Array(view.buffer);
+  for (let i = 0; i < bytes.length; i++) {
+    binary += String.fromCharCode(bytes[i]);
+  }
+  return btoa(binary);
+};